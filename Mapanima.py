@@ -3,19 +3,36 @@
 # --- Miguel Guerrero ---
 
 import streamlit as st
-import geopandas as gpd
 import pandas as pd
+import numpy as np
 import zipfile
-import tempfile
 import os
+import hashlib
 import folium
 import requests
-import shutil
-from io import BytesIO
 from streamlit_folium import st_folium
+from mapanima_traslape import CacheLRU, proyectar_dataset, construir_arbol, analizar_traslape
+from mapanima_carga import EXTENSIONES_USUARIO, ArchivoRechazado, leer_capa_usuario
+from mapanima_geojson import (
+    serializar_propiedades, serializar_entidades, ensamblar_coleccion, CapaGeoJsonPreserializada,
+    construir_topologia, ensamblar_topojson, CapaTopoJson
+)
+from mapanima_metricas import REGISTRO, etapa, contar_vertices
+from mapanima_busqueda import IndiceBusqueda
+from mapanima_actualizador import ActualizadorDataset, INTERVALO_ACTUALIZACION, avisar_log
+from mapanima_teselas import TESELAS_DISPONIBLES, generar_teselas, limpiar_teselas, tabla_propiedades, capa_teselas
+from mapanima_datos import (
+    cargar_dataset, leer_ultima_version, leer_atributos_origen, exportar_shapefile_zip, reporte_memoria, construir_indices, filtrar_posiciones,
+    NIVELES_SIMPLIFICACION, TOLERANCIA_POR_DEFECTO, construir_piramide, leer_piramide, leer_derivado
+)
 
 st.set_page_config(page_title="Mapanima - Geovisor Étnico", layout="wide")
 
+# Copy-on-write (por defecto desde pandas 3): las selecciones del dataset compartido son vistas
+# y agregar o reemplazar columnas en ellas nunca modifica el dataset de las demás sesiones
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
 # --- Estilos generales e institucionales ---
 st.markdown("""
     <style>
@@ -164,70 +181,18 @@ if "autenticado" not in st.session_state or not st.session_state["autenticado"]:
     )
     st.stop()
 
+# --- Avisos del cargador y del traslape (mapanima_*) mostrados en la interfaz ---
+def avisar_streamlit(nivel, mensaje):
+    getattr(st, nivel)(mensaje)
+
 # --- Función para descargar y cargar archivos ZIP de shapefiles ---
-@st.cache_data
+# Solo se usa en el primer arranque sin ninguna versión en disco; después la versión vigente
+# la mantiene el actualizador en segundo plano (ver actualizador_dataset más abajo).
 def descargar_y_cargar_zip(url):
     try:
         # Añade un spinner para la carga inicial del ZIP
         with st.spinner("Cargando datos geográficos principales... Esto puede tardar unos segundos."):
-            r = requests.get(url)
-            r.raise_for_status() # Lanza una excepción para errores HTTP (4xx o 5xx)
-            with zipfile.ZipFile(BytesIO(r.content)) as zip_ref:
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    zip_ref.extractall(tmpdir)
-                    shp_path = [os.path.join(tmpdir, f) for f in os.listdir(tmpdir) if f.endswith(".shp")]
-                    if not shp_path:
-                        st.error("❌ Error: No se encontró ningún archivo .shp en el ZIP descargado. Asegúrate de que el ZIP contenga un shapefile válido.")
-                        return None
-                    
-                    gdf = None
-                    try:
-                        gdf = gpd.read_file(shp_path[0])
-                    except Exception as e:
-                        st.warning(f"⚠️ Advertencia: Error al cargar shapefile con encoding predeterminado. Intentando con 'latin1'. (Detalle: {e})")
-                        try:
-                            gdf = gpd.read_file(shp_path[0], encoding='latin1')
-                        except Exception as e_latin1:
-                            st.error(f"❌ Error crítico: No se pudo cargar el shapefile ni con encoding predeterminado ni con 'latin1'. (Detalle: {e_latin1})")
-                            return None
-                    
-                    # --- MEJORA PARA CÁLCULO DE ÁREA PRECISO EN CTM12 ---
-                    if gdf is not None:
-                        # Si no hay CRS, o no es un CRS proyectado, intentar establecer un CRS por defecto si es necesario para el área
-                        # Para CTM12/EPSG:9377 como default para Colombia
-                        if gdf.crs is None and "EPSG:9377" in str(st.secrets.get("DEFAULT_CRS_FOR_AREA", "EPSG:9377")):
-                            st.info("ℹ️ CRS no detectado en el shapefile principal. Asumiendo EPSG:9377 para cálculo de área.")
-                            gdf.set_crs(epsg=9377, allow_override=True, inplace=True)
-
-                        if 'area_ha' not in gdf.columns:
-                            st.warning("⚠️ La columna 'area_ha' no fue encontrada en los datos principales. Calculando el área en hectáreas de los polígonos con reproyección para mayor precisión.")
-                            
-                            gdf_for_area_calc = gdf.copy()
-                            # Reproyectar a EPSG:9377 (CTM12) si no está ya en un CRS proyectado en metros
-                            if gdf_for_area_calc.crs is None or gdf_for_area_calc.crs.is_geographic or (gdf_for_area_calc.crs.is_projected and gdf_for_area_calc.crs.to_epsg() != 9377):
-                                st.info(f"Reproyectando temporalmente a EPSG:9377 para el cálculo de área.")
-                                gdf_for_area_calc = gdf_for_area_calc.to_crs(epsg=9377)
-                            
-                            # Calcular área en m^2 y convertir a hectáreas (1 ha = 10,000 m^2)
-                            gdf['area_ha'] = (gdf_for_area_calc.geometry.area / 10000).round(2) 
-                        else:
-                            # Si 'area_ha' ya existe, asegurarse de que sea numérica y sin NaN
-                            gdf['area_ha'] = pd.to_numeric(gdf['area_ha'], errors='coerce').fillna(0).round(2)
-                    # --- FIN MEJORA PARA CÁLCULO DE ÁREA PRECISO EN CTM12 ---
-
-                    # Asegurarse de que el GeoDataFrame final esté en CRS 4326 para Folium
-                    if gdf is not None and gdf.crs != "EPSG:4326":
-                        st.info("ℹ️ Reproyectando datos a EPSG:4326 para compatibilidad con el mapa.")
-                        gdf = gdf.to_crs(epsg=4326)
-
-                    # Rellenar valores NaN con una cadena vacía y luego convertir todas las columnas no geométricas a tipo string
-                    if gdf is not None:
-                        for col in gdf.columns:
-                            if col != gdf.geometry.name and col != 'area_ha': 
-                                gdf[col] = gdf[col].fillna('').astype(str) 
-
-                    return gdf
-
+            return cargar_dataset(url, avisar=avisar_streamlit, crs_por_defecto=st.secrets.get("DEFAULT_CRS_FOR_AREA", "EPSG:9377"))
     except requests.exceptions.HTTPError as e:
         st.error(f"❌ Error HTTP al descargar el archivo ZIP: {e}. Por favor, verifica la URL y tu conexión a internet.")
         return None
@@ -241,20 +206,210 @@ def descargar_y_cargar_zip(url):
         st.error(f"❌ Error inesperado al cargar el archivo ZIP: {e}. Por favor, contacta al soporte.")
         return None
 
-def onedrive_a_directo(url_onedrive):
-    if "1drv.ms" in url_onedrive:
-        try:
-            r = requests.get(url_onedrive, allow_redirects=True, timeout=10) 
-            r.raise_for_status()
-            return r.url.replace("redir?", "download?").replace("redir=", "download=")
-        except requests.exceptions.RequestException as e:
-            st.error(f"❌ Error al convertir URL de OneDrive a directa: {e}. Asegúrate de que la URL sea válida y accesible.")
-            return url_onedrive 
-    return url_onedrive
+# --- Índices de filtros: se construyen una vez por dataset y se comparten entre sesiones ---
+# max_entries=2: la versión vigente y la anterior (reruns que empezaron antes del cambio)
+@st.cache_resource(max_entries=2, show_spinner=False)
+def indices_filtros(url, huella, _gdf):
+    return construir_indices(_gdf)
+
+# --- Índice de búsqueda por nombre e ID: una vez por versión del dataset ---
+# Opciones que se listan bajo el cuadro de búsqueda (el filtro usa todas las coincidencias)
+MAX_OPCIONES_BUSQUEDA = 50
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def indice_busqueda(url, huella, _gdf):
+    return IndiceBusqueda(_gdf)
+
+# --- Pirámide de geometrías simplificadas: se lee del caché en disco (o se construye) una vez por dataset ---
+@st.cache_resource(max_entries=2, show_spinner=False)
+def piramide_geometrias(url, huella, _gdf):
+    piramide = leer_piramide(url, huella)
+    if piramide is None:
+        piramide = construir_piramide(_gdf)
+    return piramide
+
+# --- Copia del dataset en EPSG:9377 e índice espacial (STRtree) para el traslape ---
+@st.cache_resource(max_entries=2, show_spinner=False)
+def dataset_traslape(url, huella, _gdf):
+    gdf_9377 = leer_derivado(url, huella, "9377")
+    if gdf_9377 is None:
+        gdf_9377 = proyectar_dataset(_gdf)
+    return gdf_9377, construir_arbol(gdf_9377)
+
+# --- Fragmentos: sus widgets solo vuelven a ejecutar su propia sección, no todo el script ---
+@st.fragment
+def mostrar_mapa(m, width, height):
+    # returned_objects=[]: mover o hacer zoom en el mapa no provoca reruns (el visor no usa esos datos)
+    with etapa("transferencia_mapa"):
+        st_folium(m, width=width, height=height, returned_objects=[])
+
+# --- Mapas construidos (LRU acotado en memoria, compartido entre sesiones) ---
+# Se guarda (mapa, contenido de la capa): el tamaño de la entrada es el de la capa, que es lo que pesa
+@st.cache_resource
+def cache_mapas():
+    return CacheLRU(int(st.secrets.get("MB_CACHE_MAPAS", 256)) * 1024 * 1024)
+
+# --- Exportaciones: se generan solo al pulsar el botón y quedan en caché por estado de filtros ---
+@st.cache_resource
+def cache_exportaciones():
+    return CacheLRU(int(st.secrets.get("MB_CACHE_EXPORTACIONES", 256)) * 1024 * 1024)
+
+@st.fragment
+def opciones_descarga(clave, gdf_filtrado, gdf_filtrado_display, cols_to_display_main_viewer, m, url, huella):
+    cache = cache_exportaciones()
+
+    def perezoso(tipo, generar):
+        # Streamlit llama a esta función en otro hilo solo cuando el usuario pulsa el botón
+        def datos():
+            contenido = cache.obtener((clave, tipo))
+            if contenido is None:
+                with etapa(f"exportar_{tipo}", filas=len(gdf_filtrado)) as medicion:
+                    contenido = generar()
+                    medicion["bytes"] = len(contenido)
+                cache.guardar((clave, tipo), contenido)
+            return contenido
+        return datos
+
+    def generar_csv():
+        # --- Cambio: Descargar tabla con nombres largos si la columna cn_ci_display existe ---
+        # Asegurarse de que el CSV de descarga también use los nombres largos si se desea
+        if 'cn_ci_display' in gdf_filtrado_display.columns:
+            # Crear una lista de columnas a exportar, reemplazando 'cn_ci' con 'cn_ci_display' si está presente
+            csv_cols = [col if col != 'cn_ci' else 'cn_ci_display' for col in cols_to_display_main_viewer]
+            return gdf_filtrado_display[csv_cols].to_csv(index=False).encode("utf-8")
+        return gdf_filtrado[cols_to_display_main_viewer].to_csv(index=False).encode("utf-8")
+
+    with st.expander("📥 Opciones de descarga"):
+        st.download_button(
+            label="📅 Descargar shapefile filtrado (.zip)",
+            # El dataset en memoria solo tiene las columnas del visor: el shapefile lleva además
+            # los demás atributos del origen, leídos solo al exportar
+            data=perezoso("shp", lambda: exportar_shapefile_zip(gdf_filtrado, leer_atributos_origen(url, huella))),
+            file_name="territorios_filtrados.zip",
+            mime="application/zip",
+            on_click="ignore"
+        )
+
+        st.download_button(
+            label="🌐 Descargar mapa (HTML)",
+            data=perezoso("html", lambda: m.get_root().render().encode("utf-8")),
+            file_name="mapa_filtrado.html",
+            mime="text/html",
+            on_click="ignore"
+        )
+
+        st.download_button(
+            label="📄 Descargar tabla como CSV",
+            data=perezoso("csv", generar_csv),
+            file_name="resultados_filtrados.csv",
+            mime="text/csv",
+            on_click="ignore"
+        )
+
+# --- Caché de resultados de traslape (LRU acotado en memoria, compartido entre sesiones) ---
+@st.cache_resource
+def cache_traslape():
+    return CacheLRU(int(st.secrets.get("MB_CACHE_TRASLAPE", 512)) * 1024 * 1024)
+
+def procesar_traslape(contenido, nombre, url, gdf_total):
+    """Lee la capa del usuario (directamente de los bytes cargados) y calcula el traslape.
+
+    Devuelve (gdf_usuario, gdf_interseccion, gdf_territorios_afectados) en EPSG:4326, o None si la carga no trae ninguna capa.
+    """
+    try:
+        gdf_usuario = leer_capa_usuario(contenido, nombre=nombre)
+    except ArchivoRechazado as e:
+        st.error(f"❌ {e}")
+        return None
+
+    if gdf_usuario is None:
+        st.error("No se encontró ninguna capa con geometría en el archivo cargado. Asegúrate de que el ZIP contenga un shapefile válido (puede estar dentro de carpetas) o carga un GeoPackage, GeoJSON o KML.")
+        return None
+    if gdf_usuario.crs != "EPSG:4326":
+        st.info("ℹ️ Reproyectando shapefile del usuario a EPSG:4326 para visualización.")
+
+    gdf_total_proj, arbol = dataset_traslape(url, gdf_total.attrs.get("huella"), gdf_total)
+    # Con muchos pares candidatos las intersecciones se reparten en un pool de procesos
+    procesos = int(st.secrets.get("PROCESOS_TRASLAPE", os.cpu_count() or 1))
+    return analizar_traslape(gdf_usuario, gdf_total, gdf_total_proj, arbol, procesos=procesos)
+
+# --- GeoJSON preserializado por territorio (una vez por dataset y nivel de simplificación) ---
+@st.cache_resource(max_entries=2, show_spinner=False)
+def propiedades_geojson(huella, _gdf):
+    return serializar_propiedades(_gdf)
+
+def geometrias_nivel(url, huella, nivel, gdf):
+    return gdf.geometry.values if nivel is None else piramide_geometrias(url, huella, gdf)[nivel].values
+
+# Dos versiones del dataset (la vigente y la que se prepara) por cada nivel, más el original
+@st.cache_resource(max_entries=2 * (len(NIVELES_SIMPLIFICACION) + 1), show_spinner=False)
+def fragmentos_geojson(url, huella, nivel, _gdf):
+    return serializar_entidades(geometrias_nivel(url, huella, nivel, _gdf), propiedades_geojson(huella, _gdf))
+
+# Topología (arcos compartidos y cuantizados) para el modo TopoJSON, también por nivel
+@st.cache_resource(max_entries=2 * (len(NIVELES_SIMPLIFICACION) + 1), show_spinner=False)
+def topologia_geojson(url, huella, nivel, _gdf):
+    return construir_topologia(geometrias_nivel(url, huella, nivel, _gdf))
+
+# --- Teselas vectoriales (MVT): se generan una vez por versión del dataset en static/teselas ---
+def teselas_habilitadas():
+    # Las teselas se sirven desde static/ sin inicio de sesión (ver mapanima_teselas): son opcionales
+    return TESELAS_DISPONIBLES and bool(st.secrets.get("HABILITAR_TESELAS", False))
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def teselas_vectoriales(huella, _gdf):
+    directorio = generar_teselas(_gdf, huella)
+    # Ruta pública con la que Streamlit sirve la carpeta static/ (server.enableStaticServing)
+    base = st.get_option("server.baseUrlPath").strip("/")
+    return "/" + "/".join(p for p in [base, "app/static/teselas", os.path.basename(directorio)] if p)
+
+# --- Dataset vigente y actualización en segundo plano ---
+def preparar_recursos(url, gdf, teselas=False):
+    """Índices y derivados de una versión nueva, construidos antes de publicarla."""
+    huella = gdf.attrs.get("huella")
+    indices_filtros(url, huella, gdf)
+    indice_busqueda(url, huella, gdf)
+    piramide_geometrias(url, huella, gdf)
+    propiedades_geojson(huella, gdf)
+    fragmentos_geojson(url, huella, TOLERANCIA_POR_DEFECTO, gdf)
+    dataset_traslape(url, huella, gdf)
+    # Las teselas de la versión nueva se generan ya (solo se rehacen las de las filas que
+    # cambiaron; se conserva la generación anterior) o, si el modo teselas no está habilitado, se borran
+    if teselas:
+        teselas_vectoriales(huella, gdf)
+    else:
+        limpiar_teselas(mantener=0)
+
+@st.cache_resource(show_spinner=False)
+def actualizador_dataset(url):
+    # Los secretos se leen aquí: el hilo del actualizador no corre dentro de un rerun
+    crs_por_defecto = st.secrets.get("DEFAULT_CRS_FOR_AREA", "EPSG:9377")
+    teselas = teselas_habilitadas()
+    actualizador = ActualizadorDataset(
+        lambda huella: cargar_dataset(url, avisar=avisar_log, crs_por_defecto=crs_por_defecto, huella_vigente=huella),
+        preparar=lambda gdf: preparar_recursos(url, gdf, teselas),
+        intervalo=st.secrets.get("INTERVALO_ACTUALIZACION", INTERVALO_ACTUALIZACION),
+    )
+    # Tras un reinicio se publica enseguida la última versión en disco y el origen se revisa en
+    # segundo plano; solo el primer arranque sin caché espera la descarga. En ambos casos los
+    # índices y derivados se preparan en el hilo del actualizador, no en este rerun
+    gdf = leer_ultima_version(url)
+    if gdf is not None:
+        actualizador.publicar(gdf, preparar_en_fondo=True)
+    else:
+        actualizador.publicar(descargar_y_cargar_zip(url), preparar_en_fondo=True)
+    # Si el primer arranque no pudo cargar nada, el actualizador reintenta enseguida
+    return actualizador.iniciar(revisar_ya=gdf is not None or actualizador.vigente() is None)
 
 # --- Cargar datos principales ---
-url_zip = onedrive_a_directo(st.secrets["URL_ZIP"])
-gdf_total = descargar_y_cargar_zip(url_zip)
+REGISTRO.iniciar_ejecucion()  # Mediciones de este rerun para el panel de métricas
+# URL de origen estable (la de los secretos): la resolución del enlace de OneDrive se hace en
+# el cargador, memorizada, y no en cada rerun
+url_zip = st.secrets["URL_ZIP"]
+actualizador = actualizador_dataset(url_zip)
+# La versión vigente se toma una sola vez: todo este rerun trabaja sobre la misma, aunque el
+# actualizador publique otra mientras tanto (la sesión la verá en su siguiente rerun)
+gdf_total = actualizador.vigente()
 
 # --- Banner superior del visor ya autenticado ---
 if "autenticado" in st.session_state and st.session_state["autenticado"]:
@@ -274,16 +429,14 @@ if "autenticado" in st.session_state and st.session_state["autenticado"]:
         st.subheader("🗺️ Visor de territorios étnicos")
         st.markdown("Filtros, mapa y descarga de información cartográfica según filtros aplicados.")
 
-        for col_name in ['etapa', 'estado_act', 'cn_ci', 'departamen', 'nom_terr', 'id_rtdaf', 'tipologia']:
-            if col_name in gdf_total.columns:
-                gdf_total[col_name] = gdf_total[col_name].astype(str).str.lower().fillna('')
-            else:
-                gdf_total[col_name] = '' 
+        # Las columnas ya vienen normalizadas desde la carga; las opciones de cada filtro
+        # son las llaves (ordenadas) de los índices, calculadas una sola vez por dataset
+        indices = indices_filtros(url_zip, gdf_total.attrs.get("huella"), gdf_total)
         
         st.sidebar.header("🎯 Filtros")
         # --- CAMBIO: placeholders en español para multiselect ---
-        etapa_sel = st.sidebar.multiselect("Filtrar por etapa", sorted(gdf_total['etapa'].unique()), placeholder="Selecciona una o más etapas")
-        estado_sel = st.sidebar.multiselect("Filtrar por estado del caso", sorted(gdf_total['estado_act'].unique()), placeholder="Selecciona uno o más estados")
+        etapa_sel = st.sidebar.multiselect("Filtrar por etapa", list(indices['etapa']), placeholder="Selecciona una o más etapas")
+        estado_sel = st.sidebar.multiselect("Filtrar por estado del caso", list(indices['estado_act']), placeholder="Selecciona uno o más estados")
         
         # --- INICIO DEL CAMBIO PARA 'TIPO DE TERRITORIO' ---
         # 1. Definir el mapeo de códigos a nombres completos
@@ -297,7 +450,7 @@ if "autenticado" in st.session_state and st.session_state["autenticado"]:
 
         # 2. Obtener las opciones únicas de la columna 'cn_ci' y mapearlas a los nombres completos para mostrar al usuario
         #    Usamos .get(code, code) para que si hay un código no mapeado, se muestre el código directamente.
-        opciones_tipo_display = sorted([tipo_territorio_map.get(code, code) for code in gdf_total['cn_ci'].unique()])
+        opciones_tipo_display = sorted([tipo_territorio_map.get(code, code) for code in indices['cn_ci']])
         
         # 3. Mostrar el multiselect con los nombres completos
         tipo_display_sel = st.sidebar.multiselect(
@@ -312,13 +465,22 @@ if "autenticado" in st.session_state and st.session_state["autenticado"]:
         tipo_sel = [reverse_tipo_map.get(display_name, display_name) for display_name in tipo_display_sel]
         # --- FIN DEL CAMBIO PARA 'TIPO DE TERRITORIO' ---
 
-        depto_sel = st.sidebar.multiselect("Filtrar por departamento", sorted(gdf_total['departamen'].unique()), placeholder="Selecciona uno o más departamentos")
-        
-        # --- CAMBIO: placeholder en español para selectbox ---
-        nombre_opciones = sorted(gdf_total['nom_terr'].unique())
-        nombre_seleccionado = st.sidebar.selectbox("🔍 Buscar por nombre (nom_terr)", options=[""] + nombre_opciones, index=0, placeholder="Selecciona un nombre")
+        depto_sel = st.sidebar.multiselect("Filtrar por departamento", list(indices['departamen']), placeholder="Selecciona uno o más departamentos")
         
-        id_buscar = st.sidebar.text_input("🔍 Buscar por ID (id_rtdaf)")
+        # --- Búsqueda única por nombre o ID (sin tildes, por prefijo y tolerante a errores) ---
+        consulta = st.sidebar.text_input(
+            "🔍 Buscar territorio (nombre o ID)", placeholder="Ej.: embera chami, RTDAF-0012",
+            help="No distingue tildes ni mayúsculas y tolera errores de escritura."
+        )
+        posiciones_busqueda = None
+        territorio_elegido = None
+        if consulta:
+            resultados_busqueda = indice_busqueda(url_zip, gdf_total.attrs.get("huella"), gdf_total).buscar(consulta)
+            posiciones_busqueda = [pos for pos, _, _ in resultados_busqueda]
+            territorio_elegido = st.sidebar.selectbox(
+                f"{len(posiciones_busqueda)} coincidencias", [None] + posiciones_busqueda[:MAX_OPCIONES_BUSQUEDA],
+                format_func=lambda pos: "Todas las coincidencias" if pos is None else f"{gdf_total['nom_terr'].iat[pos]} — {gdf_total['id_rtdaf'].iat[pos]}"
+            )
 
         fondos_disponibles = {
             "OpenStreetMap": "OpenStreetMap",
@@ -335,7 +497,16 @@ if "autenticado" in st.session_state and st.session_state["autenticado"]:
 
         st.sidebar.header("⚙️ Rendimiento")
         usar_simplify = st.sidebar.checkbox("Simplificar geometría", value=True)
-        tolerancia = st.sidebar.slider("Nivel de simplificación", 0.00001, 0.001, 0.0001, step=0.00001, format="%.5f")
+        usar_teselas = st.sidebar.checkbox(
+            "Usar teselas vectoriales (vistas nacionales)", value=False, disabled=not teselas_habilitadas(),
+            help="El navegador descarga solo las teselas visibles en lugar de todas las geometrías filtradas."
+        )
+        usar_topojson = st.sidebar.checkbox(
+            "Codificar mapa como TopoJSON (más liviano)", value=False,
+            help="Coordenadas cuantizadas y bordes compartidos entre territorios una sola vez; aplica también al HTML descargado."
+        )
+        # El control se ajusta a los niveles precalculados de la pirámide
+        tolerancia = st.sidebar.select_slider("Nivel de simplificación", options=NIVELES_SIMPLIFICACION, value=TOLERANCIA_POR_DEFECTO, format_func=lambda t: f"{t:.5f}")
 
         if "mostrar_mapa" not in st.session_state:
             st.session_state["mostrar_mapa"] = False
@@ -350,30 +521,29 @@ if "autenticado" in st.session_state and st.session_state["autenticado"]:
                 st.rerun()
 
         if st.session_state["mostrar_mapa"]:
-            gdf_filtrado = gdf_total.copy()
-            
-            if etapa_sel:
-                gdf_filtrado = gdf_filtrado[gdf_filtrado["etapa"].isin(etapa_sel)]
-            if estado_sel:
-                gdf_filtrado = gdf_filtrado[gdf_filtrado["estado_act"].isin(estado_sel)]
-            
-            # --- Importante: Usa tipo_sel (los códigos internos) para el filtrado ---
-            if tipo_sel: 
-                gdf_filtrado = gdf_filtrado[gdf_filtrado["cn_ci"].isin(tipo_sel)]
-            # --- Fin del uso de tipo_sel ---
-
-            if depto_sel:
-                gdf_filtrado = gdf_filtrado[gdf_filtrado["departamen"].isin(depto_sel)]
-            
-            if id_buscar:
-                gdf_filtrado = gdf_filtrado[gdf_filtrado["id_rtdaf"].astype(str).str.contains(id_buscar, case=False, na=False)]
-            
-            if nombre_seleccionado and nombre_seleccionado != "":
-                gdf_filtrado = gdf_filtrado[gdf_filtrado["nom_terr"] == nombre_seleccionado]
-
-            if usar_simplify and not gdf_filtrado.empty:
+            # Las selecciones de la barra lateral se resuelven sobre los índices y solo
+            # se materializan las filas resultantes (sin copiar todo gdf_total)
+            with etapa("filtrado") as medicion:
+                posiciones = filtrar_posiciones(indices, len(gdf_total), {
+                    "etapa": etapa_sel,
+                    "estado_act": estado_sel,
+                    "cn_ci": tipo_sel,  # --- Importante: Usa tipo_sel (los códigos internos) para el filtrado ---
+                    "departamen": depto_sel,
+                })
+                if posiciones_busqueda is not None:
+                    # La búsqueda se combina con los demás filtros como uno más (AND)
+                    elegidas = [territorio_elegido] if territorio_elegido is not None else posiciones_busqueda
+                    posiciones = np.intersect1d(posiciones, np.asarray(elegidas, dtype=np.intp))
+                # Con copy-on-write la selección no copia datos hasta que la sesión agrega columnas
+                gdf_filtrado = gdf_total.iloc[posiciones]
+                medicion["filas"] = len(gdf_filtrado)
+
+            if usar_simplify and not usar_teselas and not gdf_filtrado.empty:
                 st.info(f"Geometrías simplificadas con tolerancia de {tolerancia}")
-                gdf_filtrado["geometry"] = gdf_filtrado["geometry"].simplify(tolerancia, preserve_topology=True)
+                with etapa("simplificacion", filas=len(gdf_filtrado)) as medicion:
+                    piramide = piramide_geometrias(url_zip, gdf_total.attrs.get("huella"), gdf_total)
+                    gdf_filtrado["geometry"] = piramide[tolerancia].loc[gdf_filtrado.index].values
+                    medicion["vertices"] = contar_vertices(gdf_filtrado.geometry.values)
 
             st.subheader("🗺️ Mapa filtrado")
 
@@ -386,42 +556,72 @@ if "autenticado" in st.session_state and st.session_state["autenticado"]:
                 centro_lat = (bounds[1] + bounds[3]) / 2
                 centro_lon = (bounds[0] + bounds[2]) / 2
                 
-                with st.spinner("Generando mapa..."):
-                    m = folium.Map(location=[centro_lat, centro_lon], zoom_start=8, tiles=fondos_disponibles[fondo_seleccionado])
-
-                    def style_function_by_tipo(feature):
-                        tipo = feature["properties"].get("cn_ci", "").lower() 
-                        color_borde = "#228B22" if tipo == "ci" else "#8B4513" 
-                        color_relleno = color_borde 
-                        opacidad_relleno = 0.6 if mostrar_relleno else 0 
-                        return {"fillColor": color_relleno, "color": color_borde, "weight": 1.5, "fillOpacity": opacidad_relleno}
-
-                    folium.GeoJson(
-                        gdf_filtrado,
-                        name="Territorios Étnicos",
-                        style_function=style_function_by_tipo,
-                        tooltip=folium.GeoJsonTooltip(
-                            fields=["id_rtdaf", "nom_terr", "etnia", "departamen", "municipio", "etapa", "estado_act", "tipologia", "area_formateada"],
-                            aliases=["ID:", "Territorio:", "Etnia:", "Departamento:", "Municipio:", "Etapa:", "Estado:", "Tipología:", "Área:"],
-                            localize=True
-                        )
-                    ).add_to(m)
-
-                    m.fit_bounds([[bounds[1], bounds[0]], [bounds[3], bounds[2]]])
-
-                    # --- Cambio: Leyenda actualizada para usar nombres largos (como referencia para la leyenda) ---
-                    leyenda_html = f'''
-                    <div style="position: absolute; bottom: 10px; right: 10px; z-index: 9999;
-                                background-color: white; padding: 10px; border: 1px solid #ccc;
-                                font-size: 14px; box-shadow: 2px 2px 4px rgba(0,0,0,0.1);">
-                        <strong>Leyenda</strong><br>
-                        <i style="background:#228B22; opacity:0.7; width:10px; height:10px; display:inline-block; border:1px solid #228B22;"></i> {tipo_territorio_map.get("ci", "CI")}<br>
-                        <i style="background:#8B4513; opacity:0.7; width:10px; height:10px; display:inline-block; border:1px solid #8B4513;"></i> {tipo_territorio_map.get("cn", "CN")}<br>
-                    </div>
-                    '''
-                    m.get_root().html.add_child(folium.Element(leyenda_html))
+                clave_mapa = (
+                    gdf_total.attrs.get("huella"), tuple(etapa_sel), tuple(estado_sel), tuple(tipo_sel), tuple(depto_sel),
+                    consulta, territorio_elegido, fondo_seleccionado, mostrar_relleno, usar_simplify, tolerancia, usar_teselas, usar_topojson
+                )
 
-                    st_folium(m, width=1200, height=600)
+                # --- Mapa memorizado por selección y estilo, compartido entre sesiones ---
+                # Si nada de lo que afecta al mapa cambió (p. ej. se abrió el expander de descargas), o
+                # otra sesión ya llegó a las mismas filas, se reutiliza el mapa ya construido
+                huella = gdf_total.attrs.get("huella")
+                nivel = tolerancia if usar_simplify else None
+                posiciones_mapa = gdf_total.index.get_indexer(gdf_filtrado.index)
+                modo_mapa = "teselas" if usar_teselas else "topojson" if usar_topojson else "geojson"
+                clave_cache_mapa = (
+                    huella, modo_mapa, None if usar_teselas else nivel, fondo_seleccionado, mostrar_relleno,
+                    hashlib.sha256(posiciones_mapa.tobytes()).hexdigest()
+                )
+                memo_mapa = cache_mapas().obtener(clave_cache_mapa)
+                if memo_mapa is not None:
+                    m = memo_mapa[0]
+                else:
+                    with st.spinner("Generando mapa..."), etapa("construccion_mapa", filas=len(gdf_filtrado)) as medicion:
+                        m = folium.Map(location=[centro_lat, centro_lon], zoom_start=8, tiles=fondos_disponibles[fondo_seleccionado])
+
+                        campos_tooltip = ["id_rtdaf", "nom_terr", "etnia", "departamen", "municipio", "etapa", "estado_act", "tipologia", "area_formateada"]
+                        alias_tooltip = ["ID:", "Territorio:", "Etnia:", "Departamento:", "Municipio:", "Etapa:", "Estado:", "Tipología:", "Área:"]
+
+                        if usar_teselas:
+                            # Modo teselas: las geometrías llegan por teselas .pbf según el zoom y la zona
+                            # visible; los atributos de las filas seleccionadas viajan solo en la página
+                            url_teselas = teselas_vectoriales(huella, gdf_total)
+                            propiedades_json = propiedades_geojson(huella, gdf_total)
+                            propiedades = tabla_propiedades(gdf_filtrado.index, (propiedades_json[i] for i in posiciones_mapa))
+                            capa_teselas(m, url_teselas, propiedades, mostrar_relleno, list(zip(campos_tooltip, alias_tooltip)))
+                            medicion["bytes"] = len(propiedades)
+                            carga_mapa = propiedades
+                        else:
+                            # Cada territorio ya está serializado (por nivel de simplificación): el
+                            # FeatureCollection se arma uniendo los fragmentos de las filas filtradas
+                            if usar_topojson:
+                                # TopoJSON: bordes compartidos una sola vez y coordenadas cuantizadas
+                                topojson = ensamblar_topojson(topologia_geojson(url_zip, huella, nivel, gdf_total), propiedades_geojson(huella, gdf_total), posiciones_mapa)
+                                CapaTopoJson(topojson, list(zip(campos_tooltip, alias_tooltip)), mostrar_relleno).add_to(m)
+                                medicion["bytes"] = len(topojson)
+                                carga_mapa = topojson
+                            else:
+                                coleccion = ensamblar_coleccion(fragmentos_geojson(url_zip, huella, nivel, gdf_total), posiciones_mapa)
+                                CapaGeoJsonPreserializada(coleccion, list(zip(campos_tooltip, alias_tooltip)), mostrar_relleno).add_to(m)
+                                medicion["bytes"] = len(coleccion)
+                                carga_mapa = coleccion
+
+                        m.fit_bounds([[bounds[1], bounds[0]], [bounds[3], bounds[2]]])
+
+                        # --- Cambio: Leyenda actualizada para usar nombres largos (como referencia para la leyenda) ---
+                        leyenda_html = f'''
+                        <div style="position: absolute; bottom: 10px; right: 10px; z-index: 9999;
+                                    background-color: white; padding: 10px; border: 1px solid #ccc;
+                                    font-size: 14px; box-shadow: 2px 2px 4px rgba(0,0,0,0.1);">
+                            <strong>Leyenda</strong><br>
+                            <i style="background:#228B22; opacity:0.7; width:10px; height:10px; display:inline-block; border:1px solid #228B22;"></i> {tipo_territorio_map.get("ci", "CI")}<br>
+                            <i style="background:#8B4513; opacity:0.7; width:10px; height:10px; display:inline-block; border:1px solid #8B4513;"></i> {tipo_territorio_map.get("cn", "CN")}<br>
+                        </div>
+                        '''
+                        m.get_root().html.add_child(folium.Element(leyenda_html))
+                        cache_mapas().guardar(clave_cache_mapa, (m, carga_mapa))
+
+                mostrar_mapa(m, width=1200, height=600)
             else:
                 st.warning("⚠️ No se encontraron territorios que coincidan con los filtros aplicados. Por favor, ajusta tus selecciones.")
 
@@ -434,7 +634,7 @@ if "autenticado" in st.session_state and st.session_state["autenticado"]:
                 cols_to_display_main_viewer = [col for col in cols_to_display_main_viewer if col in gdf_filtrado.columns]
                 
                 # --- Cambio: Mostrar nombres largos en la tabla si es posible y relevante ---
-                gdf_filtrado_display = gdf_filtrado.copy()
+                gdf_filtrado_display = gdf_filtrado.copy(deep=False)
                 if 'cn_ci' in gdf_filtrado_display.columns:
                     gdf_filtrado_display['cn_ci_display'] = gdf_filtrado_display['cn_ci'].apply(lambda x: tipo_territorio_map.get(x, x))
                     if 'cn_ci' in cols_to_display_main_viewer:
@@ -469,198 +669,147 @@ if "autenticado" in st.session_state and st.session_state["autenticado"]:
                     ''',
                     unsafe_allow_html=True
                 )
-                with st.expander("📥 Opciones de descarga"):
-                    with tempfile.TemporaryDirectory() as tmpdir:
-                        gdf_filtrado_for_save = gdf_filtrado.copy()
-                        if gdf_filtrado_for_save.crs is None:
-                            gdf_filtrado_for_save.set_crs(epsg=4326, inplace=True) 
-
-                        shp_base_path = os.path.join(tmpdir, "territorios_filtrados")
-                        gdf_filtrado_for_save.to_file(shp_base_path + ".shp") 
-
-                        zip_output_path = shutil.make_archive(shp_base_path, 'zip', tmpdir)
-                        
-                        with open(zip_output_path, "rb") as f:
-                            st.download_button(
-                                label="📅 Descargar shapefile filtrado (.zip)",
-                                data=f.read(),
-                                file_name="territorios_filtrados.zip",
-                                mime="application/zip"
-                            )
-
-                    html_bytes = m.get_root().render().encode("utf-8")
-                    st.download_button(
-                        label="🌐 Descargar mapa (HTML)",
-                        data=html_bytes,
-                        file_name="mapa_filtrado.html",
-                        mime="text/html"
-                    )
-
-                    # --- Cambio: Descargar tabla con nombres largos si la columna cn_ci_display existe ---
-                    # Asegurarse de que el CSV de descarga también use los nombres largos si se desea
-                    if 'cn_ci_display' in gdf_filtrado_display.columns:
-                        # Crear una lista de columnas a exportar, reemplazando 'cn_ci' con 'cn_ci_display' si está presente
-                        csv_cols = [col if col != 'cn_ci' else 'cn_ci_display' for col in cols_to_display_main_viewer]
-                        csv_data = gdf_filtrado_display[csv_cols].to_csv(index=False).encode("utf-8")
-                    else:
-                        csv_data = gdf_filtrado[cols_to_display_main_viewer].to_csv(index=False).encode("utf-8")
-                    st.download_button(
-                        label="📄 Descargar tabla como CSV",
-                        data=csv_data,
-                        file_name="resultados_filtrados.csv",
-                        mime="text/csv"
-                    )
+                opciones_descarga(clave_mapa, gdf_filtrado, gdf_filtrado_display, cols_to_display_main_viewer, m, url_zip, gdf_total.attrs.get("huella"))
             else:
                 st.info("No hay datos para mostrar en la tabla o descargar con los filtros actuales.")
 
     # --- ANÁLISIS DE TRASLAPE ---
     with tabs[1]:
         st.subheader("📐 Análisis de traslape entre tu shapefile y los territorios étnicos")
-        st.markdown("Carga tu propio shapefile (en formato .zip) para analizar su intersección con los territorios étnicos principales.")
+        st.markdown("Carga tu propio shapefile (en formato .zip) o una capa GeoPackage, GeoJSON o KML para analizar su intersección con los territorios étnicos principales.")
 
-        archivo_zip = st.file_uploader("📂 Carga un shapefile en formato .zip", type=["zip"])
+        archivo_zip = st.file_uploader(
+            "📂 Carga un shapefile en formato .zip, o un archivo .gpkg, .geojson o .kml",
+            type=[extension.lstrip(".") for extension in EXTENSIONES_USUARIO],
+        )
 
         if archivo_zip is not None:
-            with st.spinner("Procesando shapefile del usuario..."):
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    zip_path = os.path.join(tmpdir, "archivo.zip")
-                    with open(zip_path, "wb") as f:
-                        f.write(archivo_zip.read())
-                    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                        zip_ref.extractall(tmpdir)
-                    shp_files = [os.path.join(tmpdir, f) for f in os.listdir(tmpdir) if f.endswith(".shp")]
-
-                    if shp_files:
-                        try:
-                            gdf_usuario = gpd.read_file(shp_files[0])
-                            
-                            if gdf_usuario.crs != "EPSG:4326":
-                                st.info("ℹ️ Reproyectando shapefile del usuario a EPSG:4326 para visualización.")
-                                gdf_usuario = gdf_usuario.to_crs(epsg=4326)
-
-                            if gdf_total is None:
-                                st.error("❌ Los datos principales del visor no se cargaron, no se puede realizar el análisis de traslape. Por favor, verifica la URL de los datos principales.")
-                                st.stop() 
-                            
-                            gdf_total_para_merge = gdf_total[['id_rtdaf', 'area_ha']].copy()
-                            gdf_total_para_merge.rename(columns={'area_ha': 'area_original_ha'}, inplace=True)
-                            
-                            gdf_interseccion = gpd.overlay(gdf_usuario, gdf_total, how="intersection")
-
-                            if not gdf_interseccion.empty:
-                                st.info("ℹ️ Reproyectando temporalmente la intersección a EPSG:9377 para cálculo preciso de área.")
-                                gdf_interseccion_proj = gdf_interseccion.to_crs(epsg=9377) 
-                                gdf_interseccion["area_traslape_ha"] = (gdf_interseccion_proj.geometry.area / 10000).round(2)
-
-                                gdf_interseccion['id_rtdaf_str'] = gdf_interseccion['id_rtdaf'].astype(str)
-                                gdf_total_para_merge['id_rtdaf_str'] = gdf_total_para_merge['id_rtdaf'].astype(str)
-
-                                gdf_interseccion = pd.merge(
-                                    gdf_interseccion,
-                                    gdf_total_para_merge[['id_rtdaf_str', 'area_original_ha']], 
-                                    on='id_rtdaf_str', 
-                                    how='left'
-                                )
-                                gdf_interseccion.drop(columns=['id_rtdaf_str'], inplace=True)
-
-
-                                epsilon = 1e-9 
-                                gdf_interseccion['porc_traslape'] = (
-                                    (gdf_interseccion['area_traslape_ha'] / (gdf_interseccion['area_original_ha'] + epsilon)) * 100
-                                ).round(2).fillna(0) 
-                                gdf_interseccion['porc_traslape_str'] = gdf_interseccion['porc_traslape'].astype(str) + '%'
-
-                                st.success(f"🔍 Se encontraron {len(gdf_interseccion)} intersecciones.")
-
-                                # --- CAMBIO: Centrar el mapa directamente en la intersección ---
-                                inter_bounds = gdf_interseccion.total_bounds 
-                                
-                                m_inter = folium.Map(
-                                    location=[(inter_bounds[1] + inter_bounds[3]) / 2, (inter_bounds[0] + inter_bounds[2]) / 2],
-                                    zoom_start=12, # Un zoom inicial más cercano para el área de traslape
-                                    tiles="CartoDB positron"
-                                )
-                                
-                                folium.GeoJson(
-                                    gdf_usuario, 
-                                    name="Shapefile del usuario",
-                                    style_function=lambda x: {"fillColor": "gray", "color": "gray", "weight": 1, "fillOpacity": 0.3}
-                                ).add_to(m_inter)
-
-                                ids_con_traslape = gdf_interseccion['id_rtdaf'].unique()
-                                gdf_territorios_afectados = gdf_total[gdf_total['id_rtdaf'].astype(str).isin(ids_con_traslape.astype(str))]
-
-                                folium.GeoJson(
-                                    gdf_territorios_afectados,
-                                    name="Territorios étnicos afectados",
-                                    style_function=lambda x: {
-                                        "fillColor": "#346b34", 
-                                        "color": "#346b34",
-                                        "weight": 2, 
-                                        "fillOpacity": 0.1 
-                                    },
-                                    tooltip=folium.GeoJsonTooltip(
-                                        fields=["nom_terr", "etnia", "area_ha"], 
-                                        aliases=["Territorio:", "Etnia:", "Área Original (ha):"]
-                                    )
-                                ).add_to(m_inter)
-
-                                folium.GeoJson(
-                                    gdf_interseccion,
-                                    name="Áreas de traslape",
-                                    style_function=lambda x: {"fillColor": "red", "color": "red", "weight": 1.5, "fillOpacity": 0.7},
-                                    tooltip=folium.GeoJsonTooltip(
-                                        fields=["nom_terr", "etnia", "area_traslape_ha", "porc_traslape_str"],
-                                        aliases=["Territorio:", "Etnia:", "Área traslapada (ha):", "Porcentaje traslapado:"],
-                                        localize=True
-                                    )
-                                ).add_to(m_inter)
-                                
-                                folium.LayerControl().add_to(m_inter)
-
-                                # Ajustar el mapa a los límites de la intersección (esto hará el zoom deseado)
-                                m_inter.fit_bounds([[inter_bounds[1], inter_bounds[0]], [inter_bounds[3], inter_bounds[2]]])
-
-                                st_folium(m_inter, width=1100, height=600)
-
-                                st.markdown("### 📋 Tabla de intersección")
-                                # --- Cambio: Mostrar nombres largos en la tabla si es posible y relevante para traslape ---
-                                gdf_interseccion_display = gdf_interseccion.copy()
-                                if 'cn_ci' in gdf_interseccion_display.columns:
-                                    gdf_interseccion_display['cn_ci_display'] = gdf_interseccion_display['cn_ci'].apply(lambda x: tipo_territorio_map.get(x, x))
-                                
-                                # Definir las columnas a mostrar, incluyendo 'cn_ci_display' si existe
-                                cols_to_display_interseccion = [
-                                    "id_rtdaf", 
-                                    "nom_terr",
-                                    "etnia",
-                                    "departamen",
-                                    "municipio",
-                                    "area_original_ha",
-                                    "area_traslape_ha",
-                                    "porc_traslape_str"
-                                ]
-                                # Si la columna 'cn_ci' está en el original y tenemos su versión display, la añadimos/reemplazamos
-                                if 'cn_ci' in gdf_interseccion_display.columns:
-                                    if 'cn_ci' in cols_to_display_interseccion:
-                                        cols_to_display_interseccion[cols_to_display_interseccion.index('cn_ci')] = 'cn_ci_display'
-                                    else:
-                                        cols_to_display_interseccion.append('cn_ci_display')
-                                
-                                # Filtrar solo las columnas que realmente existen en el DataFrame
-                                final_cols_for_table_interseccion = [col for col in cols_to_display_interseccion if col in gdf_interseccion_display.columns and col != gdf_interseccion_display.geometry.name]
-
-                                st.dataframe(gdf_interseccion_display[final_cols_for_table_interseccion])
-
-                                csv_inter = gdf_interseccion_display[final_cols_for_table_interseccion].to_csv(index=False).encode("utf-8")
-                                st.download_button("💾 Descargar resultados de intersección como CSV", csv_inter, "intersecciones.csv", "text/csv")
-                            else:
-                                st.warning("No se encontraron intersecciones entre tu shapefile y los territorios cargados.")
-                        except Exception as e:
-                            st.error(f"❌ Error al procesar el shapefile del usuario o al realizar el análisis de traslape: {e}")
-                            st.exception(e) 
-                    else:
-                        st.error("No se encontró ningún archivo .shp dentro del ZIP cargado. Asegúrate de que el ZIP contenga un shapefile válido.")
+            if gdf_total is None:
+                st.error("❌ Los datos principales del visor no se cargaron, no se puede realizar el análisis de traslape. Por favor, verifica la URL de los datos principales.")
+                st.stop() 
+
+            # Resultados en caché por contenido del ZIP + versión del dataset: los reruns y las
+            # cargas repetidas del mismo archivo no vuelven a leer ni a intersectar nada
+            contenido_zip = archivo_zip.getvalue()
+            clave_traslape = (hashlib.sha256(contenido_zip).hexdigest(), gdf_total.attrs.get("huella"))
+            resultado_traslape = cache_traslape().obtener(clave_traslape)
+
+            if resultado_traslape is None:
+                with st.spinner("Procesando shapefile del usuario..."):
+                    try:
+                        with etapa("traslape", bytes=len(contenido_zip)) as medicion:
+                            resultado_traslape = procesar_traslape(contenido_zip, archivo_zip.name, url_zip, gdf_total)
+                            if resultado_traslape is not None:
+                                medicion["filas"] = len(resultado_traslape[1])
+                    except Exception as e:
+                        st.error(f"❌ Error al procesar el shapefile del usuario o al realizar el análisis de traslape: {e}")
+                        st.exception(e) 
+                if resultado_traslape is not None:
+                    cache_traslape().guardar(clave_traslape, resultado_traslape)
+
+            if resultado_traslape is not None:
+                gdf_usuario, gdf_interseccion, gdf_territorios_afectados = resultado_traslape
+                if not gdf_interseccion.empty:
+                    st.success(f"🔍 Se encontraron {len(gdf_interseccion)} intersecciones.")
+
+                    # --- CAMBIO: Centrar el mapa directamente en la intersección ---
+                    inter_bounds = gdf_interseccion.total_bounds 
+
+                    m_inter = folium.Map(
+                        location=[(inter_bounds[1] + inter_bounds[3]) / 2, (inter_bounds[0] + inter_bounds[2]) / 2],
+                        zoom_start=12, # Un zoom inicial más cercano para el área de traslape
+                        tiles="CartoDB positron"
+                    )
+
+                    folium.GeoJson(
+                        gdf_usuario, 
+                        name="Shapefile del usuario",
+                        style_function=lambda x: {"fillColor": "gray", "color": "gray", "weight": 1, "fillOpacity": 0.3}
+                    ).add_to(m_inter)
+
+                    folium.GeoJson(
+                        gdf_territorios_afectados,
+                        name="Territorios étnicos afectados",
+                        style_function=lambda x: {
+                            "fillColor": "#346b34", 
+                            "color": "#346b34",
+                            "weight": 2, 
+                            "fillOpacity": 0.1 
+                        },
+                        tooltip=folium.GeoJsonTooltip(
+                            fields=["nom_terr", "etnia", "area_ha"], 
+                            aliases=["Territorio:", "Etnia:", "Área Original (ha):"]
+                        )
+                    ).add_to(m_inter)
+
+                    folium.GeoJson(
+                        gdf_interseccion,
+                        name="Áreas de traslape",
+                        style_function=lambda x: {"fillColor": "red", "color": "red", "weight": 1.5, "fillOpacity": 0.7},
+                        tooltip=folium.GeoJsonTooltip(
+                            fields=["nom_terr", "etnia", "area_traslape_ha", "porc_traslape_str"],
+                            aliases=["Territorio:", "Etnia:", "Área traslapada (ha):", "Porcentaje traslapado:"],
+                            localize=True
+                        )
+                    ).add_to(m_inter)
+
+                    folium.LayerControl().add_to(m_inter)
+
+                    # Ajustar el mapa a los límites de la intersección (esto hará el zoom deseado)
+                    m_inter.fit_bounds([[inter_bounds[1], inter_bounds[0]], [inter_bounds[3], inter_bounds[2]]])
+
+                    mostrar_mapa(m_inter, width=1100, height=600)
+
+                    st.markdown("### 📋 Tabla de intersección")
+                    # --- Cambio: Mostrar nombres largos en la tabla si es posible y relevante para traslape ---
+                    gdf_interseccion_display = gdf_interseccion.copy()
+                    if 'cn_ci' in gdf_interseccion_display.columns:
+                        gdf_interseccion_display['cn_ci_display'] = gdf_interseccion_display['cn_ci'].apply(lambda x: tipo_territorio_map.get(x, x))
+
+                    # Definir las columnas a mostrar, incluyendo 'cn_ci_display' si existe
+                    cols_to_display_interseccion = [
+                        "id_rtdaf", 
+                        "nom_terr",
+                        "etnia",
+                        "departamen",
+                        "municipio",
+                        "area_original_ha",
+                        "area_traslape_ha",
+                        "porc_traslape_str"
+                    ]
+                    # Si la columna 'cn_ci' está en el original y tenemos su versión display, la añadimos/reemplazamos
+                    if 'cn_ci' in gdf_interseccion_display.columns:
+                        if 'cn_ci' in cols_to_display_interseccion:
+                            cols_to_display_interseccion[cols_to_display_interseccion.index('cn_ci')] = 'cn_ci_display'
+                        else:
+                            cols_to_display_interseccion.append('cn_ci_display')
+
+                    # Filtrar solo las columnas que realmente existen en el DataFrame
+                    final_cols_for_table_interseccion = [col for col in cols_to_display_interseccion if col in gdf_interseccion_display.columns and col != gdf_interseccion_display.geometry.name]
+
+                    st.dataframe(gdf_interseccion_display[final_cols_for_table_interseccion])
+
+                    csv_inter = gdf_interseccion_display[final_cols_for_table_interseccion].to_csv(index=False).encode("utf-8")
+                    st.download_button("💾 Descargar resultados de intersección como CSV", csv_inter, "intersecciones.csv", "text/csv")
+                else:
+                    st.warning("No se encontraron intersecciones entre tu shapefile y los territorios cargados.")
+
+# --- Panel de métricas por etapa (opcional, solo si MOSTRAR_METRICAS está activo en los secretos) ---
+if st.session_state.get("autenticado") and st.secrets.get("MOSTRAR_METRICAS", False):
+    with st.expander("🛠️ Métricas de rendimiento (administración)"):
+        st.markdown("**Esta ejecución**")
+        st.dataframe(pd.DataFrame(REGISTRO.ejecucion_actual()))
+        st.markdown("**Acumulado del servidor (segundos)**")
+        st.dataframe(pd.DataFrame.from_dict(REGISTRO.resumen(), orient="index"))
+        st.markdown(
+            f"**Versión del dataset:** `{gdf_total.attrs.get('huella') if gdf_total is not None else '—'}` · "
+            f"última revisión del origen: {pd.Timestamp(actualizador.ultima_revision, unit='s') if actualizador.ultima_revision else '—'}"
+            + (f" · último error: {actualizador.ultimo_error}" if actualizador.ultimo_error else "")
+        )
+        if gdf_total is not None:
+            memoria = reporte_memoria(gdf_total)
+            st.markdown(f"**Memoria del dataset principal: {memoria['bytes'].sum() / 2**20:.1f} MB**")
+            st.dataframe(memoria)
 
 # --- Footer global para la pantalla principal del visor (se muestra después del login) ---
 if "autenticado" in st.session_state and st.session_state["autenticado"]:
@@ -0,0 +1,125 @@
+# --- MAPANIMA: ACTUALIZADOR DEL DATASET EN SEGUNDO PLANO (sin Streamlit) ---
+# Un hilo revisa el origen cada cierto intervalo y, si el ZIP cambió, prepara la nueva versión
+# fuera del camino de las solicitudes (descarga, lectura, normalización e índices). Cuando está
+# lista, la referencia a la versión vigente se reemplaza de una sola vez: cada rerun del visor
+# toma la versión vigente al empezar y la usa hasta el final, y ninguna sesión espera la recarga.
+#
+# La revisión es barata cuando no hay cambios: la descarga es condicional (304) y, si la huella
+# coincide con la de la versión vigente, no se vuelve a leer nada del disco. Mientras no haya
+# ninguna versión publicada (p. ej. el origen falló en el primer arranque) se reintenta pronto,
+# con esperas crecientes, en lugar de esperar el intervalo completo.
+
+import logging
+import threading
+import time
+
+from mapanima_metricas import etapa
+
+logger = logging.getLogger("mapanima.actualizador")
+
+# Intervalo por defecto entre revisiones del origen (segundos)
+INTERVALO_ACTUALIZACION = 15 * 60
+# Primera espera entre reintentos mientras no hay versión publicada (se duplica hasta el intervalo)
+ESPERA_SIN_VERSION = 30
+
+
+def avisar_log(nivel, mensaje):
+    """Avisos del cargador cuando corre en segundo plano (no hay una sesión donde mostrarlos)."""
+    getattr(logger, "warning" if nivel == "warning" else "error" if nivel == "error" else "info")(mensaje)
+
+
+class ActualizadorDataset:
+    """Mantiene la versión vigente del dataset y la reemplaza en segundo plano.
+
+    cargar(huella_vigente) devuelve el GeoDataFrame con attrs["huella"], o None si no hay una
+    versión nueva (sin cambios respecto a huella_vigente, o el origen no trae datos legibles), y
+    puede lanzar excepciones;
+    preparar(gdf), opcional, construye los recursos derivados (índices, pirámide...) antes de
+    publicar la versión, para que el primer rerun que la vea no los construya.
+    """
+
+    def __init__(self, cargar, preparar=None, intervalo=INTERVALO_ACTUALIZACION):
+        self._cargar = cargar
+        self._preparar = preparar
+        self.intervalo = intervalo
+        self._vigente = None
+        self._por_preparar = None  # Versión publicada cuyos recursos prepara el hilo al iniciar
+        self._candado = threading.Lock()  # Una sola revisión a la vez
+        self._detener = threading.Event()
+        self._hilo = None
+        self._espera_inicial = intervalo
+        self.ultima_revision = None
+        self.ultima_publicacion = None
+        self.ultimo_error = None
+
+    def vigente(self):
+        """Versión publicada (o None). Leer una referencia es atómico: no hace falta candado."""
+        return self._vigente
+
+    def publicar(self, gdf, preparar_en_fondo=False):
+        """Publica una versión ya cargada (p. ej. la última guardada en disco al arrancar).
+
+        Con preparar_en_fondo=True la versión se publica enseguida y sus recursos los prepara el
+        hilo del actualizador al iniciar, para que el primer rerun tras un reinicio no espere
+        toda la preparación: los reruns que lleguen antes construyen solo lo que usan (o esperan
+        el recurso que el hilo ya está construyendo).
+        """
+        if gdf is not None and self._preparar is not None:
+            if preparar_en_fondo:
+                self._por_preparar = gdf
+            else:
+                self._preparar(gdf)
+        self._vigente = gdf
+        self.ultima_publicacion = time.time()
+
+    def revisar(self):
+        """Consulta el origen y publica la nueva versión si cambió. Devuelve True si hubo cambio."""
+        with self._candado, etapa("actualizacion_fondo") as m:
+            self.ultima_revision = time.time()
+            actual = self._vigente
+            gdf = self._cargar(None if actual is None else actual.attrs.get("huella"))
+            cambio = gdf is not None and (actual is None or gdf.attrs.get("huella") != actual.attrs.get("huella"))
+            m["cambio"] = cambio
+            if cambio:
+                self.publicar(gdf)
+                logger.info("Nueva versión del dataset publicada: %s", gdf.attrs.get("huella"))
+            return cambio
+
+    def _ciclo(self):
+        gdf, self._por_preparar = self._por_preparar, None
+        if gdf is not None:
+            try:
+                with etapa("preparacion_fondo", filas=len(gdf)):
+                    self._preparar(gdf)
+            except Exception as e:
+                logger.warning("No se pudieron preparar los recursos del dataset: %s: %s", type(e).__name__, e)
+        espera, reintento = self._espera_inicial, ESPERA_SIN_VERSION
+        while not self._detener.wait(espera):
+            try:
+                self.revisar()
+                self.ultimo_error = None
+            except Exception as e:
+                # Un fallo del origen no afecta a las sesiones: siguen con la versión vigente
+                self.ultimo_error = f"{type(e).__name__}: {e}"
+                logger.warning("No se pudo actualizar el dataset: %s", self.ultimo_error)
+            if self._vigente is None:
+                espera, reintento = min(reintento, self.intervalo), reintento * 2
+            else:
+                espera, reintento = self.intervalo, ESPERA_SIN_VERSION
+
+    def iniciar(self, revisar_ya=False):
+        """Arranca el hilo de revisiones periódicas (idempotente).
+
+        Con revisar_ya=True la primera revisión se hace enseguida (en el hilo), p. ej. cuando
+        se publicó la versión en disco y el origen pudo cambiar mientras el visor estaba apagado,
+        o cuando no se pudo publicar ninguna versión.
+        """
+        if self._hilo is None or not self._hilo.is_alive():
+            self._espera_inicial = 0 if revisar_ya else self.intervalo
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._ciclo, name="mapanima-actualizador", daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self):
+        self._detener.set()
@@ -0,0 +1,325 @@
+# --- MAPANIMA: BENCHMARK DE RENDIMIENTO ---
+# Mide por separado cada etapa del visor (carga del ZIP, normalización, filtros, simplificación,
+# GeoJSON/folium, traslape y exportaciones) sobre un dataset sintético a escala nacional, y
+# guarda los tiempos en JSON para comparar ejecuciones entre commits.
+#
+# No necesita red: el ZIP sintético se sirve desde un servidor HTTP local en 127.0.0.1.
+#
+# Uso:
+#   python mapanima_benchmark.py --territorios 3000 --salida bench.json
+#   python mapanima_benchmark.py --salida nuevo.json --comparar bench.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import statistics
+import functools
+import http.server
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely import affinity
+import folium
+
+import mapanima_datos
+from mapanima_datos import (
+    cargar_dataset, normalizar_columnas, construir_indices, filtrar_posiciones, construir_piramide,
+    exportar_shapefile_zip
+)
+from mapanima_traslape import proyectar_dataset, construir_arbol, analizar_traslape
+from mapanima_geojson import (
+    serializar_propiedades, serializar_entidades, ensamblar_coleccion, CapaGeoJsonPreserializada,
+    construir_topologia, ensamblar_topojson, CapaTopoJson
+)
+
+# Extensión aproximada de Colombia continental en CTM12 (EPSG:9377), metros
+EXTENSION_COLOMBIA = (4_300_000, 1_700_000, 5_500_000, 3_300_000)
+
+ETAPAS = ["Administrativa", "Judicial", "Posfallo"]
+ESTADOS = ["En estudio", "Demanda radicada", "Con sentencia", "Archivado", "Sin iniciar"]
+DEPARTAMENTOS = ["Amazonas", "Antioquia", "Cauca", "Chocó", "Guainía", "La Guajira", "Meta", "Nariño", "Putumayo", "Vaupés", "Vichada"]
+ETNIAS = ["Emberá", "Nasa", "Wayuu", "Awá", "Sikuani", "Afrodescendiente"]
+TIPOLOGIAS = ["Resguardo", "Consejo comunitario", "Ampliación", "Ancestral"]
+
+
+# --- Dataset sintético ---
+
+def generar_territorios(n, semilla=0, espaciado=150.0):
+    """GeoDataFrame en EPSG:9377 con el esquema real y polígonos complejos.
+
+    Las geometrías son celdas de Voronoi (los vecinos comparten bordes, como en el dataset real)
+    densificadas cada `espaciado` metros, con un 10 % de multipolígonos y un 10 % de huecos.
+    """
+    rng = np.random.default_rng(semilla)
+    x0, y0, x1, y1 = EXTENSION_COLOMBIA
+    puntos = shapely.points(rng.uniform(x0, x1, n), rng.uniform(y0, y1, n))
+    celdas = shapely.voronoi_polygons(shapely.multipoints(puntos), extend_to=shapely.box(x0, y0, x1, y1))
+    celdas = shapely.clip_by_rect(np.asarray(shapely.get_parts(celdas)), x0, y0, x1, y1)
+    # voronoi_polygons no conserva el orden de los puntos: se reordena por contención
+    arbol = shapely.STRtree(celdas)
+    idx_puntos, idx_celdas = arbol.query(puntos, predicate="within")
+    celdas = celdas[idx_celdas[np.argsort(idx_puntos)]]
+
+    geometrias = []
+    for i, celda in enumerate(celdas):
+        tipo = rng.random()
+        if tipo < 0.1:
+            # Multipolígono: la celda más un islote separado dentro de ella
+            nucleo = shapely.buffer(shapely.centroid(celda), np.sqrt(celda.area) * 0.1)
+            geom = shapely.MultiPolygon([celda.difference(nucleo.buffer(np.sqrt(celda.area) * 0.05)), nucleo])
+        elif tipo < 0.2:
+            # Polígono con hueco (otro territorio o un área excluida)
+            geom = celda.difference(shapely.buffer(shapely.centroid(celda), np.sqrt(celda.area) * 0.15))
+        else:
+            geom = celda
+        geometrias.append(shapely.segmentize(geom, espaciado))
+
+    gdf = gpd.GeoDataFrame({
+        "id_rtdaf": [f"RTDAF-{i:06d}" for i in range(n)],
+        "nom_terr": [f"{rng.choice(TIPOLOGIAS)} {rng.choice(ETNIAS)} {i}" for i in range(n)],
+        "etnia": rng.choice(ETNIAS, n),
+        "cn_ci": rng.choice(["CI", "CN"], n, p=[0.7, 0.3]),
+        "etapa": rng.choice(ETAPAS, n),
+        "estado_act": rng.choice(ESTADOS, n),
+        "departamen": rng.choice(DEPARTAMENTOS, n),
+        "municipio": [f"Municipio {k}" for k in rng.integers(0, 400, n)],
+        "tipologia": rng.choice(TIPOLOGIAS, n),
+    }, geometry=geometrias, crs=9377)
+    gdf["area_ha"] = (gdf.geometry.area / 10000).round(2)
+    return gdf
+
+
+def generar_proyectos(n, semilla=1):
+    """Huellas de proyectos del usuario (rectángulos rotados de 1 a 40 km) en EPSG:9377."""
+    rng = np.random.default_rng(semilla)
+    x0, y0, x1, y1 = EXTENSION_COLOMBIA
+    centros_x, centros_y = rng.uniform(x0, x1, n), rng.uniform(y0, y1, n)
+    lados = rng.uniform(1_000, 40_000, n)
+    cajas = shapely.box(centros_x - lados / 2, centros_y - lados / 4, centros_x + lados / 2, centros_y + lados / 4)
+    cajas = [affinity.rotate(c, a) for c, a in zip(cajas, rng.uniform(0, 180, n))]
+    return gpd.GeoDataFrame({"proyecto": [f"P{i}" for i in range(n)]}, geometry=cajas, crs=9377)
+
+
+def escribir_zip_shapefile(gdf, ruta_zip):
+    """Escribe gdf como shapefile comprimido en ruta_zip (archivos en la raíz del ZIP)."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        gdf.to_file(os.path.join(tmpdir, "territorios.shp"))
+        with zipfile.ZipFile(ruta_zip, "w", zipfile.ZIP_DEFLATED) as zf:
+            for nombre in sorted(os.listdir(tmpdir)):
+                zf.write(os.path.join(tmpdir, nombre), nombre)
+
+
+# --- Medición ---
+
+def medir(funcion, repeticiones):
+    """Ejecuta funcion() `repeticiones` veces; devuelve (último resultado, estadísticas en segundos)."""
+    tiempos = []
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return resultado, {
+        "min_s": round(min(tiempos), 6),
+        "mediana_s": round(statistics.median(tiempos), 6),
+        "max_s": round(max(tiempos), 6),
+        "repeticiones": repeticiones,
+    }
+
+
+class _ManejadorSilencioso(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _servidor_local(directorio):
+    manejador = functools.partial(_ManejadorSilencioso, directory=directorio)
+    servidor = http.server.ThreadingHTTPServer(("127.0.0.1", 0), manejador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def _version_git():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def ejecutar(territorios=3000, proyectos=50, repeticiones=3, semilla=0, procesos=1):
+    """Corre todas las etapas y devuelve el diccionario de resultados."""
+    etapas = {}
+
+    def registrar(nombre, estadisticas, **datos):
+        etapas[nombre] = dict(estadisticas, **datos)
+        print(f"{nombre:>28}  {estadisticas['mediana_s']:>9.4f} s", file=sys.stderr)
+
+    directorio = tempfile.mkdtemp(prefix="mapanima_bench_")
+    dir_cache_original = mapanima_datos.DIR_CACHE
+    try:
+        gdf_origen, stats = medir(lambda: generar_territorios(territorios, semilla), 1)
+        registrar("generacion_sintetica", stats, filas=len(gdf_origen))
+        escribir_zip_shapefile(gdf_origen, os.path.join(directorio, "territorios.zip"))
+        vertices = int(shapely.get_num_coordinates(gdf_origen.geometry.values).sum())
+
+        servidor = _servidor_local(directorio)
+        url = f"http://127.0.0.1:{servidor.server_address[1]}/territorios.zip"
+        mapanima_datos.DIR_CACHE = os.path.join(directorio, "cache")
+
+        # --- Carga ---
+        def carga_en_frio():
+            shutil.rmtree(mapanima_datos.DIR_CACHE, ignore_errors=True)
+            return cargar_dataset(url)
+        gdf_total, stats = medir(carga_en_frio, repeticiones)
+        registrar("carga_zip_fria", stats, filas=len(gdf_total), vertices=vertices,
+                  bytes_zip=os.path.getsize(os.path.join(directorio, "territorios.zip")))
+        _, stats = medir(lambda: cargar_dataset(url), repeticiones)
+        registrar("carga_zip_cache", stats)
+        servidor.shutdown()
+
+        crudo, stats = medir(lambda: gpd.read_file(os.path.join(directorio, "territorios.zip")), repeticiones)
+        registrar("lectura_shapefile", stats, filas=len(crudo))
+        crudo = crudo.to_crs(epsg=4326)
+        for col in crudo.columns:
+            if col not in (crudo.geometry.name, "area_ha"):
+                crudo[col] = crudo[col].fillna("").astype(str)
+        _, stats = medir(lambda: normalizar_columnas(crudo.copy()), repeticiones)
+        registrar("normalizacion", stats)
+
+        # --- Filtros ---
+        indices, stats = medir(lambda: construir_indices(gdf_total), repeticiones)
+        registrar("indices_filtros", stats)
+        rng = np.random.default_rng(semilla)
+        selecciones = [
+            {"etapa": ["judicial"]},
+            {"departamen": list(rng.choice(sorted(indices["departamen"]), 3, replace=False)), "cn_ci": ["ci"]},
+            {"etapa": ["administrativa", "posfallo"], "estado_act": ["en estudio", "archivado"]},
+        ]
+        posiciones, stats = medir(lambda: [filtrar_posiciones(indices, len(gdf_total), s) for s in selecciones], repeticiones)
+        registrar("filtrado", stats, combinaciones=len(selecciones), filas=[len(p) for p in posiciones])
+        seleccion = posiciones[1]
+
+        # --- Simplificación ---
+        piramide, stats = medir(lambda: construir_piramide(gdf_total), repeticiones)
+        registrar("piramide_simplificacion", stats, niveles=len(piramide))
+
+        # --- GeoJSON / folium ---
+        gdf_sel = gdf_total.iloc[seleccion]
+        mapa_base = lambda: folium.Map(location=[4.5, -74.0], zoom_start=6, tiles=None)
+
+        def folium_geojson():
+            m = mapa_base()
+            folium.GeoJson(gdf_sel.assign(area_formateada=""), tooltip=folium.GeoJsonTooltip(fields=["nom_terr", "id_rtdaf"])).add_to(m)
+            return m.get_root().render()
+        html, stats = medir(folium_geojson, repeticiones)
+        registrar("render_folium_geojson", stats, filas=len(gdf_sel), bytes_html=len(html))
+
+        propiedades, stats = medir(lambda: serializar_propiedades(gdf_total), repeticiones)
+        registrar("preserializar_propiedades", stats)
+        fragmentos, stats = medir(lambda: serializar_entidades(gdf_total.geometry.values, propiedades), repeticiones)
+        registrar("preserializar_geojson", stats)
+        campos = [("nom_terr", "Territorio:"), ("id_rtdaf", "ID:")]
+
+        def render_preserializado():
+            m = mapa_base()
+            CapaGeoJsonPreserializada(ensamblar_coleccion(fragmentos, seleccion), campos).add_to(m)
+            return m.get_root().render()
+        html, stats = medir(render_preserializado, repeticiones)
+        registrar("render_preserializado", stats, filas=len(seleccion), bytes_html=len(html))
+
+        topologia, stats = medir(lambda: construir_topologia(gdf_total.geometry.values), repeticiones)
+        registrar("topologia_topojson", stats, arcos=len(topologia["arcos_json"]))
+
+        def render_topojson():
+            m = mapa_base()
+            CapaTopoJson(ensamblar_topojson(topologia, propiedades, seleccion), campos).add_to(m)
+            return m.get_root().render()
+        html, stats = medir(render_topojson, repeticiones)
+        registrar("render_topojson", stats, filas=len(seleccion), bytes_html=len(html))
+
+        # --- Traslape ---
+        gdf_total_proj, stats = medir(lambda: proyectar_dataset(gdf_total), repeticiones)
+        registrar("proyeccion_ctm12", stats)
+        arbol, stats = medir(lambda: construir_arbol(gdf_total_proj), repeticiones)
+        registrar("arbol_strtree", stats)
+        gdf_proyectos = generar_proyectos(proyectos, semilla + 1)
+        resultado, stats = medir(lambda: analizar_traslape(gdf_proyectos, gdf_total, gdf_total_proj, arbol, procesos=procesos), repeticiones)
+        registrar("traslape", stats, proyectos=proyectos, intersecciones=len(resultado[1]), procesos=procesos)
+
+        # --- Exportaciones ---
+        contenido, stats = medir(lambda: exportar_shapefile_zip(gdf_sel), repeticiones)
+        registrar("exportar_shapefile", stats, filas=len(gdf_sel), bytes=len(contenido))
+        contenido, stats = medir(lambda: gdf_sel.drop(columns=gdf_sel.geometry.name).to_csv(index=False).encode("utf-8"), repeticiones)
+        registrar("exportar_csv", stats, filas=len(gdf_sel), bytes=len(contenido))
+    finally:
+        mapanima_datos.DIR_CACHE = dir_cache_original
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    return {
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _version_git(),
+        "parametros": {"territorios": territorios, "proyectos": proyectos, "repeticiones": repeticiones, "semilla": semilla, "procesos": procesos},
+        "entorno": {
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "geopandas": gpd.__version__,
+            "shapely": shapely.__version__,
+            "pandas": pd.__version__,
+            "folium": folium.__version__,
+        },
+        "etapas": etapas,
+    }
+
+
+def comparar(actual, anterior):
+    """Tabla de medianas: anterior, actual y razón (actual / anterior) por etapa."""
+    filas = []
+    for nombre, datos in actual["etapas"].items():
+        previo = anterior["etapas"].get(nombre)
+        if previo is None:
+            continue
+        razon = datos["mediana_s"] / previo["mediana_s"] if previo["mediana_s"] else float("nan")
+        filas.append(f"{nombre:>28}  {previo['mediana_s']:>9.4f}  {datos['mediana_s']:>9.4f}  {razon:>6.2f}x")
+    encabezado = f"{'etapa':>28}  {'anterior':>9}  {'actual':>9}  {'razón':>7}"
+    return "\n".join([f"{anterior.get('commit')} -> {actual.get('commit')}", encabezado] + filas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark por etapas de Mapanima sobre datos sintéticos.")
+    parser.add_argument("--territorios", type=int, default=3000, help="Número de territorios sintéticos")
+    parser.add_argument("--proyectos", type=int, default=50, help="Huellas de proyectos para el traslape")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Repeticiones por etapa (se reporta la mediana)")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla del generador (mismos datos en cada corrida)")
+    parser.add_argument("--procesos", type=int, default=1, help="Procesos para las intersecciones del traslape")
+    parser.add_argument("--salida", default="benchmark.json", help="Archivo JSON de resultados")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para comparar medianas")
+    args = parser.parse_args(argv)
+
+    resultados = ejecutar(args.territorios, args.proyectos, args.repeticiones, args.semilla, args.procesos)
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(resultados, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {args.salida}", file=sys.stderr)
+
+    if args.comparar:
+        with open(args.comparar, "r", encoding="utf-8") as f:
+            print(comparar(resultados, json.load(f)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+# --- MAPANIMA: ÍNDICE DE BÚSQUEDA DE TERRITORIOS (sin Streamlit) ---
+# Búsqueda por nombre (nom_terr) e ID (id_rtdaf) sin distinguir tildes ni mayúsculas, con
+# coincidencia por prefijo, por subcadena y aproximada (trigramas), para un solo cuadro de
+# búsqueda en el visor. El índice se construye una vez por versión del dataset.
+
+import bisect
+import re
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+
+COLUMNAS_BUSQUEDA = ["nom_terr", "id_rtdaf"]
+# Similitud mínima de trigramas para una coincidencia aproximada: por cada palabra de la consulta se
+# toma la palabra más parecida del texto (coeficiente de Dice) y se promedia entre las palabras.
+# Comparar palabra a palabra, y no contra todo el nombre, hace que un error de una letra en una
+# palabra ('chamii', 'katoi') encuentre nombres largos de varias palabras.
+UMBRAL_SIMILITUD = 0.4
+
+# Puntajes por tipo de coincidencia (los aproximados quedan entre 0 y 1)
+PUNTAJE_EXACTO = 3.0
+PUNTAJE_PREFIJO = 2.0
+PUNTAJE_SUBCADENA = 1.5
+# Sin coincidencias directas, se devuelven las aproximadas con al menos esta fracción de la mejor similitud
+FRACCION_MEJOR_APROXIMADA = 0.85
+
+
+def normalizar_texto(texto):
+    """Minúsculas, sin tildes ni diacríticos y con la puntuación reducida a espacios: 'Emberá-Chamí' -> 'embera chami'."""
+    descompuesto = unicodedata.normalize("NFKD", str(texto))
+    sin_tildes = "".join(c for c in descompuesto if not unicodedata.combining(c))
+    return re.sub(r"[\W_]+", " ", sin_tildes.lower()).strip()
+
+
+def _trigramas(texto):
+    # Relleno al estilo pg_trgm: cada palabra aporta también sus trigramas de inicio y fin
+    trigramas = set()
+    for palabra in texto.split():
+        relleno = f"  {palabra} "
+        trigramas.update(relleno[i:i + 3] for i in range(len(relleno) - 2))
+    return trigramas
+
+
+class IndiceBusqueda:
+    """Índice de nombres e IDs normalizados -> posiciones de fila del dataset.
+
+    - Prefijo: búsqueda binaria sobre los textos y las palabras ordenadas.
+    - Subcadena: índice invertido de trigramas de los textos completos.
+    - Aproximada: índice invertido de trigramas del vocabulario (palabras distintas); la similitud
+      de todas las palabras se calcula de una vez con bincount y se lleva a las entradas con maximum.at.
+    - Los puntajes y el orden se calculan con arreglos de numpy, sin recorrer las entradas en Python.
+    """
+
+    def __init__(self, gdf, columnas=COLUMNAS_BUSQUEDA):
+        textos, posiciones = [], []
+        for col in columnas:
+            if col not in gdf.columns:
+                continue
+            for pos, valor in enumerate(gdf[col].astype(str)):
+                normalizado = normalizar_texto(valor)
+                if normalizado:
+                    textos.append(normalizado)
+                    posiciones.append(pos)
+        self.textos = textos
+        self.posiciones = np.asarray(posiciones, dtype=np.int64)
+
+        self._longitudes = np.fromiter((len(t) for t in textos), dtype=np.int32, count=len(textos))
+
+        # Prefijos: textos y palabras ordenados (para bisect) con la entrada de cada uno
+        completos = sorted((t, i) for i, t in enumerate(textos))
+        self._claves_completos = [t for t, _ in completos]
+        self._entradas_completos = np.asarray([i for _, i in completos], dtype=np.int64)
+        palabras = sorted((p, i) for i, t in enumerate(textos) for p in set(t.split()))
+        self._claves_palabras = [p for p, _ in palabras]
+        self._entradas_palabras = np.asarray([i for _, i in palabras], dtype=np.int64)
+
+        # Trigramas: trigrama -> arreglo de entradas que lo contienen
+        listas = defaultdict(list)
+        for i, t in enumerate(textos):
+            for tri in _trigramas(t):
+                listas[tri].append(i)
+        self._trigramas = {tri: np.asarray(entradas, dtype=np.int32) for tri, entradas in listas.items()}
+
+        # Vocabulario: trigrama -> palabras que lo contienen, y pares (entrada, palabra) para
+        # llevar la similitud de cada palabra a los textos que la usan
+        vocabulario = sorted(set(self._claves_palabras))
+        id_palabra = {p: i for i, p in enumerate(vocabulario)}
+        listas = defaultdict(list)
+        n_trigramas_palabra = np.zeros(len(vocabulario), dtype=np.int32)
+        for i, palabra in enumerate(vocabulario):
+            trigramas = _trigramas(palabra)
+            n_trigramas_palabra[i] = len(trigramas)
+            for tri in trigramas:
+                listas[tri].append(i)
+        self._trigramas_palabra = {tri: np.asarray(ids, dtype=np.int32) for tri, ids in listas.items()}
+        self._n_trigramas_palabra = n_trigramas_palabra
+        self._pares_entrada = self._entradas_palabras
+        self._pares_palabra = np.asarray([id_palabra[p] for p in self._claves_palabras], dtype=np.int64)
+
+    @staticmethod
+    def _rango_prefijo(claves, consulta):
+        return bisect.bisect_left(claves, consulta), bisect.bisect_left(claves, consulta + "\uffff")
+
+    def _similitud_palabras(self, consulta):
+        """Similitud de cada entrada con la consulta: promedio, sobre las palabras de la consulta, de la
+        similitud (Dice de trigramas) con la palabra más parecida de la entrada."""
+        similitud = np.zeros(len(self.textos))
+        palabras = consulta.split()
+        for palabra in palabras:
+            trigramas = _trigramas(palabra)
+            presentes = [self._trigramas_palabra[tri] for tri in trigramas if tri in self._trigramas_palabra]
+            if not presentes:
+                continue
+            comunes = np.bincount(np.concatenate(presentes), minlength=len(self._n_trigramas_palabra))
+            dice = 2 * comunes / (len(trigramas) + self._n_trigramas_palabra)
+            mejor = np.zeros(len(self.textos))
+            np.maximum.at(mejor, self._pares_entrada, dice[self._pares_palabra])
+            similitud += mejor
+        return similitud / len(palabras)
+
+    def buscar(self, consulta, limite=None):
+        """Posiciones de fila ordenadas de mejor a peor coincidencia, sin repetir.
+
+        Devuelve una lista de (posición, puntaje, texto normalizado que coincidió).
+        """
+        consulta = normalizar_texto(consulta)
+        if not consulta or not self.textos:
+            return []
+        puntajes = np.full(len(self.textos), -1.0)
+
+        # Prefijo del texto completo (o coincidencia exacta) y prefijo de alguna palabra
+        inicio, fin = self._rango_prefijo(self._claves_completos, consulta)
+        puntajes[self._entradas_completos[inicio:fin]] = PUNTAJE_PREFIJO
+        if inicio < fin and self._claves_completos[inicio] == consulta:
+            exactos = inicio + np.flatnonzero(np.asarray(self._claves_completos[inicio:fin]) == consulta)
+            puntajes[self._entradas_completos[exactos]] = PUNTAJE_EXACTO
+        inicio, fin = self._rango_prefijo(self._claves_palabras, consulta)
+        entradas = self._entradas_palabras[inicio:fin]
+        puntajes[entradas] = np.maximum(puntajes[entradas], PUNTAJE_PREFIJO - 0.1)
+
+        # Subcadena y similitud aproximada a partir de los trigramas compartidos
+        trigramas_consulta = [tri for tri in _trigramas(consulta) if tri in self._trigramas]
+        if trigramas_consulta:
+            conteos = np.bincount(
+                np.concatenate([self._trigramas[tri] for tri in trigramas_consulta]), minlength=len(self.textos)
+            )
+            n_consulta = len(_trigramas(consulta))
+            candidatos = np.flatnonzero((conteos > 0) & (puntajes < 0))
+            comunes = conteos[candidatos]
+            similitud = self._similitud_palabras(consulta)[candidatos]
+            # Una subcadena dentro de una palabra no trae los trigramas de borde (hasta 3 por palabra)
+            for entrada in candidatos[comunes >= n_consulta - 3 * len(consulta.split())]:
+                if consulta in self.textos[entrada]:
+                    puntajes[entrada] = PUNTAJE_SUBCADENA
+            aproximados = (similitud >= UMBRAL_SIMILITUD) & (puntajes[candidatos] < 0)
+            puntajes[candidatos[aproximados]] = similitud[aproximados]
+
+        # Las coincidencias aproximadas solo se usan si no hay exactas, por prefijo o por subcadena,
+        # y entonces solo las cercanas a la mejor
+        mejor = puntajes.max()
+        minimo = PUNTAJE_SUBCADENA if mejor >= PUNTAJE_SUBCADENA else FRACCION_MEJOR_APROXIMADA * mejor
+        # Mejor puntaje primero; a igual puntaje, el texto más corto (más específico)
+        entradas = np.flatnonzero((puntajes >= minimo) & (puntajes >= 0))
+        entradas = entradas[np.lexsort((entradas, self._longitudes[entradas], -puntajes[entradas]))]
+        # Una fila puede coincidir por nombre y por ID: se conserva su mejor entrada
+        _, primeras = np.unique(self.posiciones[entradas], return_index=True)
+        entradas = entradas[np.sort(primeras)]
+        if limite is not None:
+            entradas = entradas[:limite]
+        return [(int(self.posiciones[e]), round(float(puntajes[e]), 3), self.textos[e]) for e in entradas]
@@ -0,0 +1,149 @@
+# --- MAPANIMA: LECTURA DE CAPAS DEL USUARIO (sin Streamlit) ---
+# Capas que el usuario sube para el traslape: shapefile en .zip (también dentro de carpetas, y
+# varios por archivo), GeoPackage, GeoJSON y KML. Se leen directamente de los bytes en memoria:
+# el ZIP no se extrae a disco y solo se descomprimen los archivos de las capas encontradas.
+#
+# Los ZIP se revisan antes de leerlos (número de archivos, tamaño total y relación de
+# compresión) y, como los tamaños declarados pueden mentir, cada archivo se descomprime por
+# bloques contando los bytes reales: un ZIP bomba se rechaza sin llegar a descomprimirse.
+
+import os
+import zipfile
+import warnings
+from io import BytesIO
+
+import pandas as pd
+import geopandas as gpd
+import pyogrio
+import pyogrio.errors
+
+EXTENSIONES_USUARIO = (".zip", ".gpkg", ".geojson", ".json", ".kml")
+# Formatos de capa que se buscan dentro de un ZIP
+EXTENSIONES_CAPA = (".shp", ".gpkg", ".geojson", ".json", ".kml")
+# Archivos que acompañan al .shp y viajan con él a la lectura
+COMPLEMENTOS_SHP = (".shp", ".shx", ".dbf", ".prj", ".cpg")
+
+# Límites de una carga (sobre los bytes descomprimidos)
+MAX_BYTES_CARGA = 500 * 1024 * 1024
+MAX_ARCHIVOS_ZIP = 2000
+MAX_RELACION_COMPRESION = 200
+TAM_BLOQUE = 1024 * 1024
+
+# GDAL avisa que un GeoPackage leído desde memoria no tiene extensión .gpkg: es esperado
+warnings.filterwarnings("ignore", message=".*GPKG application_id, but non conformant file extension", category=RuntimeWarning)
+
+
+class ArchivoRechazado(ValueError):
+    """La carga no es válida o supera los límites; el mensaje es apto para el usuario."""
+
+
+def _validar_zip(zip_ref, max_bytes):
+    archivos = [i for i in zip_ref.infolist() if not i.is_dir()]
+    if len(archivos) > MAX_ARCHIVOS_ZIP:
+        raise ArchivoRechazado(f"El ZIP contiene {len(archivos)} archivos; el máximo permitido es {MAX_ARCHIVOS_ZIP}.")
+    if sum(i.file_size for i in archivos) > max_bytes:
+        raise ArchivoRechazado(f"El contenido descomprimido del ZIP supera el máximo permitido de {max_bytes // 2**20} MB.")
+    for info in archivos:
+        if info.file_size > MAX_RELACION_COMPRESION * max(info.compress_size, 1) and info.file_size > TAM_BLOQUE:
+            raise ArchivoRechazado(f"El archivo '{info.filename}' del ZIP tiene una relación de compresión sospechosa.")
+    return archivos
+
+
+def _leer_miembro(zip_ref, info, presupuesto):
+    """Bytes de un archivo del ZIP, descomprimido por bloques sin pasar de lo declarado ni del
+    presupuesto restante. Devuelve (bytes, presupuesto restante)."""
+    bloques, total = [], 0
+    with zip_ref.open(info) as f:
+        for bloque in iter(lambda: f.read(TAM_BLOQUE), b""):
+            total += len(bloque)
+            if total > info.file_size or total > presupuesto:
+                raise ArchivoRechazado(f"El archivo '{info.filename}' del ZIP se descomprime a más bytes de los declarados o permitidos.")
+            bloques.append(bloque)
+    return b"".join(bloques), presupuesto - total
+
+
+def _leer(origen, **kwargs):
+    # Los bytes se leen en memoria (/vsimem/ de GDAL), sin archivo temporal
+    return gpd.read_file(BytesIO(origen) if isinstance(origen, bytes) else origen, **kwargs)
+
+
+def _capas_archivo(origen, etiqueta):
+    """Capas con geometría de un GeoPackage/GeoJSON/KML (ruta o bytes): [(etiqueta, GeoDataFrame)]."""
+    capas = pyogrio.list_layers(origen)
+    con_geometria = [nombre for nombre, tipo in capas if tipo is not None]
+    return [
+        (etiqueta if len(con_geometria) == 1 else f"{etiqueta}:{nombre}", _leer(origen, layer=nombre))
+        for nombre in con_geometria
+    ]
+
+
+def _capas_zip(zip_ref, max_bytes):
+    archivos = _validar_zip(zip_ref, max_bytes)
+    # Carpetas de sistema (p. ej. __MACOSX de los ZIP creados en macOS) no traen capas
+    archivos = [i for i in archivos if not any(p.startswith("__") or p.startswith(".") for p in i.filename.split("/"))]
+    por_nombre = {i.filename.lower(): i for i in archivos}
+    capas_zip = [i for i in archivos if i.filename.lower().endswith(EXTENSIONES_CAPA)]
+
+    capas, presupuesto = [], max_bytes
+    for info in capas_zip:
+        etiqueta = os.path.splitext(info.filename)[0]
+        if not info.filename.lower().endswith(".shp"):
+            datos, presupuesto = _leer_miembro(zip_ref, info, presupuesto)
+            try:
+                capas += _capas_archivo(datos, etiqueta)
+            except pyogrio.errors.DataSourceError:
+                pass  # Un .json que no es GeoJSON (metadatos, estilos...) no es una capa
+            continue
+        # Los archivos del shapefile se reempaquetan en memoria (sin comprimir) en la raíz de un
+        # ZIP propio, que GDAL sabe abrir aunque vinieran en una carpeta o junto a otros. Así
+        # también pasan por la descompresión contada: GDAL nunca lee el ZIP original
+        paquete = BytesIO()
+        with zipfile.ZipFile(paquete, "w", zipfile.ZIP_STORED) as destino:
+            for extension in COMPLEMENTOS_SHP:
+                complemento = por_nombre.get(etiqueta.lower() + extension)
+                if complemento is not None:
+                    datos, presupuesto = _leer_miembro(zip_ref, complemento, presupuesto)
+                    destino.writestr("capa" + extension, datos)
+        capas.append((etiqueta, _leer(paquete.getvalue())))
+    return capas
+
+
+def leer_capas_usuario(origen, nombre=None, max_bytes=MAX_BYTES_CARGA):
+    """Todas las capas con geometría de una carga: [(etiqueta, GeoDataFrame)].
+
+    origen es una ruta o los bytes del archivo (nombre, el nombre original, indica el formato).
+    Lanza ArchivoRechazado si el archivo supera los límites.
+    """
+    nombre = nombre or (origen if isinstance(origen, str) else "")
+    tamano = len(origen) if isinstance(origen, bytes) else os.path.getsize(origen)
+    if tamano > max_bytes:
+        raise ArchivoRechazado(f"El archivo supera el tamaño máximo permitido de {max_bytes // 2**20} MB.")
+
+    es_zip = nombre.lower().endswith(".zip") if nombre else origen[:4] == b"PK\x03\x04"
+    if not es_zip:
+        return _capas_archivo(origen, os.path.splitext(os.path.basename(nombre))[0] or "capa")
+    try:
+        with zipfile.ZipFile(BytesIO(origen) if isinstance(origen, bytes) else origen) as zip_ref:
+            return _capas_zip(zip_ref, max_bytes)
+    except zipfile.BadZipFile:
+        raise ArchivoRechazado("El archivo cargado no es un ZIP válido.")
+
+
+def leer_capa_usuario(origen, nombre=None, max_bytes=MAX_BYTES_CARGA):
+    """La capa del usuario como un solo GeoDataFrame, o None si la carga no trae ninguna capa.
+
+    Si hay varias capas se unen en el CRS de la primera, con su origen en la columna 'capa'.
+    """
+    capas = leer_capas_usuario(origen, nombre=nombre, max_bytes=max_bytes)
+    if not capas:
+        return None
+    if len(capas) == 1:
+        return capas[0][1]
+    sin_crs = [etiqueta for etiqueta, gdf in capas if gdf.crs is None]
+    if sin_crs:
+        raise ArchivoRechazado(f"No se pueden combinar las capas: {', '.join(sin_crs)} no tiene(n) CRS definido.")
+    crs = capas[0][1].crs
+    return gpd.GeoDataFrame(
+        pd.concat([gdf.to_crs(crs).assign(capa=etiqueta) for etiqueta, gdf in capas], ignore_index=True),
+        crs=crs,
+    )
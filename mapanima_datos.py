@@ -0,0 +1,808 @@
+# --- MAPANIMA: CAPA DE DATOS (sin Streamlit) ---
+# Funciones de carga y caché del dataset principal que no dependen de la interfaz,
+# para poder reutilizarlas desde el visor y desde otros scripts.
+
+import os
+import hashlib
+import json
+import time
+import codecs
+import zipfile
+import contextlib
+import tempfile
+from io import BytesIO
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import pyogrio
+import pyogrio.errors
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from mapanima_traslape import proyectar_dataset
+from mapanima_metricas import etapa, contar_vertices
+
+# Carpeta del caché persistente. Se puede cambiar con la variable de entorno MAPANIMA_CACHE_DIR.
+DIR_CACHE = os.environ.get(
+    "MAPANIMA_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache_mapanima")
+)
+
+# Se incrementa cada vez que cambia la normalización del dataset, para invalidar los cachés viejos.
+VERSION_CACHE = 4
+
+
+def _hash_corto(texto):
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()[:16]
+
+
+def _leer_json(ruta):
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _escribir_json(ruta, datos):
+    ruta_tmp = ruta + ".tmp"
+    with open(ruta_tmp, "w", encoding="utf-8") as f:
+        json.dump(datos, f)
+    os.replace(ruta_tmp, ruta)
+
+
+# --- HTTP compartido: conexiones reutilizadas, tiempos límite y reintentos con espera ---
+TIMEOUT_HTTP = (10, 60)  # (conexión, lectura) en segundos
+REINTENTOS_HTTP = 3
+ESPERA_REINTENTO = 0.5  # Espera base del backoff exponencial: 0.5 s, 1 s, 2 s...
+# Tiempo durante el que se reutiliza la URL directa resuelta de un enlace de OneDrive
+TTL_URL_DIRECTA = 60 * 60
+
+
+def crear_sesion_http(reintentos=REINTENTOS_HTTP, espera=ESPERA_REINTENTO):
+    """Sesión de requests con pool de conexiones y reintentos ante fallos transitorios.
+
+    Reintenta errores de conexión y respuestas 429/5xx de GET/HEAD (respetando Retry-After).
+    Un corte a mitad del cuerpo no lo reintenta urllib3: de eso se encarga descargar_zip,
+    que reanuda desde el fragmento ya escrito.
+    """
+    reintento = Retry(
+        total=reintentos, connect=reintentos, read=reintentos, status=reintentos,
+        backoff_factor=espera, status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET", "HEAD"), respect_retry_after_header=True, raise_on_status=False,
+    )
+    adaptador = HTTPAdapter(max_retries=reintento, pool_connections=4, pool_maxsize=8)
+    sesion = requests.Session()
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    sesion.headers["User-Agent"] = "Mapanima"
+    return sesion
+
+
+# Una sola sesión por proceso, compartida por el visor, el actualizador y la línea de comandos
+SESION_HTTP = crear_sesion_http()
+
+
+class _CorteDescarga(Exception):
+    """La conexión se cortó con el cuerpo ya empezado: se reanuda desde el fragmento en disco."""
+
+
+def descargar_zip(url, timeout=TIMEOUT_HTTP, tam_bloque=1024 * 1024, clave=None):
+    """Descarga el ZIP remoto por bloques directamente a disco (memoria acotada).
+
+    - Si ya hay una copia completa, envía If-None-Match / If-Modified-Since: un 304 cuesta
+      una petición y no una descarga.
+    - Si quedó una descarga a medias (.part), la reanuda con Range + If-Range. Un corte de la
+      conexión durante la descarga se reintenta así, sin volver a bajar lo ya recibido.
+      Los fallos antes de empezar el cuerpo (conexión rechazada, sin respuesta) solo los
+      reintenta la sesión HTTP: reintentarlos también aquí multiplicaría los intentos.
+
+    clave identifica el archivo en el caché (por defecto la misma URL): permite descargar de
+    una URL directa que cambia con el tiempo y guardar bajo el enlace estable de origen.
+
+    Devuelve (ruta_zip, huella), donde la huella es el SHA-256 del contenido.
+    """
+    for intento in range(REINTENTOS_HTTP + 1):
+        try:
+            return _descargar_zip(url, clave or url, timeout, tam_bloque)
+        except _CorteDescarga as corte:
+            if intento == REINTENTOS_HTTP:
+                raise corte.__cause__
+            time.sleep(ESPERA_REINTENTO * 2 ** intento)
+
+
+def _descargar_zip(url, clave, timeout, tam_bloque):
+    os.makedirs(DIR_CACHE, exist_ok=True)
+    base = os.path.join(DIR_CACHE, _hash_corto(clave))
+    ruta_zip, ruta_meta = base + ".zip", base + ".json"
+    ruta_part, ruta_meta_part = base + ".zip.part", base + ".zip.part.json"
+
+    meta = _leer_json(ruta_meta) if os.path.exists(ruta_zip) else None
+    meta_part = _leer_json(ruta_meta_part) if os.path.exists(ruta_part) else None
+
+    headers = {}
+    ya_descargado = 0
+    if meta_part and (meta_part.get("etag") or meta_part.get("last_modified")):
+        # Reanudar: el servidor responde 206 solo si el archivo sigue siendo el mismo
+        ya_descargado = os.path.getsize(ruta_part)
+        headers["Range"] = f"bytes={ya_descargado}-"
+        headers["If-Range"] = meta_part.get("etag") or meta_part["last_modified"]
+    elif meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with SESION_HTTP.get(url, headers=headers, stream=True, timeout=timeout) as r:
+        if r.status_code == 304 and meta:
+            return ruta_zip, meta["sha256"]
+        if r.status_code == 416 and ya_descargado:
+            # El fragmento local no corresponde al archivo remoto: se descarta y se empieza de cero
+            os.remove(ruta_part)
+            os.remove(ruta_meta_part)
+            return _descargar_zip(url, clave, timeout, tam_bloque)
+        r.raise_for_status()
+
+        validadores = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+        sha = hashlib.sha256()
+        if r.status_code == 206 and ya_descargado:
+            # Se recalcula el hash de lo que ya estaba en disco antes de seguir agregando
+            with open(ruta_part, "rb") as f:
+                for bloque in iter(lambda: f.read(tam_bloque), b""):
+                    sha.update(bloque)
+            modo = "ab"
+        else:
+            modo = "wb"
+        _escribir_json(ruta_meta_part, validadores)
+
+        with open(ruta_part, modo) as f:
+            try:
+                for bloque in r.iter_content(chunk_size=tam_bloque):
+                    if bloque:
+                        f.write(bloque)
+                        sha.update(bloque)
+            except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError) as e:
+                raise _CorteDescarga() from e
+
+    os.replace(ruta_part, ruta_zip)
+    huella = "sha256:" + sha.hexdigest()
+    _escribir_json(ruta_meta, dict(validadores, sha256=huella))
+    os.remove(ruta_meta_part)
+    return ruta_zip, huella
+
+
+def ruta_cache(url, huella):
+    # Un archivo por URL + huella: <hash_url>_<hash_huella>.parquet
+    return os.path.join(DIR_CACHE, f"{_hash_corto(url)}_{_hash_corto(f'{VERSION_CACHE}|{huella}')}.parquet")
+
+
+def _borrar(ruta):
+    # Otro hilo (el actualizador, otra sesión) puede haber borrado ya el archivo
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(ruta)
+
+
+def leer_cache(url, huella):
+    """Devuelve el GeoDataFrame normalizado guardado para (url, huella), o None si no existe."""
+    if not huella:
+        return None
+    ruta = ruta_cache(url, huella)
+    if not os.path.exists(ruta):
+        return None
+    try:
+        return gpd.read_parquet(ruta)
+    except Exception:
+        # Archivo corrupto o de una versión incompatible (o borrado mientras se leía): se
+        # descarta y se reconstruye
+        _borrar(ruta)
+        return None
+
+
+def guardar_cache(gdf, url, huella):
+    """Guarda el GeoDataFrame normalizado como GeoParquet y borra las versiones anteriores de la misma URL."""
+    os.makedirs(DIR_CACHE, exist_ok=True)
+    ruta = ruta_cache(url, huella)
+    ruta_tmp = ruta + ".tmp"
+    gdf.to_parquet(ruta_tmp, index=False)
+    os.replace(ruta_tmp, ruta)  # Escritura atómica: nunca queda un parquet a medio escribir
+
+    # Se borran las versiones anteriores de la misma URL (dataset y archivos derivados)
+    prefijo = _hash_corto(url) + "_"
+    vigente = os.path.basename(ruta)[:-len(".parquet")]
+    for nombre in os.listdir(DIR_CACHE):
+        if nombre.startswith(prefijo) and nombre.endswith((".parquet", ".json")) and not nombre.startswith(vigente):
+            _borrar(os.path.join(DIR_CACHE, nombre))
+    return ruta
+
+
+# --- Pirámide de geometrías simplificadas ---
+# Tolerancias fijas (grados, EPSG:4326) entre las que elige el control deslizante del visor
+NIVELES_SIMPLIFICACION = [0.00001, 0.00005, 0.0001, 0.0002, 0.0005, 0.001]
+# Nivel con el que arranca el control (y que se prepara antes de publicar cada versión)
+TOLERANCIA_POR_DEFECTO = 0.0001
+
+
+def construir_piramide(gdf, niveles=NIVELES_SIMPLIFICACION):
+    """Geometrías simplificadas (preservando topología) para cada nivel: {tolerancia: GeoSeries}.
+
+    Las series conservan el índice de gdf para poder seleccionar las mismas filas que el filtro.
+    """
+    return {t: gdf.geometry.simplify(t, preserve_topology=True) for t in niveles}
+
+
+def _ruta_derivado(url, huella, nombre):
+    # Los archivos derivados comparten el prefijo del dataset: se invalidan y borran con él
+    return ruta_cache(url, huella)[:-len(".parquet")] + f"_{nombre}.parquet"
+
+
+def guardar_derivado(gdf, url, huella, nombre):
+    """Guarda un GeoDataFrame derivado del dataset (pirámide, copia proyectada...) junto a su caché."""
+    os.makedirs(DIR_CACHE, exist_ok=True)
+    ruta = _ruta_derivado(url, huella, nombre)
+    gdf.to_parquet(ruta + ".tmp")
+    os.replace(ruta + ".tmp", ruta)
+
+
+def leer_derivado(url, huella, nombre):
+    """Devuelve el GeoDataFrame derivado guardado para (url, huella), o None si no existe."""
+    ruta = _ruta_derivado(url, huella, nombre)
+    if not huella or not os.path.exists(ruta):
+        return None
+    try:
+        return gpd.read_parquet(ruta)
+    except Exception:
+        _borrar(ruta)
+        return None
+
+
+def guardar_piramide(piramide, url, huella):
+    """Guarda la pirámide junto al dataset en caché, un GeoParquet con una columna geométrica por nivel."""
+    columnas = {f"t_{t}": serie for t, serie in piramide.items()}
+    guardar_derivado(gpd.GeoDataFrame(columnas, geometry=next(iter(columnas))), url, huella, "piramide")
+
+
+def leer_piramide(url, huella):
+    """Devuelve la pirámide guardada para (url, huella), o None si no existe."""
+    gdf_piramide = leer_derivado(url, huella, "piramide")
+    if gdf_piramide is None:
+        return None
+    return {float(col[2:]): gdf_piramide[col] for col in gdf_piramide.columns if col.startswith("t_")}
+
+
+# --- Tipado compacto y normalización de columnas al cargar ---
+# Columnas que el visor compara en minúsculas (filtros, búsquedas y tooltips)
+COLUMNAS_NORMALIZADAS = ['etapa', 'estado_act', 'cn_ci', 'departamen', 'nom_terr', 'id_rtdaf', 'tipologia']
+# De ellas, las de pocos valores distintos se guardan siempre como categóricas
+COLUMNAS_CATEGORICAS = ['etapa', 'estado_act', 'cn_ci', 'departamen', 'tipologia']
+# Las demás columnas de texto pasan a categóricas si tienen a lo sumo esta fracción de valores distintos
+UMBRAL_CATEGORIA = 0.5
+
+# Texto respaldado por Arrow (un solo buffer contiguo) en lugar de objetos str de Python
+try:
+    import pyarrow  # noqa: F401
+    TIPO_TEXTO = pd.StringDtype("pyarrow")
+except ImportError:
+    TIPO_TEXTO = pd.StringDtype()
+
+
+def tipar_columnas(gdf, umbral_categoria=UMBRAL_CATEGORIA):
+    """Asigna a cada columna un tipo compacto según su contenido, en lugar de pasarlo todo a str.
+
+    - Números: se conservan numéricos (los enteros se reducen al menor tipo que los contiene).
+    - Fechas y booleanos: se conservan.
+    - Texto: categórico si tiene pocos valores distintos, texto Arrow si no. Los vacíos quedan como ''.
+    """
+    for col in gdf.columns:
+        if col == gdf.geometry.name:
+            continue
+        serie = gdf[col]
+        if pd.api.types.is_bool_dtype(serie) or pd.api.types.is_datetime64_any_dtype(serie):
+            continue
+        if pd.api.types.is_integer_dtype(serie):
+            gdf[col] = pd.to_numeric(serie, downcast="integer")
+        elif pd.api.types.is_float_dtype(serie):
+            continue
+        else:
+            texto = serie.astype(TIPO_TEXTO).fillna('')
+            if len(texto) and texto.nunique() / len(texto) <= umbral_categoria:
+                texto = texto.astype("category")
+            gdf[col] = texto
+    return gdf
+
+
+def normalizar_columnas(gdf):
+    """Pasa a minúsculas las columnas de filtro una sola vez, en el pipeline de carga.
+
+    Las columnas que falten se crean vacías para que el visor no tenga que comprobarlo.
+    """
+    for col in COLUMNAS_NORMALIZADAS:
+        if col in gdf.columns:
+            gdf[col] = gdf[col].astype(TIPO_TEXTO).fillna('').str.lower()
+        else:
+            gdf[col] = pd.Series('', index=gdf.index, dtype=TIPO_TEXTO)
+        if col in COLUMNAS_CATEGORICAS:
+            gdf[col] = gdf[col].astype("category")
+    return gdf
+
+
+def reporte_memoria(gdf):
+    """Memoria aproximada por columna (bytes): atributos con memory_usage(deep=True) y, para
+    la geometría, 16 bytes por coordenada además de los punteros."""
+    filas = []
+    for col in gdf.columns:
+        tamano = int(gdf[col].memory_usage(deep=True, index=False))
+        if col == gdf.geometry.name:
+            tamano += int(shapely.get_num_coordinates(np.asarray(gdf[col].values)).sum()) * 16
+        filas.append({"columna": col, "tipo": str(gdf[col].dtype), "bytes": tamano})
+    return pd.DataFrame(filas)
+
+
+# --- Índices invertidos para los filtros del visor ---
+# Columnas categóricas sobre las que filtra la barra lateral (nombre e ID van por mapanima_busqueda)
+COLUMNAS_FILTRO = ["etapa", "estado_act", "cn_ci", "departamen"]
+
+
+def construir_indices(gdf, columnas=COLUMNAS_FILTRO):
+    """Para cada columna, un diccionario valor -> arreglo ordenado de posiciones de fila.
+
+    Se construye una sola vez; luego cada combinación de filtros se resuelve con
+    intersecciones de enteros en lugar de máscaras booleanas sobre el GeoDataFrame.
+    """
+    indices = {}
+    for col in columnas:
+        if col not in gdf.columns:
+            continue
+        codigos, unicos = pd.factorize(gdf[col].astype(str).to_numpy(), sort=True)
+        orden = np.argsort(codigos, kind="stable")  # estable: posiciones ordenadas dentro de cada valor
+        limites = np.searchsorted(codigos[orden], np.arange(len(unicos) + 1))
+        indices[col] = {valor: orden[limites[i]:limites[i + 1]] for i, valor in enumerate(unicos)}
+    return indices
+
+
+def filtrar_posiciones(indices, n_filas, selecciones):
+    """Posiciones de fila que cumplen todos los filtros.
+
+    selecciones: {columna: [valores]}; una lista vacía significa "sin filtro" en esa columna.
+    Dentro de una columna los valores se unen (OR) y entre columnas se intersectan (AND).
+    """
+    resultado = None
+    for col, valores in selecciones.items():
+        if not valores:
+            continue
+        indice = indices.get(col, {})
+        partes = [indice[v] for v in valores if v in indice]
+        posiciones = np.unique(np.concatenate(partes)) if partes else np.empty(0, dtype=np.intp)
+        resultado = posiciones if resultado is None else np.intersect1d(resultado, posiciones, assume_unique=True)
+    return np.arange(n_filas) if resultado is None else resultado
+
+
+# --- Carga completa del dataset principal ---
+
+def _sin_avisos(nivel, mensaje):
+    pass
+
+
+# Enlace de OneDrive -> (URL directa, instante en que se resolvió)
+_URLS_DIRECTAS = {}
+
+
+def onedrive_a_directo(url_onedrive, avisar=_sin_avisos, ttl=TTL_URL_DIRECTA):
+    """Convierte un enlace corto de OneDrive (1drv.ms) en el enlace de descarga directa.
+
+    La resolución se memoriza durante ttl segundos. Si al renovarla OneDrive falla, se sigue
+    usando la última URL directa conocida.
+    """
+    if "1drv.ms" not in url_onedrive:
+        return url_onedrive
+    memorizada = _URLS_DIRECTAS.get(url_onedrive)
+    if memorizada and time.monotonic() - memorizada[1] < ttl:
+        return memorizada[0]
+    try:
+        # stream=True: solo interesa la URL final de las redirecciones, no el cuerpo
+        with SESION_HTTP.get(url_onedrive, allow_redirects=True, stream=True, timeout=TIMEOUT_HTTP) as r:
+            r.raise_for_status()
+            directa = r.url.replace("redir?", "download?").replace("redir=", "download=")
+        _URLS_DIRECTAS[url_onedrive] = (directa, time.monotonic())
+        return directa
+    except requests.exceptions.RequestException as e:
+        if memorizada:
+            avisar("warning", f"⚠️ No se pudo renovar el enlace directo de OneDrive ({e}). Se usa el último enlace conocido.")
+            return memorizada[0]
+        avisar("error", f"❌ Error al convertir URL de OneDrive a directa: {e}. Asegúrate de que la URL sea válida y accesible.")
+        return url_onedrive
+
+
+# --- Actualización incremental ---
+# Cada versión en caché guarda, junto al dataset, una huella por fila del shapefile de origen
+# (atributos y WKB de la geometría). Cuando llega una versión nueva del ZIP, las filas cuyo
+# id_rtdaf y geometría no cambiaron reutilizan el trabajo geométrico de la versión anterior
+# (reproyecciones, área, pirámide y copia en CTM12); solo se procesan las nuevas o modificadas.
+COLUMNA_ID = "id_rtdaf"
+
+
+def huellas_filas(gdf):
+    """DataFrame alineado con gdf: id, hash de los atributos y hash del WKB de la geometría."""
+    atributos = pd.DataFrame(gdf.drop(columns=gdf.geometry.name)).astype(str)
+    wkb = shapely.to_wkb(gdf.geometry.values)
+    h_geometria = np.frombuffer(
+        b"".join(hashlib.blake2b(w if w is not None else b"", digest_size=8).digest() for w in wkb), dtype="<u8"
+    )
+    return pd.DataFrame({
+        "id": gdf[COLUMNA_ID].astype(str).to_numpy() if COLUMNA_ID in gdf.columns else np.full(len(gdf), ""),
+        "h_atributos": pd.util.hash_pandas_object(atributos, index=False).to_numpy(),
+        "h_geometria": h_geometria,
+    })
+
+
+def _ruta_meta(url, huella):
+    return ruta_cache(url, huella)[:-len(".parquet")] + "_meta.json"
+
+
+def _descripcion_origen(gdf):
+    # Si cambia algo de esto, las geometrías anteriores no son comparables y se reconstruye todo
+    return {
+        "version": VERSION_CACHE,
+        "crs": gdf.crs.to_string() if gdf.crs is not None else None,
+        "columnas": [c for c in gdf.columns if c != gdf.geometry.name],
+        "niveles": NIVELES_SIMPLIFICACION,
+    }
+
+
+def guardar_huellas(filas, descripcion, url, huella):
+    """Guarda las huellas por fila y la descripción del origen de esta versión."""
+    ruta = _ruta_derivado(url, huella, "filas")
+    filas.to_parquet(ruta + ".tmp", index=False)
+    os.replace(ruta + ".tmp", ruta)
+    _escribir_json(_ruta_meta(url, huella), dict(descripcion, huella=huella))
+
+
+def _ultima_meta(url, excluir=None):
+    """Descripción de la versión en caché más reciente de la URL (sin contar la huella `excluir`)."""
+    if not os.path.isdir(DIR_CACHE):
+        return None
+    prefijo = _hash_corto(url) + "_"
+    excluido = os.path.basename(_ruta_meta(url, excluir)) if excluir else None
+    candidatos = [
+        os.path.join(DIR_CACHE, n) for n in os.listdir(DIR_CACHE)
+        if n.startswith(prefijo) and n.endswith("_meta.json") and n != excluido
+    ]
+    if not candidatos:
+        return None
+    return _leer_json(max(candidatos, key=os.path.getmtime))
+
+
+def leer_ultima_version(url):
+    """Última versión del dataset guardada en disco para la URL, sin consultar el origen.
+
+    Permite arrancar el visor al instante tras un reinicio y dejar la revisión del origen
+    para el actualizador en segundo plano. Devuelve None si no hay ninguna versión en caché.
+    """
+    meta = _ultima_meta(url)
+    if not meta or meta.get("version") != VERSION_CACHE:
+        return None
+    gdf = leer_cache(url, meta["huella"])
+    if gdf is not None:
+        gdf.attrs["huella"] = meta["huella"]
+    return gdf
+
+
+def leer_version_anterior(url, huella, descripcion, filas):
+    """Versión anterior en caché de la misma URL, comparada fila a fila con el shapefile nuevo.
+
+    Devuelve None si no hay una versión anterior comparable (otro CRS, otras columnas, otra
+    versión del caché o IDs repetidos). Si la hay, un diccionario con:
+    reutilizar (máscara de filas nuevas cuya geometría no cambió), posiciones (fila anterior
+    de cada una), gdf, piramide, gdf_9377 anteriores y el resumen de cambios.
+    """
+    if not filas["id"].is_unique or (filas["id"] == "").any():
+        return None
+    meta = _ultima_meta(url, excluir=huella)
+    if not meta or dict(meta, huella=None) != dict(descripcion, huella=None):
+        return None
+
+    huella_anterior = meta["huella"]
+    try:
+        filas_anteriores = pd.read_parquet(_ruta_derivado(url, huella_anterior, "filas"))
+    except Exception:
+        return None
+    gdf_anterior = leer_cache(url, huella_anterior)
+    piramide_anterior = leer_piramide(url, huella_anterior)
+    gdf_9377_anterior = leer_derivado(url, huella_anterior, "9377")
+    if gdf_anterior is None or piramide_anterior is None or gdf_9377_anterior is None or not filas_anteriores["id"].is_unique:
+        return None
+
+    # Emparejamiento por id: posición anterior de cada fila nueva (-1 si es nueva)
+    indice_anterior = pd.Index(filas_anteriores["id"])
+    posiciones = indice_anterior.get_indexer(filas["id"])
+    existe = posiciones >= 0
+    pos_validas = posiciones[existe]
+    misma_geometria = np.zeros(len(filas), dtype=bool)
+    misma_geometria[existe] = filas["h_geometria"].to_numpy()[existe] == filas_anteriores["h_geometria"].to_numpy()[pos_validas]
+    mismos_atributos = np.zeros(len(filas), dtype=bool)
+    mismos_atributos[existe] = filas["h_atributos"].to_numpy()[existe] == filas_anteriores["h_atributos"].to_numpy()[pos_validas]
+
+    return {
+        "reutilizar": misma_geometria,
+        "posiciones": posiciones,
+        "gdf": gdf_anterior,
+        "piramide": piramide_anterior,
+        "gdf_9377": gdf_9377_anterior,
+        "resumen": {
+            "nuevos": int((~existe).sum()),
+            "geometria_modificada": int((existe & ~misma_geometria).sum()),
+            "solo_atributos": int((misma_geometria & ~mismos_atributos).sum()),
+            "sin_cambios": int((misma_geometria & mismos_atributos).sum()),
+            "eliminados": int(len(filas_anteriores) - existe.sum()),
+        },
+    }
+
+
+def _combinar(reutilizar, anteriores, nuevos):
+    """Arreglo de geometrías (u otros valores) alineado con el dataset nuevo: los de la versión
+    anterior donde reutilizar es True y los recién calculados en el resto."""
+    resultado = np.empty(len(reutilizar), dtype=object)
+    resultado[reutilizar] = np.asarray(anteriores, dtype=object)
+    resultado[~reutilizar] = np.asarray(nuevos, dtype=object)
+    return resultado
+
+
+# --- Lectura del shapefile principal ---
+# Columnas del shapefile que usa la aplicación (filtros, búsqueda, tabla, tooltips, teselas y
+# traslape); el resto de atributos no se carga en el dataset en memoria. El shapefile exportado
+# sí lleva todos los atributos: se leen del ZIP de origen al exportar (leer_atributos_origen)
+COLUMNAS_DATASET = ["id_rtdaf", "nom_terr", "etnia", "departamen", "municipio", "etapa", "estado_act", "tipologia", "cn_ci", "area_ha"]
+
+# Codificación según el identificador de idioma (LDID) del encabezado DBF, byte 29
+CODIFICACIONES_LDID = {
+    0x01: "CP437", 0x02: "CP850", 0x03: "CP1252", 0x57: "CP1252", 0x58: "CP1252", 0x59: "CP1252",
+    0x64: "CP852", 0x65: "CP866", 0x66: "CP865", 0xC8: "CP1250", 0xC9: "CP1251", 0xCA: "CP1254", 0xCB: "CP1253",
+}
+
+
+def _codificacion_cpg(texto):
+    """Nombre de codificación a partir del contenido de un .cpg ('UTF-8', '1252', '88591'...)."""
+    texto = texto.strip().upper()
+    if texto in ("UTF-8", "UTF8", "65001"):
+        return "UTF-8"
+    if texto.isdigit():
+        return {"88591": "ISO-8859-1", "28591": "ISO-8859-1"}.get(texto, f"CP{texto}")
+    try:
+        return codecs.lookup(texto).name.upper()
+    except LookupError:
+        return None
+
+
+def detectar_codificacion(zip_ref, ruta_shp, tam_bloque=1024 * 1024):
+    """Codificación de los atributos de un shapefile dentro de un ZIP, sin leerlo dos veces.
+
+    En orden: el .cpg, el LDID del encabezado DBF y, si ninguno la indica, una revisión de los
+    bytes de los registros: UTF-8 si decodifican como UTF-8, si no CP1252 (latin1 de Windows).
+    """
+    base = os.path.splitext(ruta_shp)[0].lower()
+    miembros = {n.lower(): n for n in zip_ref.namelist()}
+    if base + ".cpg" in miembros:
+        codificacion = _codificacion_cpg(zip_ref.read(miembros[base + ".cpg"]).decode("ascii", "ignore"))
+        if codificacion:
+            return codificacion
+    if base + ".dbf" not in miembros:
+        return "UTF-8"
+    with zip_ref.open(miembros[base + ".dbf"]) as dbf:
+        encabezado = dbf.read(32)
+        if len(encabezado) == 32 and encabezado[29] in CODIFICACIONES_LDID:
+            return CODIFICACIONES_LDID[encabezado[29]]
+        # Los registros empiezan después del encabezado (su longitud está en los bytes 8-9)
+        dbf.read(max(int.from_bytes(encabezado[8:10], "little") - 32, 0))
+        decodificador = codecs.getincrementaldecoder("utf-8")()
+        try:
+            for bloque in iter(lambda: dbf.read(tam_bloque), b""):
+                decodificador.decode(bloque)
+            decodificador.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "CP1252"
+    return "UTF-8"
+
+
+def leer_shapefile(ruta, codificacion=None, columnas=COLUMNAS_DATASET):
+    """Lee el shapefile con el motor columnar de pyogrio (Arrow) y solo las columnas indicadas
+    que existan (columnas=None lee todas)."""
+    if columnas is not None:
+        campos = set(pyogrio.read_info(ruta, encoding=codificacion)["fields"])
+        columnas = [c for c in columnas if c in campos]
+    return gpd.read_file(ruta, engine="pyogrio", use_arrow=True, columns=columnas, encoding=codificacion)
+
+
+def cargar_dataset(url, avisar=_sin_avisos, crs_por_defecto="EPSG:9377", huella_vigente=None):
+    """Descarga, lee y normaliza el shapefile principal (o lo toma del caché en disco).
+
+    url es la URL de origen tal como está configurada (puede ser un enlace 1drv.ms): se
+    resuelve aquí y todo el caché en disco queda asociado a ella.
+
+    avisar(nivel, mensaje) recibe los avisos para el usuario, con nivel "info", "warning" o
+    "error": el visor los muestra con st.info/st.warning/st.error y la línea de comandos los
+    imprime. Devuelve el GeoDataFrame en EPSG:4326 con attrs["huella"], o None si el ZIP no
+    trae un shapefile legible. Los errores de descarga se propagan al llamador.
+
+    huella_vigente es la versión que el llamador ya tiene: si el ZIP no cambió (304 o mismo
+    contenido) se devuelve None enseguida, sin volver a leer el GeoParquet del caché.
+
+    Si hay en caché una versión anterior del mismo origen, solo las filas nuevas o con
+    geometría modificada pasan por reproyección, cálculo de área y simplificación.
+    """
+    # --- Descarga por bloques a disco, condicional (304) y reanudable ---
+    # El caché se identifica con la URL de origen (estable); la descarga usa la URL directa
+    with etapa("descarga") as m:
+        ruta_zip, huella = descargar_zip(onedrive_a_directo(url, avisar=avisar), clave=url)
+        m["bytes"] = os.path.getsize(ruta_zip)
+        m["sin_cambios"] = huella == huella_vigente
+    if huella == huella_vigente:
+        return None
+
+    # --- Caché persistente en disco (GeoParquet ya normalizado) ---
+    # Si el contenido no ha cambiado, se evita todo el procesamiento
+    with etapa("lectura_cache") as m:
+        gdf = leer_cache(url, huella)
+        m["acierto"] = gdf is not None
+        m["filas"] = 0 if gdf is None else len(gdf)
+    if gdf is not None:
+        gdf.attrs["huella"] = huella  # Versión del dataset, para los recursos derivados
+        return gdf
+
+    # --- Lectura columnar directamente del ZIP (sin extraerlo), solo de las columnas usadas ---
+    with etapa("lectura_shapefile") as m, zipfile.ZipFile(ruta_zip) as zip_ref:
+        shp = [n for n in zip_ref.namelist() if n.lower().endswith(".shp") and not n.startswith("__MACOSX/")]
+        if not shp:
+            avisar("error", "❌ Error: No se encontró ningún archivo .shp en el ZIP descargado. Asegúrate de que el ZIP contenga un shapefile válido.")
+            return None
+        codificacion = detectar_codificacion(zip_ref, shp[0])
+        try:
+            gdf = leer_shapefile(f"/vsizip/{ruta_zip}/{shp[0]}", codificacion=codificacion)
+        except Exception as e:
+            avisar("error", f"❌ Error crítico: No se pudo cargar el shapefile (codificación {codificacion}). (Detalle: {e})")
+            return None
+        m["codificacion"] = codificacion
+        m["columnas"] = len(gdf.columns) - 1
+        m["filas"] = len(gdf)
+        m["vertices"] = contar_vertices(gdf.geometry.values)
+
+    # Si no hay CRS se asume el CRS por defecto para Colombia (CTM12/EPSG:9377)
+    if gdf.crs is None and "EPSG:9377" in str(crs_por_defecto):
+        avisar("info", "ℹ️ CRS no detectado en el shapefile principal. Asumiendo EPSG:9377 para cálculo de área.")
+        gdf.set_crs(epsg=9377, allow_override=True, inplace=True)
+
+    # --- Diferencias con la versión anterior en caché (por id_rtdaf y hash de geometría) ---
+    with etapa("diferencias", filas=len(gdf)) as m:
+        descripcion = _descripcion_origen(gdf)
+        filas = huellas_filas(gdf)
+        anterior = leer_version_anterior(url, huella, descripcion, filas)
+        if anterior is not None:
+            m.update(anterior["resumen"])
+    reutilizar = anterior["reutilizar"] if anterior is not None else np.zeros(len(gdf), dtype=bool)
+    procesar = ~reutilizar  # Filas que necesitan el trabajo geométrico completo
+    pos_anterior = anterior["posiciones"][reutilizar] if anterior is not None else None
+    if anterior is not None:
+        r = anterior["resumen"]
+        avisar("info", (
+            f"ℹ️ Actualización incremental: {r['nuevos']} territorios nuevos, {r['geometria_modificada']} con límites "
+            f"modificados, {r['solo_atributos']} con solo atributos modificados y {r['eliminados']} eliminados."
+        ))
+
+    # --- Cálculo de área preciso en CTM12 ---
+    geometria_9377 = None  # Se conserva para la copia proyectada que usa el traslape
+    if 'area_ha' not in gdf.columns:
+        avisar("warning", "⚠️ La columna 'area_ha' no fue encontrada en los datos principales. Calculando el área en hectáreas de los polígonos con reproyección para mayor precisión.")
+        gdf_for_area_calc = gdf[procesar]
+        # Reproyectar a EPSG:9377 (CTM12) si no está ya en un CRS proyectado en metros
+        if gdf_for_area_calc.crs is None or gdf_for_area_calc.crs.is_geographic or (gdf_for_area_calc.crs.is_projected and gdf_for_area_calc.crs.to_epsg() != 9377):
+            avisar("info", "Reproyectando temporalmente a EPSG:9377 para el cálculo de área.")
+            with etapa("reproyeccion_9377", filas=len(gdf_for_area_calc)):
+                gdf_for_area_calc = gdf_for_area_calc.to_crs(epsg=9377)
+        # Calcular área en m^2 y convertir a hectáreas (1 ha = 10,000 m^2)
+        area_ha = np.empty(len(gdf))
+        area_ha[procesar] = (gdf_for_area_calc.geometry.area / 10000).round(2).to_numpy()
+        if anterior is not None:
+            area_ha[reutilizar] = anterior["gdf"]["area_ha"].to_numpy()[pos_anterior]
+            geometria_9377 = _combinar(reutilizar, anterior["gdf_9377"].geometry.values[pos_anterior], gdf_for_area_calc.geometry.values)
+        else:
+            geometria_9377 = gdf_for_area_calc.geometry
+        gdf['area_ha'] = area_ha
+    else:
+        # Si 'area_ha' ya existe, asegurarse de que sea numérica y sin NaN
+        gdf['area_ha'] = pd.to_numeric(gdf['area_ha'], errors='coerce').fillna(0).round(2)
+
+    if geometria_9377 is None and gdf.crs is not None and gdf.crs.to_epsg() == 9377:
+        geometria_9377 = gdf.geometry
+
+    # El GeoDataFrame final queda en EPSG:4326 para Folium
+    if gdf.crs != "EPSG:4326":
+        avisar("info", "ℹ️ Reproyectando datos a EPSG:4326 para compatibilidad con el mapa.")
+        with etapa("reproyeccion_4326", filas=int(procesar.sum())):
+            if anterior is not None:
+                geometrias = _combinar(reutilizar, anterior["gdf"].geometry.values[pos_anterior], gdf.geometry[procesar].to_crs(epsg=4326).values)
+                gdf = gdf.set_geometry(gpd.GeoSeries(geometrias, index=gdf.index, crs=4326), crs=4326)
+            else:
+                gdf = gdf.to_crs(epsg=4326)
+
+    if geometria_9377 is None and anterior is not None:
+        # Copia en CTM12 solo de las filas modificadas; el resto viene de la versión anterior
+        geometria_9377 = _combinar(reutilizar, anterior["gdf_9377"].geometry.values[pos_anterior], gdf.geometry[procesar].to_crs(epsg=9377).values)
+
+    with etapa("normalizacion", filas=len(gdf)) as m:
+        m["bytes_antes"] = int(reporte_memoria(gdf)["bytes"].sum())
+        # Tipos compactos según el contenido (categóricas, texto Arrow, números y fechas reales)
+        gdf = tipar_columnas(gdf)
+        # Minúsculas y categóricas una sola vez aquí, no en cada rerun del visor
+        gdf = normalizar_columnas(gdf)
+        m["bytes"] = int(reporte_memoria(gdf)["bytes"].sum())
+
+    gdf.attrs["huella"] = huella
+    try:
+        with etapa("escritura_cache", filas=len(gdf)):
+            guardar_cache(gdf, url, huella)
+        # La pirámide de simplificación se calcula aquí, una sola vez, y queda junto al dataset
+        # (en una actualización incremental, solo para las filas modificadas)
+        with etapa("piramide", filas=int(procesar.sum())):
+            piramide = construir_piramide(gdf[procesar])
+            if anterior is not None:
+                piramide = {
+                    t: gpd.GeoSeries(_combinar(reutilizar, anterior["piramide"][t].values[pos_anterior], serie.values), index=gdf.index, crs=gdf.crs)
+                    for t, serie in piramide.items()
+                }
+            guardar_piramide(piramide, url, huella)
+        # Copia en CTM12 para el traslape, reutilizando la reproyección ya hecha
+        with etapa("proyeccion_traslape", filas=len(gdf)):
+            guardar_derivado(proyectar_dataset(gdf, geometria_9377), url, huella, "9377")
+        guardar_huellas(filas, descripcion, url, huella)
+    except Exception as e:
+        avisar("warning", f"⚠️ No se pudo guardar el caché local de datos: {e}")
+    return gdf
+
+
+# --- Exportaciones ---
+
+def leer_atributos_origen(url, huella):
+    """Todos los atributos (sin geometría) del shapefile de origen de la versión huella, con el
+    mismo índice de filas que el dataset de cargar_dataset.
+
+    Se leen del ZIP descargado en caché. Devuelve None si ese ZIP ya es de otra versión (p. ej. el
+    actualizador descargó una nueva) o no trae un shapefile legible.
+    """
+    base = os.path.join(DIR_CACHE, _hash_corto(url))
+    meta = _leer_json(base + ".json")
+    if not meta or meta.get("sha256") != huella:
+        return None
+    try:
+        with zipfile.ZipFile(base + ".zip") as zip_ref:
+            shp = [n for n in zip_ref.namelist() if n.lower().endswith(".shp") and not n.startswith("__MACOSX/")]
+            if not shp:
+                return None
+            codificacion = detectar_codificacion(zip_ref, shp[0])
+        return pd.DataFrame(pyogrio.read_dataframe(
+            f"/vsizip/{base}.zip/{shp[0]}", read_geometry=False, use_arrow=True, encoding=codificacion
+        ))
+    except (OSError, zipfile.BadZipFile, pyogrio.errors.DataSourceError):
+        return None
+
+
+def exportar_shapefile_zip(gdf_filtrado, atributos=None):
+    """Shapefile de gdf_filtrado comprimido en un ZIP en memoria (bytes).
+
+    atributos (leer_atributos_origen) agrega las columnas del origen que el dataset en memoria
+    no carga, alineadas por el índice de filas.
+    """
+    # El driver de shapefile de GDAL solo escribe a disco: los componentes se escriben una vez
+    # y se comprimen directamente a un ZIP en memoria (sin make_archive ni releer el .zip)
+    gdf_filtrado_for_save = gdf_filtrado
+    if atributos is not None:
+        extra = atributos.drop(columns=[c for c in atributos.columns if c in gdf_filtrado.columns])
+        gdf_filtrado_for_save = gdf_filtrado.join(extra, how="left")
+    if gdf_filtrado_for_save.crs is None:
+        gdf_filtrado_for_save = gdf_filtrado_for_save.set_crs(epsg=4326)
+    buffer = BytesIO()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        gdf_filtrado_for_save.to_file(os.path.join(tmpdir, "territorios_filtrados.shp"))
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+            for nombre in sorted(os.listdir(tmpdir)):
+                zf.write(os.path.join(tmpdir, nombre), nombre)
+    return buffer.getvalue()
@@ -0,0 +1,242 @@
+# --- MAPANIMA: GEOJSON PRESERIALIZADO Y TOPOJSON ---
+# Cada territorio se serializa a GeoJSON una sola vez por versión del dataset (y por nivel de
+# simplificación). Un mapa filtrado se arma uniendo los fragmentos de las filas seleccionadas,
+# sin volver a recorrer coordenadas con __geo_interface__ ni json.dumps en cada rerun.
+# Opcionalmente el mapa se codifica como TopoJSON: coordenadas cuantizadas y cada borde
+# compartido entre territorios vecinos se guarda una sola vez.
+
+import json
+
+import numpy as np
+import shapely
+from folium.template import Template
+from folium.elements import JSCSSMixin
+from branca.element import MacroElement
+
+# Propiedades que viajan con cada entidad: las del tooltip y cn_ci para el estilo
+PROPIEDADES_GEOJSON = ["id_rtdaf", "nom_terr", "etnia", "departamen", "municipio", "etapa", "estado_act", "tipologia", "area_formateada", "cn_ci"]
+
+
+def json_para_script(texto):
+    """JSON listo para incrustar dentro de un <script>: '</' se escapa para que no lo cierre."""
+    return texto.replace("</", "<\\/")
+
+
+def area_formateada(area_ha):
+    """Área en el formato del visor: '12 ha + 3,456 m²'."""
+    return area_ha.apply(lambda ha: f"{int(ha)} ha + {int(round((ha - int(ha)) * 10000)):,} m²" if ha >= 0 else "N/A")
+
+
+def serializar_propiedades(gdf, propiedades=PROPIEDADES_GEOJSON):
+    """JSON de las propiedades de cada fila (lista alineada con las posiciones de gdf)."""
+    atributos = gdf.drop(columns=gdf.geometry.name).copy()
+    if "area_formateada" in propiedades and "area_ha" in atributos.columns:
+        atributos["area_formateada"] = area_formateada(atributos["area_ha"])
+    columnas = [c for c in propiedades if c in atributos.columns]
+    # Texto anulable: los vacíos (NaN, NaT) se serializan como '' y no como 'nan'
+    registros = atributos[columnas].astype("string").fillna("").to_dict("records")
+    return [json.dumps(r, ensure_ascii=False) for r in registros]
+
+
+def serializar_entidades(geometrias, propiedades_json):
+    """Fragmentos 'Feature' en bytes, uno por fila, listos para unir en un FeatureCollection."""
+    geojson = shapely.to_geojson(np.asarray(geometrias))
+    fragmentos = np.empty(len(propiedades_json), dtype=object)
+    for i, (props, geom) in enumerate(zip(propiedades_json, geojson)):
+        if geom is None:
+            geom = "null"
+        fragmentos[i] = json_para_script(
+            '{"type":"Feature","id":%d,"properties":%s,"geometry":%s}' % (i, props, geom)
+        ).encode("utf-8")
+    return fragmentos
+
+
+def ensamblar_coleccion(fragmentos, posiciones):
+    """FeatureCollection (bytes) con los fragmentos de las posiciones seleccionadas."""
+    return b'{"type":"FeatureCollection","features":[' + b",".join(fragmentos[posiciones]) + b"]}"
+
+
+# --- TopoJSON ---
+# Cuadrícula de cuantización sobre la extensión del dataset (1e6 pasos ≈ 2 m para Colombia)
+CUANTIZACION = 1_000_000
+OBJETO_TOPOJSON = "territorios"
+
+
+def _poligonos(geom):
+    """Lista de polígonos de una geometría poligonal (vacía para otros tipos)."""
+    if geom is None or geom.is_empty:
+        return []
+    if geom.geom_type == "Polygon":
+        return [geom]
+    if geom.geom_type == "MultiPolygon":
+        return list(geom.geoms)
+    return []
+
+
+def construir_topologia(geometrias, cuantizacion=CUANTIZACION):
+    """Topología de todo el dataset: arcos compartidos ya codificados y referencias por entidad.
+
+    1. Se cuantizan las coordenadas a una cuadrícula entera sobre la extensión total.
+    2. Un punto es nodo (junction) si aparece con más de un par de vecinos distinto; ahí se
+       cortan los anillos en arcos. Los anillos sin nodos se rotan a un inicio canónico.
+    3. Los arcos idénticos (en cualquier sentido) se guardan una sola vez: la referencia es
+       el índice del arco, o ~índice si se recorre al revés.
+    """
+    geometrias = np.asarray(geometrias)
+    x0, y0, x1, y1 = shapely.total_bounds(geometrias)
+    kx = (cuantizacion - 1) / (x1 - x0) if x1 > x0 else 1.0
+    ky = (cuantizacion - 1) / (y1 - y0) if y1 > y0 else 1.0
+
+    # Anillos cuantizados y abiertos (sin repetir el punto final)
+    anillos, estructura = [], []
+    for geom in geometrias:
+        polys = []
+        for poly in _poligonos(geom):
+            ids = []
+            for anillo in [poly.exterior, *poly.interiors]:
+                q = np.round((np.asarray(anillo.coords)[:, :2] - (x0, y0)) * (kx, ky)).astype(np.int64)
+                q = q[np.r_[True, np.any(np.diff(q, axis=0) != 0, axis=1)]]
+                if len(q) > 1 and (q[0] == q[-1]).all():
+                    q = q[:-1]
+                ids.append(len(anillos))
+                anillos.append(q)
+            polys.append(ids)
+        estructura.append(polys)
+
+    # Nodos: puntos visitados con distintos pares de vecinos
+    llaves = [(a[:, 0] << 32) | a[:, 1] for a in anillos]
+    es_nodo = [np.zeros(len(k), dtype=bool) for k in llaves]
+    if anillos:
+        todas = np.concatenate(llaves)
+        previo = np.concatenate([np.roll(k, 1) for k in llaves])
+        siguiente = np.concatenate([np.roll(k, -1) for k in llaves])
+        vecinos = np.stack([todas, np.minimum(previo, siguiente), np.maximum(previo, siguiente)], axis=1)
+        distintos = np.unique(vecinos, axis=0)
+        claves, cuentas = np.unique(distintos[:, 0], return_counts=True)
+        nodos = claves[cuentas > 1]
+        es_nodo = [np.isin(k, nodos) for k in llaves]
+
+    arcos, indice_arcos = [], {}
+
+    def registrar(arco):
+        directo = arco.tobytes()
+        if directo in indice_arcos:
+            return indice_arcos[directo]
+        inverso = arco[::-1].tobytes()
+        if inverso in indice_arcos:
+            return ~indice_arcos[inverso]
+        indice_arcos[directo] = len(arcos)
+        arcos.append(arco)
+        return len(arcos) - 1
+
+    referencias_anillo = []
+    for anillo, llave, nodo in zip(anillos, llaves, es_nodo):
+        if len(anillo) == 0:
+            referencias_anillo.append([])
+            continue
+        posiciones = np.flatnonzero(nodo)
+        if len(posiciones) == 0:
+            # Anillo sin nodos: inicio canónico en el punto menor, para reconocer anillos
+            # idénticos (p. ej. un hueco ocupado por otro territorio)
+            inicio = int(np.argmin(llave))
+            rotado = np.roll(anillo, -inicio, axis=0)
+            referencias_anillo.append([registrar(np.vstack([rotado, rotado[:1]]))])
+            continue
+        rotado = np.roll(anillo, -posiciones[0], axis=0)
+        cerrado = np.vstack([rotado, rotado[:1]])
+        cortes = list(posiciones - posiciones[0]) + [len(anillo)]
+        referencias_anillo.append([registrar(cerrado[a:b + 1]) for a, b in zip(cortes[:-1], cortes[1:])])
+
+    # Arcos codificados por diferencias (formato TopoJSON cuantizado)
+    arcos_json = [
+        json.dumps(np.concatenate([a[:1], np.diff(a, axis=0)]).tolist(), separators=(",", ":"))
+        for a in arcos
+    ]
+    entidades = [[[referencias_anillo[i] for i in poly] for poly in polys] for polys in estructura]
+    return {
+        "transform": {"scale": [1 / kx, 1 / ky], "translate": [float(x0), float(y0)]},
+        "arcos_json": arcos_json,
+        "entidades": entidades,
+    }
+
+
+def ensamblar_topojson(topologia, propiedades_json, posiciones):
+    """Topology (bytes) con las entidades seleccionadas y solo los arcos que estas usan."""
+    nuevos = {}
+    geometrias = []
+    for pos in posiciones:
+        polys = topologia["entidades"][pos]
+        remapeados = []
+        for poly in polys:
+            anillos = []
+            for anillo in poly:
+                refs = []
+                for ref in anillo:
+                    original = ref if ref >= 0 else ~ref
+                    if original not in nuevos:
+                        nuevos[original] = len(nuevos)
+                    refs.append(nuevos[original] if ref >= 0 else ~nuevos[original])
+                anillos.append(refs)
+            remapeados.append(anillos)
+        if not remapeados:
+            geom = '"type":null'
+        elif len(remapeados) == 1:
+            geom = '"type":"Polygon","arcs":' + json.dumps(remapeados[0], separators=(",", ":"))
+        else:
+            geom = '"type":"MultiPolygon","arcs":' + json.dumps(remapeados, separators=(",", ":"))
+        geometrias.append('{%s,"id":%d,"properties":%s}' % (geom, pos, propiedades_json[pos]))
+
+    arcos = [None] * len(nuevos)
+    for original, nuevo in nuevos.items():
+        arcos[nuevo] = topologia["arcos_json"][original]
+    texto = (
+        '{"type":"Topology","transform":%s,"objects":{"%s":{"type":"GeometryCollection","geometries":[%s]}},"arcs":[%s]}'
+        % (json.dumps(topologia["transform"]), OBJETO_TOPOJSON, ",".join(geometrias), ",".join(arcos))
+    )
+    return json_para_script(texto).encode("utf-8")
+
+
+class CapaGeoJsonPreserializada(MacroElement):
+    """Capa L.geoJson que incrusta un FeatureCollection ya serializado.
+
+    Reproduce el estilo por tipo de territorio (ci/cn) y el tooltip del visor sin pasar por la
+    serialización genérica de folium.GeoJson.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.geoJson({{ this.expresion_datos() }}, {
+            style: function(f) {
+                var color = (f.properties.cn_ci || "").toLowerCase() === "ci" ? "#228B22" : "#8B4513";
+                return {"fillColor": color, "color": color, "weight": 1.5, "fillOpacity": {{ this.relleno }}};
+            }
+        }).bindTooltip(function(layer) {
+            var p = layer.feature.properties;
+            var campos = {{ this.campos|tojson }};
+            return '<table>' + campos.map(function(c) {
+                return '<tr><th style="text-align:left;padding-right:6px">' + c[1] + '</th><td>' + (p[c[0]] === undefined ? '' : p[c[0]]) + '</td></tr>';
+            }).join('') + '</table>';
+        }, {"sticky": true}).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, datos, campos, mostrar_relleno=True, nombre="Territorios Étnicos"):
+        super().__init__()
+        self._name = "CapaGeoJsonPreserializada"
+        self.datos = datos.decode("utf-8") if isinstance(datos, bytes) else datos
+        self.campos = campos
+        self.relleno = 0.6 if mostrar_relleno else 0
+        self.layer_name = nombre
+
+    def expresion_datos(self):
+        return self.datos
+
+
+class CapaTopoJson(JSCSSMixin, CapaGeoJsonPreserializada):
+    """Igual que CapaGeoJsonPreserializada, pero recibe un TopoJSON y lo decodifica en el
+    navegador con topojson-client."""
+
+    default_js = [("topojson-client", "https://unpkg.com/topojson-client@3/dist/topojson-client.min.js")]
+
+    def expresion_datos(self):
+        return f"topojson.feature({self.datos}, \"{OBJETO_TOPOJSON}\")"
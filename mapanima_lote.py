@@ -0,0 +1,152 @@
+# --- MAPANIMA: ANÁLISIS DE TRASLAPE POR LOTES (línea de comandos) ---
+# Ejecuta el mismo análisis de traslape de la pestaña del visor sobre muchas capas a la vez.
+# El dataset principal se carga una sola vez por ejecución (mismo cargador y caché en disco
+# que el visor) y las capas se procesan en paralelo compartiendo el índice espacial.
+#
+# Uso:
+#   python mapanima_lote.py proyectos/ otro.gpkg --url "https://..." --salida resultados
+#
+# Si no se pasa --url se usa la variable de entorno MAPANIMA_URL_ZIP o URL_ZIP de
+# .streamlit/secrets.toml.
+
+import os
+import sys
+import argparse
+import tomllib
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from mapanima_datos import cargar_dataset, leer_derivado
+from mapanima_traslape import proyectar_dataset, construir_arbol, analizar_traslape
+from mapanima_carga import EXTENSIONES_USUARIO, leer_capa_usuario
+
+RUTA_SECRETOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml")
+
+
+def avisar_consola(nivel, mensaje):
+    print(f"[{nivel}] {mensaje}", file=sys.stderr)
+
+
+def url_por_defecto():
+    if os.environ.get("MAPANIMA_URL_ZIP"):
+        return os.environ["MAPANIMA_URL_ZIP"]
+    try:
+        with open(RUTA_SECRETOS, "rb") as f:
+            return tomllib.load(f).get("URL_ZIP")
+    except (OSError, tomllib.TOMLDecodeError):
+        return None
+
+
+def listar_entradas(rutas):
+    """Archivos a procesar: los indicados y los de formato soportado dentro de cada carpeta."""
+    entradas = []
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            for nombre in sorted(os.listdir(ruta)):
+                if nombre.lower().endswith(EXTENSIONES_USUARIO):
+                    entradas.append(os.path.join(ruta, nombre))
+        else:
+            entradas.append(ruta)
+    return entradas
+
+
+def nombres_salida(entradas):
+    """Nombre base de los resultados de cada entrada, sin repetir (proyecto, proyecto_2...).
+
+    Cada candidato se compara con todos los nombres ya asignados (sin distinguir mayúsculas,
+    por los sistemas de archivos que no las distinguen): a.zip, a.gpkg y a_2.zip dan a, a_2 y a_2_2.
+    """
+    usados, nombres = set(), []
+    for ruta in entradas:
+        base = os.path.splitext(os.path.basename(ruta))[0]
+        nombre, n = base, 1
+        while nombre.lower() in usados:
+            n += 1
+            nombre = f"{base}_{n}"
+        usados.add(nombre.lower())
+        nombres.append(nombre)
+    return nombres
+
+
+def procesar_entrada(ruta, nombre, gdf_total, gdf_total_proj, arbol, salida, formatos, procesos):
+    """Traslape de una entrada; escribe sus resultados y devuelve su fila del resumen."""
+    fila = {"entrada": ruta, "estado": "ok", "intersecciones": 0, "territorios_afectados": 0, "area_traslape_ha": 0.0, "detalle": ""}
+    try:
+        gdf_usuario = leer_capa_usuario(ruta)
+        if gdf_usuario is None:
+            return dict(fila, estado="error", detalle="La entrada no contiene ninguna capa con geometría")
+        if gdf_usuario.crs is None:
+            return dict(fila, estado="error", detalle="La capa no tiene CRS definido")
+
+        _, gdf_interseccion, gdf_territorios_afectados = analizar_traslape(
+            gdf_usuario, gdf_total, gdf_total_proj, arbol, procesos=procesos
+        )
+        if gdf_interseccion.empty:
+            return dict(fila, estado="sin_traslape")
+
+        if "csv" in formatos:
+            gdf_interseccion.drop(columns=gdf_interseccion.geometry.name).to_csv(
+                os.path.join(salida, f"{nombre}_traslape.csv"), index=False
+            )
+        if "gpkg" in formatos:
+            ruta_gpkg = os.path.join(salida, f"{nombre}_traslape.gpkg")
+            gdf_interseccion.to_file(ruta_gpkg, layer="interseccion", driver="GPKG")
+            gdf_territorios_afectados.to_file(ruta_gpkg, layer="territorios_afectados", driver="GPKG")
+
+        return dict(
+            fila,
+            intersecciones=len(gdf_interseccion),
+            territorios_afectados=len(gdf_territorios_afectados),
+            area_traslape_ha=round(float(gdf_interseccion["area_traslape_ha"].sum()), 2),
+        )
+    except Exception as e:
+        # Una entrada dañada no detiene el lote: queda registrada en el resumen
+        return dict(fila, estado="error", detalle=str(e))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Análisis de traslape por lotes contra los territorios étnicos de Mapanima.")
+    parser.add_argument("entradas", nargs="+", help="Archivos .zip (shapefiles), .gpkg, .geojson o .kml, o carpetas que los contengan")
+    parser.add_argument("--url", default=url_por_defecto(), help="URL del ZIP principal (por defecto MAPANIMA_URL_ZIP o URL_ZIP de secrets.toml)")
+    parser.add_argument("--salida", default="resultados_traslape", help="Carpeta de resultados")
+    parser.add_argument("--formatos", nargs="+", choices=["csv", "gpkg"], default=["csv", "gpkg"], help="Formatos de salida por entrada")
+    parser.add_argument("--hilos", type=int, default=os.cpu_count() or 1, help="Entradas procesadas a la vez")
+    parser.add_argument("--procesos", type=int, default=1, help="Procesos para las intersecciones de cada entrada")
+    args = parser.parse_args(argv)
+
+    if not args.url:
+        parser.error("No se indicó la URL del dataset principal (--url, MAPANIMA_URL_ZIP o URL_ZIP en secrets.toml).")
+
+    entradas = listar_entradas(args.entradas)
+    if not entradas:
+        parser.error("No se encontraron entradas con formato soportado (" + ", ".join(EXTENSIONES_USUARIO) + ").")
+
+    # --- Dataset principal: una sola carga para todo el lote ---
+    gdf_total = cargar_dataset(args.url, avisar=avisar_consola)
+    if gdf_total is None:
+        return 1
+    gdf_total_proj = leer_derivado(args.url, gdf_total.attrs.get("huella"), "9377")
+    if gdf_total_proj is None:
+        gdf_total_proj = proyectar_dataset(gdf_total)
+    arbol = construir_arbol(gdf_total_proj)
+
+    # --- Entradas en paralelo ---
+    # Hilos y no procesos: todas comparten el dataset y el STRtree ya cargados, y shapely
+    # libera el GIL durante las consultas e intersecciones
+    os.makedirs(args.salida, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max(1, args.hilos)) as ejecutor:
+        filas = list(ejecutor.map(
+            lambda par: procesar_entrada(par[0], par[1], gdf_total, gdf_total_proj, arbol, args.salida, args.formatos, args.procesos),
+            zip(entradas, nombres_salida(entradas)),
+        ))
+
+    resumen = pd.DataFrame(filas)
+    resumen.to_csv(os.path.join(args.salida, "resumen.csv"), index=False)
+    for fila in filas:
+        print(f"{fila['estado']:>13}  {fila['intersecciones']:>6}  {fila['area_traslape_ha']:>12}  {fila['entrada']}")
+    return 1 if (resumen["estado"] == "error").any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+# --- MAPANIMA: MÉTRICAS POR ETAPA (sin Streamlit) ---
+# Registro de tiempo, filas, vértices, bytes y memoria de cada etapa del visor (descarga,
+# lectura, reproyección, normalización, filtros, simplificación, GeoJSON, transferencia del
+# mapa, exportaciones y traslape).
+#
+# Cada medición se emite como una línea JSON en el logger "mapanima.metricas" y se acumula
+# en una ventana por etapa para calcular p50/p95. Si está definida la variable de entorno
+# MAPANIMA_PROMETHEUS_TEXTFILE, el resumen se escribe en ese archivo con el formato de texto
+# de Prometheus (colector textfile de node_exporter).
+#
+# Con MAPANIMA_LOG_METRICAS=1 las líneas JSON se imprimen en stderr (si no, quedan en el logger
+# para la configuración de logging de quien use el módulo).
+#
+# Memoria: por defecto se reporta el crecimiento del pico de RSS del proceso durante la etapa.
+# Con MAPANIMA_TRACEMALLOC=1 se activa tracemalloc y se reporta el pico de memoria de Python
+# asignada durante la etapa (más preciso, pero con costo en todo el proceso).
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import tracemalloc
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+import shapely
+
+try:
+    import resource
+except ImportError:  # Windows: sin getrusage, no se reporta el pico de RSS
+    resource = None
+
+logger = logging.getLogger("mapanima.metricas")
+if os.environ.get("MAPANIMA_LOG_METRICAS") == "1" and not logger.handlers:
+    logger.addHandler(logging.StreamHandler(sys.stderr))
+    logger.setLevel(logging.INFO)
+
+# Mediciones que se conservan por etapa para los percentiles
+VENTANA = 1000
+# Intervalo mínimo entre escrituras del archivo de Prometheus (segundos)
+INTERVALO_PROMETHEUS = 10
+
+RUTA_PROMETHEUS = os.environ.get("MAPANIMA_PROMETHEUS_TEXTFILE")
+
+if os.environ.get("MAPANIMA_TRACEMALLOC") == "1" and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+def _pico_rss_mb():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KiB y macOS bytes
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+
+def contar_vertices(geometrias):
+    """Número total de coordenadas de un arreglo/GeoSeries de geometrías."""
+    return int(shapely.get_num_coordinates(np.asarray(geometrias)).sum())
+
+
+class RegistroMetricas:
+    """Ventana de mediciones por etapa, compartida por todas las sesiones y segura entre hilos."""
+
+    def __init__(self, ventana=VENTANA, ruta_prometheus=RUTA_PROMETHEUS):
+        self.ruta_prometheus = ruta_prometheus
+        self._muestras = defaultdict(lambda: deque(maxlen=ventana))
+        self._totales = defaultdict(lambda: [0, 0.0])  # etapa -> [cuenta, suma de segundos]
+        self._candado = threading.Lock()
+        self._ultima_escritura = 0.0
+        self._local = threading.local()
+
+    # --- Mediciones de la ejecución actual (un rerun del script en su hilo) ---
+    def iniciar_ejecucion(self):
+        self._local.ejecucion = []
+
+    def ejecucion_actual(self):
+        return list(getattr(self._local, "ejecucion", []))
+
+    def registrar(self, medicion):
+        with self._candado:
+            self._muestras[medicion["etapa"]].append(medicion["segundos"])
+            total = self._totales[medicion["etapa"]]
+            total[0] += 1
+            total[1] += medicion["segundos"]
+        ejecucion = getattr(self._local, "ejecucion", None)
+        if ejecucion is not None:
+            ejecucion.append(medicion)
+        logger.info(json.dumps(medicion, ensure_ascii=False))
+        if self.ruta_prometheus and time.monotonic() - self._ultima_escritura >= INTERVALO_PROMETHEUS:
+            self.escribir_prometheus()
+
+    def resumen(self):
+        """Por etapa: cuenta total, p50, p95 y máximo de la ventana (segundos)."""
+        with self._candado:
+            copia = {etapa: (np.array(m), tuple(self._totales[etapa])) for etapa, m in self._muestras.items()}
+        return {
+            etapa: {
+                "cuenta": cuenta,
+                "suma_s": round(suma, 6),
+                "p50_s": round(float(np.percentile(m, 50)), 6),
+                "p95_s": round(float(np.percentile(m, 95)), 6),
+                "max_s": round(float(m.max()), 6),
+            }
+            for etapa, (m, (cuenta, suma)) in sorted(copia.items()) if len(m)
+        }
+
+    def escribir_prometheus(self, ruta=None):
+        """Escribe el resumen como 'summary' de Prometheus (escritura atómica)."""
+        ruta = ruta or self.ruta_prometheus
+        self._ultima_escritura = time.monotonic()
+        lineas = [
+            "# HELP mapanima_etapa_segundos Duración de cada etapa del visor.",
+            "# TYPE mapanima_etapa_segundos summary",
+        ]
+        for etapa, datos in self.resumen().items():
+            lineas += [
+                f'mapanima_etapa_segundos{{etapa="{etapa}",quantile="0.5"}} {datos["p50_s"]}',
+                f'mapanima_etapa_segundos{{etapa="{etapa}",quantile="0.95"}} {datos["p95_s"]}',
+                f'mapanima_etapa_segundos_sum{{etapa="{etapa}"}} {datos["suma_s"]}',
+                f'mapanima_etapa_segundos_count{{etapa="{etapa}"}} {datos["cuenta"]}',
+            ]
+        try:
+            with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+                f.write("\n".join(lineas) + "\n")
+            os.replace(ruta + ".tmp", ruta)
+        except OSError as e:
+            logger.warning("No se pudo escribir el archivo de métricas de Prometheus: %s", e)
+
+
+REGISTRO = RegistroMetricas()
+
+
+@contextmanager
+def etapa(nombre, registro=None, **datos):
+    """Mide el bloque como la etapa `nombre`.
+
+    El bloque recibe un diccionario donde puede agregar filas, vértices, bytes u otros datos:
+
+        with etapa("normalizacion", filas=len(gdf)) as m:
+            ...
+            m["bytes"] = len(payload)
+    """
+    registro = registro or REGISTRO
+    medicion = {"etapa": nombre, **datos}
+    con_tracemalloc = tracemalloc.is_tracing()
+    if con_tracemalloc:
+        tracemalloc.reset_peak()
+        memoria_inicial = tracemalloc.get_traced_memory()[0]
+    pico_inicial = _pico_rss_mb()
+    inicio = time.perf_counter()
+    try:
+        yield medicion
+    except BaseException:
+        medicion["error"] = True
+        raise
+    finally:
+        medicion["segundos"] = round(time.perf_counter() - inicio, 6)
+        if con_tracemalloc:
+            medicion["memoria_pico_mb"] = round((tracemalloc.get_traced_memory()[1] - memoria_inicial) / 2 ** 20, 2)
+        if pico_inicial is not None:
+            medicion["aumento_pico_rss_mb"] = round(_pico_rss_mb() - pico_inicial, 2)
+        registro.registrar(medicion)
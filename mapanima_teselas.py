@@ -0,0 +1,319 @@
+# --- MAPANIMA: TESELAS VECTORIALES (MVT) ---
+# Genera teselas Mapbox Vector Tile del dataset principal en la carpeta static/ de la app
+# (Streamlit las sirve con server.enableStaticServing) y arma la capa Leaflet.VectorGrid
+# que las consume. Así el navegador descarga solo las teselas y zooms que está viendo,
+# en lugar de recibir todo el GeoJSON filtrado en cada rerun.
+#
+# Cada versión guarda, junto a las teselas, la huella de la geometría y la caja de cada fila
+# (filas.npz). Al generar una versión nueva solo se rehacen las teselas que tocan las cajas
+# viejas o nuevas de las filas insertadas, modificadas o eliminadas; las demás se enlazan
+# (hard link, o copia si el sistema de archivos no lo permite) desde la versión anterior.
+#
+# Exposición: Streamlit sirve static/ en /app/static/ sin pasar por el inicio de sesión del
+# visor, así que quien conozca (o adivine) la URL de una versión puede descargar sus teselas.
+# Por eso las teselas solo llevan la geometría y el identificador de fila ('fid'): los
+# atributos viajan aparte, dentro de la página autenticada, solo para las filas filtradas.
+# Aun así las geometrías quedan expuestas: el modo teselas es opcional y se habilita con
+# HABILITAR_TESELAS = true en los secretos.
+
+import os
+import json
+import hashlib
+import shutil
+from collections import defaultdict
+
+import numpy as np
+import shapely
+from folium.plugins import VectorGridProtobuf
+from folium.template import Template
+from branca.element import MacroElement
+
+from mapanima_geojson import json_para_script
+
+try:
+    import mapbox_vector_tile
+except ImportError:  # Dependencia opcional: sin ella el visor sigue usando GeoJSON
+    mapbox_vector_tile = None
+
+TESELAS_DISPONIBLES = mapbox_vector_tile is not None
+
+# Carpeta servida por Streamlit en /app/static/teselas/
+DIR_TESELAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "teselas")
+
+CAPA = "territorios"
+EXTENSION = 4096        # Resolución interna de cada tesela (estándar MVT)
+MARGEN = 64             # Margen (en unidades de la tesela) para que no se vean cortes en los bordes
+ZOOM_MIN, ZOOM_MAX = 4, 10  # Por encima de ZOOM_MAX Leaflet amplía las teselas de ZOOM_MAX
+ORIGEN = 20037508.342789244  # Semiancho del mundo en EPSG:3857 (metros)
+
+# Cambia cuando cambia el contenido de las teselas, para no reutilizar generaciones viejas
+VERSION_TESELAS = 2
+# Generaciones completas que se conservan en disco: la vigente y la anterior, que siguen
+# pidiendo las páginas ya abiertas hasta su siguiente rerun
+GENERACIONES_CONSERVADAS = 2
+
+
+def _rango_teselas(bounds, z):
+    """Índices x, y de las teselas del zoom z que cubren cada caja (minx, miny, maxx, maxy) en metros."""
+    n = 2 ** z
+    tam = 2 * ORIGEN / n
+    x0 = np.clip(np.floor((bounds[:, 0] + ORIGEN) / tam), 0, n - 1).astype(int)
+    x1 = np.clip(np.floor((bounds[:, 2] + ORIGEN) / tam), 0, n - 1).astype(int)
+    y0 = np.clip(np.floor((ORIGEN - bounds[:, 3]) / tam), 0, n - 1).astype(int)
+    y1 = np.clip(np.floor((ORIGEN - bounds[:, 1]) / tam), 0, n - 1).astype(int)
+    return x0, x1, y0, y1
+
+
+def _huellas_geometrias(geometrias):
+    """Huella de 64 bits del WKB de cada geometría, para saber qué filas cambiaron entre versiones."""
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(wkb or b"", digest_size=8).digest(), "little") for wkb in shapely.to_wkb(geometrias)),
+        dtype=np.uint64, count=len(geometrias),
+    )
+
+
+def _teselas_cajas(bounds, z):
+    """Conjunto (x, y) de las teselas del zoom z que tocan alguna de las cajas (las vacías se ignoran)."""
+    bounds = bounds[~np.isnan(bounds).any(axis=1)]
+    x0, x1, y0, y1 = _rango_teselas(bounds, z)
+    return {(x, y) for i in range(len(bounds)) for x in range(x0[i], x1[i] + 1) for y in range(y0[i], y1[i] + 1)}
+
+
+def _version_anterior(directorio, zoom_min, zoom_max):
+    """La generación completa más reciente de otra versión, con los mismos zooms: (carpeta, filas) o None."""
+    candidatas = []
+    for nombre in os.listdir(DIR_TESELAS) if os.path.isdir(DIR_TESELAS) else []:
+        ruta = os.path.join(DIR_TESELAS, nombre)
+        try:
+            with open(os.path.join(ruta, "completo.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if ruta != directorio and meta.get("version") == VERSION_TESELAS and (meta["zoom_min"], meta["zoom_max"]) == (zoom_min, zoom_max):
+            candidatas.append((os.path.getmtime(os.path.join(ruta, "completo.json")), ruta))
+    for _, ruta in sorted(candidatas, reverse=True):
+        try:
+            with np.load(os.path.join(ruta, "filas.npz")) as filas:
+                return ruta, {k: filas[k] for k in filas.files}
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def _faltantes(claves, otras):
+    """Máscara de las claves que no están en otras."""
+    otras = set(otras)
+    return np.asarray([c not in otras for c in claves], dtype=bool)
+
+
+def _enlazar(origen, destino):
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    try:
+        os.link(origen, destino)
+    except OSError:
+        shutil.copy2(origen, destino)
+
+
+def directorio_version(huella):
+    # Una carpeta por versión del dataset, para que el navegador no mezcle teselas viejas y nuevas
+    return os.path.join(DIR_TESELAS, hashlib.sha256(f"{VERSION_TESELAS}|{huella}".encode("utf-8")).hexdigest()[:16])
+
+
+def generar_teselas(gdf, huella, zoom_min=ZOOM_MIN, zoom_max=ZOOM_MAX):
+    """Genera {z}/{x}/{y}.pbf para el dataset y devuelve la carpeta.
+
+    Si ya existe una generación completa para esta versión del dataset, no se repite; si existe
+    la de una versión anterior, solo se rehacen las teselas de las filas que cambiaron.
+    Cada entidad lleva solo la propiedad 'fid', la etiqueta de su fila en gdf: el estilo, el filtro
+    y la ventana emergente la buscan en la tabla de propiedades de la página (tabla_propiedades).
+    """
+    if mapbox_vector_tile is None:
+        raise RuntimeError("El paquete 'mapbox-vector-tile' no está instalado.")
+
+    directorio = directorio_version(huella)
+    if os.path.exists(os.path.join(directorio, "completo.json")):
+        return directorio
+
+    fids = gdf.index.to_numpy(dtype=np.int64)
+    propiedades = [{"fid": int(fid)} for fid in fids]
+    geometrias = np.asarray(gdf.geometry.to_crs(epsg=3857).values)
+    filas = {"fid": fids, "huella": _huellas_geometrias(geometrias), "bounds": shapely.bounds(geometrias)}
+
+    # Filas que cambiaron respecto a la versión anterior: una fila se conserva solo si tiene el
+    # mismo fid y la misma geometría (las teselas viejas llevan el fid)
+    anterior = _version_anterior(directorio, zoom_min, zoom_max)
+    if anterior is not None:
+        dir_anterior, filas_anteriores = anterior
+        claves = list(zip(filas["fid"].tolist(), filas["huella"].tolist()))
+        claves_anteriores = list(zip(filas_anteriores["fid"].tolist(), filas_anteriores["huella"].tolist()))
+        nuevas, viejas = _faltantes(claves, claves_anteriores), _faltantes(claves_anteriores, claves)
+        cajas_cambiadas = np.concatenate([filas["bounds"][nuevas], filas_anteriores["bounds"][viejas]])
+
+    for z in range(zoom_min, zoom_max + 1):
+        tam = 2 * ORIGEN / 2 ** z
+        if anterior is None:
+            sucias, usadas = None, np.arange(len(geometrias))
+        else:
+            # Solo se rehacen las teselas que tocan las cajas de las filas cambiadas, con las filas
+            # que las tocan; las demás se enlazan desde la versión anterior
+            sucias = _teselas_cajas(cajas_cambiadas, z)
+            validas = np.flatnonzero(~np.isnan(filas["bounds"]).any(axis=1))
+            x0, x1, y0, y1 = _rango_teselas(filas["bounds"][validas], z)
+            usadas = validas[np.asarray([
+                any((x, y) in sucias for x in range(x0[j], x1[j] + 1) for y in range(y0[j], y1[j] + 1))
+                for j in range(len(validas))
+            ], dtype=bool)]
+            dir_z = os.path.join(dir_anterior, str(z))
+            for raiz, _, archivos in os.walk(dir_z):
+                for archivo in archivos:
+                    x, y = int(os.path.basename(raiz)), int(archivo.split(".")[0])
+                    if (x, y) not in sucias:
+                        _enlazar(os.path.join(raiz, archivo), os.path.join(directorio, str(z), str(x), archivo))
+
+        # Simplificación acorde a la resolución de la tesela en este zoom
+        geoms_z = np.empty(len(geometrias), dtype=object)
+        geoms_z[usadas] = shapely.simplify(geometrias[usadas], tam / EXTENSION, preserve_topology=True)
+        x0, x1, y0, y1 = _rango_teselas(shapely.bounds(geoms_z[usadas]), z)
+
+        por_tesela = defaultdict(list)
+        for j, i in enumerate(usadas):
+            if geoms_z[i] is None or geoms_z[i].is_empty:
+                continue
+            for x in range(x0[j], x1[j] + 1):
+                for y in range(y0[j], y1[j] + 1):
+                    if sucias is None or (x, y) in sucias:
+                        por_tesela[(x, y)].append(i)
+
+        margen = tam * MARGEN / EXTENSION
+        for (x, y), indices in por_tesela.items():
+            minx, maxy = -ORIGEN + x * tam, ORIGEN - y * tam
+            caja = (minx, maxy - tam, minx + tam, maxy)
+            recortes = shapely.clip_by_rect(geoms_z[indices], caja[0] - margen, caja[1] - margen, caja[2] + margen, caja[3] + margen)
+            entidades = [
+                {"geometry": g, "properties": propiedades[i]}
+                for g, i in zip(recortes, indices) if not g.is_empty
+            ]
+            if not entidades:
+                continue
+            datos = mapbox_vector_tile.encode(
+                [{"name": CAPA, "features": entidades}],
+                default_options={"quantize_bounds": caja, "extents": EXTENSION},
+            )
+            ruta = os.path.join(directorio, str(z), str(x), f"{y}.pbf")
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            with open(ruta, "wb") as f:
+                f.write(datos)
+
+    os.makedirs(directorio, exist_ok=True)
+    np.savez(os.path.join(directorio, "filas.npz"), **filas)
+    with open(os.path.join(directorio, "completo.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "huella": huella, "version": VERSION_TESELAS, "zoom_min": zoom_min, "zoom_max": zoom_max,
+            "base": None if anterior is None else os.path.basename(anterior[0]),
+        }, f)
+
+    # Se borran las generaciones más viejas del dataset
+    limpiar_teselas()
+    return directorio
+
+
+def limpiar_teselas(mantener=GENERACIONES_CONSERVADAS):
+    """Borra las generaciones completas de teselas salvo las `mantener` más recientes.
+
+    Las carpetas sin completo.json no se tocan: pueden ser una generación en curso.
+    """
+    if not os.path.isdir(DIR_TESELAS):
+        return
+    completas = []
+    for nombre in os.listdir(DIR_TESELAS):
+        marca = os.path.join(DIR_TESELAS, nombre, "completo.json")
+        try:
+            completas.append((os.path.getmtime(marca), os.path.join(DIR_TESELAS, nombre)))
+        except OSError:
+            continue
+    for _, ruta in sorted(completas, reverse=True)[mantener:]:
+        shutil.rmtree(ruta, ignore_errors=True)
+
+
+class _TablaPropiedades(MacroElement):
+    """Tabla {fid: propiedades} de la capa de teselas, como variable de la página.
+
+    Va en la sección script del mapa: streamlit_folium inserta la sección html con innerHTML,
+    que no ejecuta etiquetas <script>, y solo ejecuta la sección script.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = {{ this.propiedades|safe }};
+        {% endmacro %}
+    """)
+
+    def __init__(self, propiedades):
+        super().__init__()
+        self._name = "TablaPropiedades"
+        self.propiedades = propiedades
+
+
+class _VentanaTesela(MacroElement):
+    """Ventana emergente al hacer clic sobre una entidad de la capa de teselas."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        {{ this.capa.get_name() }}.on('click', function(e) {
+            var p = {{ this.tabla.get_name() }}[(e.layer.properties || {}).fid];
+            if (!p) { return; }
+            var campos = {{ this.campos|tojson }};
+            var html = campos.map(function(c) {
+                return '<b>' + c[1] + '</b> ' + (p[c[0]] === undefined ? '' : p[c[0]]);
+            }).join('<br>');
+            L.popup().setLatLng(e.latlng).setContent(html).openOn({{ this._parent.get_name() }});
+        });
+        {% endmacro %}
+    """)
+
+    def __init__(self, capa, tabla, campos):
+        super().__init__()
+        self._name = "VentanaTesela"
+        self.capa = capa
+        self.tabla = tabla
+        self.campos = campos
+
+
+def tabla_propiedades(fids, propiedades_json):
+    """Objeto JSON {fid: propiedades} de las filas seleccionadas, a partir de las propiedades ya
+    serializadas de cada fila (mapanima_geojson.serializar_propiedades)."""
+    return json_para_script("{" + ",".join('"%d":%s' % (fid, props) for fid, props in zip(fids, propiedades_json)) + "}")
+
+
+def capa_teselas(mapa, url_base, propiedades, mostrar_relleno, campos):
+    """Agrega al mapa la capa VectorGrid que lee las teselas de url_base.
+
+    propiedades: tabla_propiedades de las filas a mostrar. Las entidades que no están en ella no
+    se dibujan: el filtrado se hace en el navegador con el estilo de cada entidad, así las mismas
+    teselas sirven para cualquier combinación de filtros.
+    campos: lista de (propiedad, etiqueta) para la ventana emergente.
+    """
+    # La tabla se crea una sola vez en la página (antes que la capa) y no por cada entidad dibujada
+    tabla = _TablaPropiedades(propiedades)
+    tabla.add_to(mapa)
+    opciones = """{
+        "rendererFactory": L.canvas.tile,
+        "interactive": true,
+        "maxNativeZoom": %(zoom_max)d,
+        "getFeatureId": function(f) { return f.properties.fid; },
+        "vectorTileLayerStyles": {
+            "%(capa)s": function(t, z) {
+                var p = %(tabla)s[t.fid];
+                if (!p) {
+                    return {"stroke": false, "fill": false};
+                }
+                var color = (p.cn_ci || "").toLowerCase() === "ci" ? "#228B22" : "#8B4513";
+                return {"fill": true, "fillColor": color, "color": color, "weight": 1.5, "fillOpacity": %(relleno)s};
+            }
+        }
+    }""" % {"zoom_max": ZOOM_MAX, "capa": CAPA, "tabla": tabla.get_name(), "relleno": 0.6 if mostrar_relleno else 0}
+
+    capa = VectorGridProtobuf(url_base.rstrip("/") + "/{z}/{x}/{y}.pbf", "Territorios Étnicos", opciones)
+    capa.add_to(mapa)
+    _VentanaTesela(capa, tabla, campos).add_to(mapa)
+    return capa
@@ -0,0 +1,238 @@
+# --- MAPANIMA: ANÁLISIS DE TRASLAPE (sin Streamlit) ---
+# Intersección entre las geometrías del usuario y los territorios étnicos, prefiltrada con un
+# índice espacial STRtree construido una sola vez sobre el dataset principal.
+
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+# Atributos de los territorios que necesita el resultado del traslape (tabla, mapa y CSV)
+COLUMNAS_TRASLAPE = ["id_rtdaf", "nom_terr", "etnia", "departamen", "municipio", "cn_ci", "area_ha"]
+
+# Por debajo de este número de pares candidatos no vale la pena repartir el trabajo entre procesos
+UMBRAL_PARALELO = 2000
+LOTES_POR_PROCESO = 4
+
+_ejecutores = {}
+_candado_ejecutores = threading.Lock()
+
+
+def _ejecutor(procesos):
+    """Pool de procesos persistente (uno por tamaño), compartido por todas las sesiones.
+
+    Se usa 'spawn' porque el servidor de Streamlit tiene hilos y hacer fork de un proceso con
+    hilos no es seguro.
+    """
+    with _candado_ejecutores:
+        if procesos not in _ejecutores:
+            _ejecutores[procesos] = ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context("spawn"))
+        return _ejecutores[procesos]
+
+
+# CRS de trabajo del traslape: CTM12 (metros), para intersectar y medir áreas sin reproyectar el resultado
+CRS_TRASLAPE = 9377
+
+
+def proyectar_dataset(gdf_total, geometria_9377=None):
+    """Copia del dataset principal en EPSG:9377 con solo las columnas del traslape.
+
+    Si el cargador ya tenía las geometrías en CTM12 (shapefile original en 9377 o reproyección
+    para el área), se reutilizan en lugar de volver a reproyectar desde EPSG:4326.
+    """
+    columnas = [c for c in COLUMNAS_TRASLAPE if c in gdf_total.columns]
+    if geometria_9377 is not None:
+        return gpd.GeoDataFrame(pd.DataFrame(gdf_total[columnas]), geometry=np.asarray(geometria_9377), crs=CRS_TRASLAPE)
+    return gdf_total[columnas + [gdf_total.geometry.name]].to_crs(epsg=CRS_TRASLAPE)
+
+
+def construir_arbol(gdf_total):
+    """Índice espacial STRtree sobre las geometrías del dataset principal (posiciones de fila)."""
+    return shapely.STRtree(gdf_total.geometry.values)
+
+
+def pares_candidatos(arbol, gdf_usuario):
+    """Pares (posición en gdf_usuario, posición en gdf_total) cuyas geometrías se intersectan."""
+    idx_usuario, idx_total = arbol.query(gdf_usuario.geometry.values, predicate="intersects")
+    return idx_usuario, idx_total
+
+
+def _misma_dimension(geoms, dimension):
+    """Deja solo las partes con la dimensión de la geometría del usuario (como keep_geom_type de overlay)."""
+    resultado = np.array(geoms, dtype=object)
+    colecciones = shapely.get_type_id(resultado) == shapely.GeometryType.GEOMETRYCOLLECTION
+    for i in np.flatnonzero(colecciones):
+        partes = [p for p in shapely.get_parts(resultado[i]) if shapely.get_dimensions(p) == dimension]
+        resultado[i] = shapely.union_all(partes) if partes else shapely.Polygon()
+    resultado[shapely.get_dimensions(resultado) != dimension] = shapely.Polygon()
+    return resultado
+
+
+def _intersectar_lote(geoms_usuario, geoms_total, dimension, con_area):
+    """Intersección exacta de un lote de pares (y su área si el CRS es proyectado)."""
+    geoms = shapely.intersection(geoms_usuario, geoms_total)
+    if len(geoms):
+        geoms = _misma_dimension(geoms, dimension)
+    return geoms, (shapely.area(geoms) if con_area else None)
+
+
+def _intersectar_lote_wkb(lote, dimension, con_area):
+    """Versión para los procesos del pool: las geometrías viajan como WKB, cada una una sola vez
+    por lote (un territorio grande suele aparecer en muchos pares), y vuelven también como WKB."""
+    wkb_usuario, inv_usuario, wkb_total, inv_total = lote
+    geoms_usuario = shapely.from_wkb(wkb_usuario)[inv_usuario]
+    geoms_total = shapely.from_wkb(wkb_total)[inv_total]
+    geoms, areas = _intersectar_lote(geoms_usuario, geoms_total, dimension, con_area)
+    return shapely.to_wkb(geoms), areas
+
+
+def _intersectar_pares(gdf_usuario, gdf_total, idx_usuario, idx_total, dimension, con_area, procesos):
+    if procesos <= 1 or len(idx_usuario) < UMBRAL_PARALELO:
+        return _intersectar_lote(
+            np.asarray(gdf_usuario.geometry.values[idx_usuario]), np.asarray(gdf_total.geometry.values[idx_total]),
+            dimension, con_area
+        )
+    # Lotes contiguos de pares; map conserva el orden, así el resultado es idéntico al secuencial
+    wkb_usuario = shapely.to_wkb(gdf_usuario.geometry.values)
+    wkb_total = shapely.to_wkb(gdf_total.geometry.values)
+    lotes = []
+    n_lotes = min(procesos * LOTES_POR_PROCESO, len(idx_usuario))
+    for lote_u, lote_t in zip(np.array_split(idx_usuario, n_lotes), np.array_split(idx_total, n_lotes)):
+        unicos_u, inv_u = np.unique(lote_u, return_inverse=True)
+        unicos_t, inv_t = np.unique(lote_t, return_inverse=True)
+        lotes.append((wkb_usuario[unicos_u], inv_u, wkb_total[unicos_t], inv_t))
+    resultados = list(_ejecutor(procesos).map(_intersectar_lote_wkb, lotes, repeat(dimension), repeat(con_area)))
+    geoms = shapely.from_wkb(np.concatenate([g for g, _ in resultados]))
+    areas = np.concatenate([a for _, a in resultados]) if con_area else None
+    return geoms, areas
+
+
+def calcular_interseccion(gdf_usuario, gdf_total, arbol, columnas=COLUMNAS_TRASLAPE, idx_usuario=None, idx_total=None, procesos=1):
+    """Equivalente a gpd.overlay(gdf_usuario, gdf_total, how="intersection"), pero:
+
+    - solo calcula la intersección exacta de los pares que el STRtree reporta como candidatos,
+    - de gdf_total solo trae las columnas necesarias (area_ha se renombra a area_original_ha),
+    - si una columna del usuario tiene el mismo nombre que una del territorio, la del usuario
+      se renombra con el sufijo '_usuario' para no romper la tabla ni los tooltips.
+
+    Ambos GeoDataFrames deben estar en el mismo CRS. Se pueden pasar los pares ya calculados.
+    Con procesos > 1 y muchos pares, las intersecciones se calculan en un pool de procesos.
+    Si el CRS es proyectado (metros) se agrega también la columna area_traslape_ha.
+    """
+    if idx_usuario is None or idx_total is None:
+        idx_usuario, idx_total = pares_candidatos(arbol, gdf_usuario)
+    columnas = [c for c in columnas if c in gdf_total.columns]
+
+    dimension = int(shapely.get_dimensions(gdf_usuario.geometry.values).max()) if len(gdf_usuario) else 2
+    con_area = gdf_usuario.crs is not None and gdf_usuario.crs.is_projected
+    geoms, areas = _intersectar_pares(gdf_usuario, gdf_total, idx_usuario, idx_total, dimension, con_area, procesos)
+
+    atributos_usuario = pd.DataFrame(gdf_usuario.drop(columns=gdf_usuario.geometry.name)).iloc[idx_usuario].reset_index(drop=True)
+    atributos_usuario = atributos_usuario.rename(columns={c: f"{c}_usuario" for c in atributos_usuario.columns if c in columnas})
+    atributos_total = pd.DataFrame(gdf_total[columnas]).iloc[idx_total].reset_index(drop=True)
+    atributos_total = atributos_total.rename(columns={"area_ha": "area_original_ha"})
+
+    gdf_interseccion = gpd.GeoDataFrame(
+        pd.concat([atributos_usuario, atributos_total], axis=1),
+        geometry=geoms,
+        crs=gdf_usuario.crs,
+    )
+    if con_area:
+        gdf_interseccion["area_traslape_ha"] = (areas / 10000).round(2)
+    return gdf_interseccion[~gdf_interseccion.geometry.is_empty].reset_index(drop=True)
+
+
+# --- Resultado completo (visor y línea de comandos) ---
+# La capa del usuario se lee con mapanima_carga.leer_capa_usuario
+def analizar_traslape(gdf_usuario, gdf_total, gdf_total_proj, arbol, procesos=1):
+    """Traslape completo de una capa del usuario contra el dataset principal.
+
+    gdf_total_proj y arbol son la copia en CTM12 y su STRtree (se construyen una vez por dataset).
+    Devuelve (gdf_usuario, gdf_interseccion, gdf_territorios_afectados) en EPSG:4326; la
+    intersección trae area_traslape_ha, porc_traslape y porc_traslape_str.
+    """
+    # El traslape se calcula directamente en CTM12 (EPSG:9377): intersección y áreas
+    # en metros, sin reproyectar la intersección después
+    gdf_usuario_proj = gdf_usuario.to_crs(epsg=CRS_TRASLAPE)
+    if gdf_usuario.crs != "EPSG:4326":
+        gdf_usuario = gdf_usuario.to_crs(epsg=4326)
+
+    # Solo se intersectan los pares que el índice espacial reporta como candidatos
+    gdf_interseccion = calcular_interseccion(gdf_usuario_proj, gdf_total_proj, arbol, procesos=procesos)
+
+    # De los territorios afectados solo se conservan las columnas del traslape (mapa, tabla y
+    # caché de resultados); las fechas u otros tipos no serializables no viajan al GeoJSON
+    columnas_afectados = [c for c in COLUMNAS_TRASLAPE if c in gdf_total.columns] + [gdf_total.geometry.name]
+    gdf_territorios_afectados = gdf_total.iloc[0:0][columnas_afectados]
+    if not gdf_interseccion.empty:
+        # area_traslape_ha ya viene calculada en CTM12; solo el resultado se pasa a 4326 para el mapa
+        gdf_interseccion = gdf_interseccion.to_crs(epsg=4326)
+
+        epsilon = 1e-9
+        gdf_interseccion['porc_traslape'] = (
+            (gdf_interseccion['area_traslape_ha'] / (gdf_interseccion['area_original_ha'] + epsilon)) * 100
+        ).round(2).fillna(0)
+        gdf_interseccion['porc_traslape_str'] = gdf_interseccion['porc_traslape'].astype(str) + '%'
+
+        ids_con_traslape = gdf_interseccion['id_rtdaf'].unique()
+        afectados = gdf_total['id_rtdaf'].astype(str).isin(ids_con_traslape.astype(str))
+        gdf_territorios_afectados = gdf_total.loc[afectados, columnas_afectados]
+
+    return gdf_usuario, gdf_interseccion, gdf_territorios_afectados
+
+
+# --- Caché de resultados por contenido ---
+
+def _tamano_aproximado(valor):
+    """Bytes aproximados de un resultado (GeoDataFrames, bytes, texto o tuplas de ellos): atributos + coordenadas."""
+    if isinstance(valor, (tuple, list)):
+        return sum(_tamano_aproximado(v) for v in valor)
+    if isinstance(valor, (bytes, bytearray, str)):
+        return len(valor)
+    if isinstance(valor, pd.DataFrame):
+        tamano = int(valor.memory_usage(deep=True).sum())
+        for col in valor.columns:
+            if isinstance(valor[col].dtype, gpd.array.GeometryDtype):
+                tamano += int(shapely.get_num_coordinates(valor[col].values).sum()) * 16
+        return tamano
+    return 0
+
+
+class CacheLRU:
+    """Caché LRU acotada por memoria aproximada, segura entre hilos (sesiones de Streamlit).
+
+    Las llaves son hashes de contenido, así que un mismo archivo cargado por distintos usuarios
+    o en distintos reruns reutiliza el mismo resultado. Los valores no se deben modificar.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._datos = OrderedDict()
+        self._bytes = 0
+        self._candado = threading.Lock()
+
+    def obtener(self, clave):
+        with self._candado:
+            if clave not in self._datos:
+                return None
+            self._datos.move_to_end(clave)
+            return self._datos[clave][0]
+
+    def guardar(self, clave, valor):
+        tamano = _tamano_aproximado(valor)
+        if tamano > self.max_bytes:
+            return  # Un resultado más grande que toda la caché no se guarda
+        with self._candado:
+            if clave in self._datos:
+                self._bytes -= self._datos.pop(clave)[1]
+            self._datos[clave] = (valor, tamano)
+            self._bytes += tamano
+            while self._bytes > self.max_bytes:
+                _, (_, tamano_viejo) = self._datos.popitem(last=False)
+                self._bytes -= tamano_viejo
@@ -0,0 +1,87 @@
+# Servidor HTTP local que hace de origen remoto (OneDrive) en las pruebas de descarga.
+
+import os
+import sys
+import threading
+import http.server
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class ManejadorPrueba(http.server.BaseHTTPRequestHandler):
+    """Sirve server.datos con ETag, 304 condicional y Range/If-Range.
+
+    server.fallos es una lista de respuestas forzadas que se consumen en orden, una por
+    petición: un código HTTP (p. ej. 503), "cortar" para cerrar la conexión sin responder o
+    "truncar" para cerrarla a mitad del cuerpo de la respuesta.
+    Las rutas /1drv.ms/... redirigen a /redir?..., como los enlaces cortos de OneDrive.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, codigo, cuerpo=b"", encabezados=None):
+        self.send_response(codigo)
+        for nombre, valor in (encabezados or {}).items():
+            self.send_header(nombre, valor)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_GET(self):
+        servidor = self.server
+        servidor.peticiones.append({"ruta": self.path, **{k.lower(): v for k, v in self.headers.items()}})
+        if servidor.fallos:
+            fallo = servidor.fallos.pop(0)
+            if fallo == "cortar":
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            if fallo == "truncar":
+                self.send_response(200)
+                self.send_header("ETag", servidor.etag)
+                self.send_header("Content-Length", str(len(servidor.datos)))
+                self.end_headers()
+                self.wfile.write(servidor.datos[:len(servidor.datos) // 2])
+                self.wfile.flush()
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            return self._responder(fallo)
+        if self.path.startswith("/1drv.ms/"):
+            return self._responder(302, encabezados={"Location": "/redir?resid=" + self.path.rsplit("/", 1)[-1]})
+
+        etag = servidor.etag
+        if self.headers.get("If-None-Match") == etag:
+            return self._responder(304, encabezados={"ETag": etag})
+        rango = self.headers.get("Range")
+        if rango and self.headers.get("If-Range") == etag:
+            inicio = int(rango.split("=")[1].rstrip("-"))
+            return self._responder(206, servidor.datos[inicio:], {"ETag": etag})
+        return self._responder(200, servidor.datos, {"ETag": etag})
+
+
+@pytest.fixture
+def servidor():
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ManejadorPrueba)
+    srv.datos = os.urandom(300_000)
+    srv.etag = '"v1"'
+    srv.fallos = []
+    srv.peticiones = []
+    srv.url = f"http://127.0.0.1:{srv.server_port}"
+    hilo = threading.Thread(target=srv.serve_forever, daemon=True)
+    hilo.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    import mapanima_datos
+    monkeypatch.setattr(mapanima_datos, "DIR_CACHE", str(tmp_path))
+    return tmp_path
@@ -0,0 +1,64 @@
+import time
+
+import geopandas as gpd
+
+import mapanima_actualizador as ma
+
+
+def _version(huella):
+    gdf = gpd.GeoDataFrame(geometry=[])
+    gdf.attrs["huella"] = huella
+    return gdf
+
+
+def test_revisar_pasa_la_huella_vigente():
+    recibidas = []
+
+    def cargar(huella):
+        recibidas.append(huella)
+        return None if huella == "v1" else _version("v1")
+
+    actualizador = ma.ActualizadorDataset(cargar)
+    assert actualizador.revisar() is True
+    assert actualizador.revisar() is False
+    assert recibidas == [None, "v1"]
+    assert actualizador.vigente().attrs["huella"] == "v1"
+
+
+def test_sin_version_reintenta_pronto(monkeypatch):
+    monkeypatch.setattr(ma, "ESPERA_SIN_VERSION", 0.05)
+    intentos = []
+
+    def cargar(huella):
+        intentos.append(time.monotonic())
+        if len(intentos) < 3:
+            raise ConnectionError("origen caído")
+        return _version("v1")
+
+    actualizador = ma.ActualizadorDataset(cargar, intervalo=3600).iniciar(revisar_ya=True)
+    try:
+        limite = time.monotonic() + 5
+        while actualizador.vigente() is None and time.monotonic() < limite:
+            time.sleep(0.01)
+    finally:
+        actualizador.detener()
+    assert actualizador.vigente() is not None
+    assert len(intentos) == 3
+
+
+def test_preparar_en_fondo_no_bloquea_la_publicacion():
+    import threading
+    hilos = []
+    actualizador = ma.ActualizadorDataset(lambda huella: None, preparar=lambda gdf: hilos.append(threading.current_thread().name))
+    actualizador.publicar(_version("v1"), preparar_en_fondo=True)
+    assert actualizador.vigente().attrs["huella"] == "v1"
+    assert hilos == []
+
+    actualizador.iniciar()
+    try:
+        limite = time.monotonic() + 5
+        while not hilos and time.monotonic() < limite:
+            time.sleep(0.01)
+    finally:
+        actualizador.detener()
+    assert hilos == ["mapanima-actualizador"]
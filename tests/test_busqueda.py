@@ -0,0 +1,51 @@
+import geopandas as gpd
+import pytest
+import shapely
+
+from mapanima_busqueda import IndiceBusqueda
+
+NOMBRES = [
+    "Resguardo Indígena Emberá Chamí de Cristianía",
+    "Resguardo Emberá Katío del Alto Sinú",
+    "Wayuu de la Alta y Media Guajira",
+    "Consejo Comunitario del Río Baudó ACABA",
+    "Resguardo Nasa de Tóez",
+    "Consejo Comunitario Mayor del Alto San Juan",
+    "Resguardo Zenú de San Andrés de Sotavento",
+    "Resguardo Embera Dobida",
+]
+
+
+@pytest.fixture(scope="module")
+def indice():
+    gdf = gpd.GeoDataFrame(
+        {"nom_terr": NOMBRES, "id_rtdaf": [f"RT{i:04d}" for i in range(len(NOMBRES))]},
+        geometry=[shapely.Point(0, 0)] * len(NOMBRES),
+    )
+    return IndiceBusqueda(gdf)
+
+
+def _nombres(indice, consulta):
+    return [NOMBRES[pos] for pos, _, _ in indice.buscar(consulta)]
+
+
+@pytest.mark.parametrize("consulta, esperado", [
+    ("chamii", NOMBRES[0]),   # letra de más
+    ("katoi", NOMBRES[1]),    # letras transpuestas
+    ("guajra", NOMBRES[2]),   # letra de menos
+    ("baudoo", NOMBRES[3]),
+    ("toes", NOMBRES[4]),     # letra cambiada
+    ("embera chamii", NOMBRES[0]),
+])
+def test_error_de_una_letra_encuentra_el_nombre(indice, consulta, esperado):
+    assert _nombres(indice, consulta)[0] == esperado
+
+
+def test_error_de_una_letra_en_palabra_comun_encuentra_todos(indice):
+    assert set(_nombres(indice, "embrea")) == {NOMBRES[0], NOMBRES[1], NOMBRES[7]}
+
+
+def test_coincidencias_directas_antes_que_aproximadas(indice):
+    assert _nombres(indice, "RT0004") == [NOMBRES[4]]
+    assert _nombres(indice, "sinu") == [NOMBRES[1]]
+    assert _nombres(indice, "xyz") == []
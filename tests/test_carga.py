@@ -0,0 +1,50 @@
+import io
+import os
+import struct
+import zipfile
+
+import geopandas as gpd
+import pytest
+import shapely
+
+from mapanima_carga import ArchivoRechazado, leer_capa_usuario
+
+
+def _zip_shapefile(tmp_path, prefijo=""):
+    gdf = gpd.GeoDataFrame({"nombre": ["a", "b"]}, geometry=[shapely.box(0, 0, 1, 1), shapely.box(2, 2, 3, 3)], crs="EPSG:9377")
+    gdf.to_file(tmp_path / "capa.shp")
+    salida = io.BytesIO()
+    with zipfile.ZipFile(salida, "w", zipfile.ZIP_DEFLATED) as z:
+        for nombre in sorted(os.listdir(tmp_path)):
+            z.write(tmp_path / nombre, prefijo + nombre)
+    return salida.getvalue()
+
+
+def _declarar_tamano(datos, nombre, tamano):
+    """Reescribe el tamaño descomprimido declarado de un archivo del ZIP (cabecera local y directorio central)."""
+    datos = bytearray(datos)
+    codificado = nombre.encode()
+    for firma, desplazamiento, inicio_nombre in ((b"PK\x03\x04", 22, 30), (b"PK\x01\x02", 24, 46)):
+        pos = datos.find(firma)
+        while pos != -1:
+            largo = struct.unpack_from("<H", datos, pos + inicio_nombre - (4 if firma == b"PK\x03\x04" else 18))[0]
+            if bytes(datos[pos + inicio_nombre:pos + inicio_nombre + largo]) == codificado:
+                struct.pack_into("<I", datos, pos + desplazamiento, tamano)
+            pos = datos.find(firma, pos + 4)
+    return bytes(datos)
+
+
+@pytest.mark.parametrize("prefijo", ["", "carpeta/"])
+def test_shapefile_en_raiz_o_carpeta(tmp_path, prefijo):
+    gdf = leer_capa_usuario(_zip_shapefile(tmp_path, prefijo), "capa.zip")
+    assert len(gdf) == 2
+    assert gdf.crs.to_epsg() == 9377
+
+
+def test_shapefile_en_raiz_con_tamano_falso_se_rechaza(tmp_path):
+    datos = _declarar_tamano(_zip_shapefile(tmp_path), "capa.shp", 10)
+    with zipfile.ZipFile(io.BytesIO(datos)) as z:
+        assert z.getinfo("capa.shp").file_size == 10
+    # El contenido real no cabe en lo declarado: se rechaza sin que GDAL lea el ZIP original
+    with pytest.raises(ArchivoRechazado):
+        leer_capa_usuario(datos, "capa.zip")
@@ -0,0 +1,85 @@
+# Descarga condicional y reanudable de descargar_zip contra el servidor local de conftest.
+
+import os
+import json
+import hashlib
+
+import mapanima_datos as md
+
+
+def _huella(datos):
+    return "sha256:" + hashlib.sha256(datos).hexdigest()
+
+
+def _rutas(url):
+    base = os.path.join(md.DIR_CACHE, md._hash_corto(url))
+    return base + ".zip", base + ".zip.part", base + ".zip.part.json"
+
+
+def _dejar_parcial(url, datos, etag):
+    _, ruta_part, ruta_meta_part = _rutas(url)
+    with open(ruta_part, "wb") as f:
+        f.write(datos)
+    with open(ruta_meta_part, "w", encoding="utf-8") as f:
+        json.dump({"etag": etag, "last_modified": None}, f)
+
+
+def test_descarga_completa(servidor, cache):
+    url = servidor.url + "/datos.zip"
+    ruta_zip, huella = md.descargar_zip(url)
+    assert huella == _huella(servidor.datos)
+    with open(ruta_zip, "rb") as f:
+        assert f.read() == servidor.datos
+    assert not os.path.exists(_rutas(url)[1])
+
+
+def test_304_si_no_cambio(servidor, cache):
+    url = servidor.url + "/datos.zip"
+    _, huella = md.descargar_zip(url)
+    _, huella_2 = md.descargar_zip(url)
+    assert huella_2 == huella
+    assert servidor.peticiones[-1]["if-none-match"] == servidor.etag
+
+
+def test_descarga_de_nuevo_si_cambio(servidor, cache):
+    url = servidor.url + "/datos.zip"
+    md.descargar_zip(url)
+    servidor.datos, servidor.etag = os.urandom(1000), '"v2"'
+    ruta_zip, huella = md.descargar_zip(url)
+    assert huella == _huella(servidor.datos)
+    with open(ruta_zip, "rb") as f:
+        assert f.read() == servidor.datos
+
+
+def test_reanuda_con_range(servidor, cache):
+    url = servidor.url + "/datos.zip"
+    mitad = len(servidor.datos) // 2
+    _dejar_parcial(url, servidor.datos[:mitad], servidor.etag)
+    ruta_zip, huella = md.descargar_zip(url)
+    assert servidor.peticiones[-1]["range"] == f"bytes={mitad}-"
+    assert servidor.peticiones[-1]["if-range"] == servidor.etag
+    assert huella == _huella(servidor.datos)
+    with open(ruta_zip, "rb") as f:
+        assert f.read() == servidor.datos
+
+
+def test_reanudacion_con_etag_cambiado_descarga_completo(servidor, cache):
+    url = servidor.url + "/datos.zip"
+    # El fragmento local es de una versión anterior: el servidor ignora el Range (200)
+    _dejar_parcial(url, os.urandom(1000), '"v0"')
+    ruta_zip, huella = md.descargar_zip(url)
+    assert servidor.peticiones[-1]["if-range"] == '"v0"'
+    assert huella == _huella(servidor.datos)
+    with open(ruta_zip, "rb") as f:
+        assert f.read() == servidor.datos
+
+
+def test_sin_cambios_no_relee_el_dataset(servidor, cache, monkeypatch):
+    url = servidor.url + "/datos.zip"
+    _, huella = md.descargar_zip(url, clave=url)
+
+    def no_leer(*args):
+        raise AssertionError("no debe leer el caché si la huella no cambió")
+    monkeypatch.setattr(md, "leer_cache", no_leer)
+    assert md.cargar_dataset(url, huella_vigente=huella) is None
+    assert servidor.peticiones[-1].get("if-none-match") == servidor.etag
@@ -0,0 +1,59 @@
+import io
+import os
+import zipfile
+
+import geopandas as gpd
+import shapely
+
+import mapanima_datos as md
+
+
+def _zip_dataset(tmp_path):
+    gdf = gpd.GeoDataFrame(
+        {
+            "id_rtdaf": ["RT0001", "RT0002", "RT0003"], "nom_terr": ["Uno", "Dos", "Tres"], "cn_ci": ["ci", "cn", "ci"],
+            "resolucion": ["R-1", "R-2", "R-3"],  # Atributo que el visor no carga
+        },
+        geometry=[shapely.box(4_800_000 + i * 2000, 2_000_000, 4_801_000 + i * 2000, 2_001_000) for i in range(3)],
+        crs="EPSG:9377",
+    )
+    carpeta = tmp_path / "shp"
+    carpeta.mkdir()
+    gdf.to_file(carpeta / "territorios.shp")
+    salida = io.BytesIO()
+    with zipfile.ZipFile(salida, "w") as z:
+        for nombre in sorted(os.listdir(carpeta)):
+            z.write(carpeta / nombre, nombre)
+    return salida.getvalue()
+
+
+def test_exportacion_conserva_los_atributos_del_origen(servidor, cache, tmp_path):
+    servidor.datos = _zip_dataset(tmp_path)
+    url = servidor.url + "/datos.zip"
+    gdf = md.cargar_dataset(url)
+    assert "resolucion" not in gdf.columns
+
+    atributos = md.leer_atributos_origen(url, gdf.attrs["huella"])
+    assert atributos["resolucion"].tolist() == ["R-1", "R-2", "R-3"]
+    assert md.leer_atributos_origen(url, "sha256:otra") is None
+    # Las filas del caché en disco conservan el índice del origen
+    assert md.leer_ultima_version(url).index.equals(atributos.index)
+
+    seleccion = gdf.iloc[[2, 0]]
+    with zipfile.ZipFile(io.BytesIO(md.exportar_shapefile_zip(seleccion, atributos))) as z:
+        z.extractall(tmp_path / "exportado")
+    exportado = gpd.read_file(tmp_path / "exportado" / "territorios_filtrados.shp")
+    assert exportado["id_rtdaf"].str.upper().tolist() == ["RT0003", "RT0001"]
+    assert exportado["resolucion"].tolist() == ["R-3", "R-1"]
+
+
+def test_derivado_borrado_mientras_se_lee_devuelve_none(cache, monkeypatch):
+    ruta = md._ruta_derivado("http://origen/datos.zip", "sha256:v1", "9377")
+    with open(ruta, "wb") as f:
+        f.write(b"no es parquet")
+
+    def leer_y_borrar(r):
+        os.remove(r)  # Otro hilo borra la versión vieja mientras esta lectura falla
+        raise OSError("archivo desaparecido")
+    monkeypatch.setattr(md.gpd, "read_parquet", leer_y_borrar)
+    assert md.leer_derivado("http://origen/datos.zip", "sha256:v1", "9377") is None
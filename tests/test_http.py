@@ -0,0 +1,91 @@
+# Reintentos de la sesión HTTP y memoria de la resolución de enlaces de OneDrive.
+
+import time
+
+import pytest
+import requests
+
+import mapanima_datos as md
+
+
+@pytest.fixture(autouse=True)
+def sesion(monkeypatch):
+    # Sin espera entre reintentos y sin enlaces memorizados de otras pruebas
+    monkeypatch.setattr(md, "SESION_HTTP", md.crear_sesion_http(espera=0))
+    monkeypatch.setattr(md, "_URLS_DIRECTAS", {})
+
+
+@pytest.mark.parametrize("fallos", [[503, 502], [500, 504, 429]])
+def test_reintenta_respuestas_5xx(servidor, cache, fallos):
+    servidor.fallos = list(fallos)
+    _, huella = md.descargar_zip(servidor.url + "/datos.zip")
+    assert huella.startswith("sha256:")
+    assert len(servidor.peticiones) == len(fallos) + 1
+
+
+def test_reintenta_conexion_cortada(servidor, cache):
+    servidor.fallos = ["cortar", "cortar"]
+    ruta_zip, _ = md.descargar_zip(servidor.url + "/datos.zip")
+    with open(ruta_zip, "rb") as f:
+        assert f.read() == servidor.datos
+    assert len(servidor.peticiones) == 3
+
+
+def test_agota_los_reintentos(servidor, cache):
+    servidor.fallos = [503] * 10
+    with pytest.raises(requests.exceptions.HTTPError):
+        md.descargar_zip(servidor.url + "/datos.zip")
+    assert len(servidor.peticiones) == md.REINTENTOS_HTTP + 1
+
+
+def test_onedrive_memoriza_la_url_directa(servidor):
+    corto = servidor.url + "/1drv.ms/u/abc"
+    directa = md.onedrive_a_directo(corto)
+    assert directa == servidor.url + "/download?resid=abc"
+    assert md.onedrive_a_directo(corto) == directa
+    assert len(servidor.peticiones) == 2  # Redirección y destino, una sola vez
+
+
+def test_onedrive_renueva_al_vencer_el_ttl(servidor):
+    corto = servidor.url + "/1drv.ms/u/abc"
+    directa = md.onedrive_a_directo(corto)
+    md._URLS_DIRECTAS[corto] = (directa, time.monotonic() - md.TTL_URL_DIRECTA - 1)
+    assert md.onedrive_a_directo(corto) == directa
+    assert len(servidor.peticiones) == 4
+    assert md._URLS_DIRECTAS[corto][1] > time.monotonic() - 5
+
+
+def test_onedrive_usa_la_ultima_url_si_falla_la_renovacion(servidor):
+    corto = servidor.url + "/1drv.ms/u/abc"
+    md._URLS_DIRECTAS[corto] = ("http://anterior/download?resid=abc", time.monotonic() - md.TTL_URL_DIRECTA - 1)
+    servidor.fallos = [404]
+    avisos = []
+    assert md.onedrive_a_directo(corto, avisar=lambda nivel, mensaje: avisos.append(nivel)) == "http://anterior/download?resid=abc"
+    assert avisos == ["warning"]
+
+
+def test_conexion_rechazada_no_multiplica_los_reintentos(cache, monkeypatch):
+    # Puerto sin servidor: solo la sesión reintenta la conexión, no también descargar_zip
+    import socket
+    import urllib3.connection
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        puerto = s.getsockname()[1]
+    intentos = []
+    original = urllib3.connection.HTTPConnection._new_conn
+    monkeypatch.setattr(urllib3.connection.HTTPConnection, "_new_conn", lambda self: intentos.append(1) or original(self))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        md.descargar_zip(f"http://127.0.0.1:{puerto}/datos.zip")
+    assert len(intentos) == md.REINTENTOS_HTTP + 1
+
+
+def test_corte_a_mitad_del_cuerpo_se_reanuda(servidor, cache, monkeypatch):
+    monkeypatch.setattr(md, "ESPERA_REINTENTO", 0)
+    servidor.fallos = ["truncar"]
+    ruta_zip, _ = md.descargar_zip(servidor.url + "/datos.zip", tam_bloque=16 * 1024)
+    with open(ruta_zip, "rb") as f:
+        assert f.read() == servidor.datos
+    # Se reanuda desde los bloques completos ya escritos, sin volver a pedir el principio
+    rango = servidor.peticiones[-1]["range"]
+    assert 0 < int(rango.removeprefix("bytes=").rstrip("-")) <= len(servidor.datos) // 2
+    assert len(servidor.peticiones) == 2
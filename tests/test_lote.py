@@ -0,0 +1,53 @@
+import os
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+from mapanima_lote import nombres_salida, procesar_entrada
+from mapanima_traslape import proyectar_dataset, construir_arbol
+
+
+def test_nombres_salida_sin_colisiones():
+    entradas = ["p/a.zip", "p/a.gpkg", "q/a_2.zip", "q/A.kml", "b.geojson"]
+    nombres = nombres_salida(entradas)
+    assert nombres == ["a", "a_2", "a_2_2", "A_3", "b"]
+    assert len({n.lower() for n in nombres}) == len(entradas)
+
+
+def _dataset_total():
+    # Dos territorios de 1 km x 1 km en CTM12, llevados a EPSG:4326 como el dataset del visor
+    gdf = gpd.GeoDataFrame(
+        {
+            "id_rtdaf": ["RT0001", "RT0002"], "nom_terr": ["Uno", "Dos"], "etnia": ["Nasa", "Wayuu"],
+            "departamen": ["Cauca", "La Guajira"], "municipio": ["Toribío", "Uribia"], "cn_ci": ["ci", "ci"],
+            "area_ha": [100.0, 100.0],
+        },
+        geometry=[shapely.box(4_800_000, 2_000_000, 4_801_000, 2_001_000), shapely.box(4_900_000, 2_000_000, 4_901_000, 2_001_000)],
+        crs="EPSG:9377",
+    )
+    return gdf.to_crs(epsg=4326)
+
+
+def test_procesar_entrada(tmp_path):
+    gdf_total = _dataset_total()
+    gdf_total_proj = proyectar_dataset(gdf_total)
+    arbol = construir_arbol(gdf_total_proj)
+
+    # Capa del usuario que cubre la mitad oeste del primer territorio
+    ruta = tmp_path / "proyecto.gpkg"
+    gpd.GeoDataFrame(geometry=[shapely.box(4_799_500, 2_000_000, 4_800_500, 2_001_000)], crs="EPSG:9377").to_file(ruta)
+    salida = tmp_path / "salida"
+    salida.mkdir()
+
+    fila = procesar_entrada(str(ruta), "proyecto", gdf_total, gdf_total_proj, arbol, str(salida), ["csv", "gpkg"], 1)
+    assert fila["estado"] == "ok", fila["detalle"]
+    assert fila["intersecciones"] == 1
+    assert fila["territorios_afectados"] == 1
+    assert abs(fila["area_traslape_ha"] - 50) < 0.5
+    assert sorted(os.listdir(salida)) == ["proyecto_traslape.csv", "proyecto_traslape.gpkg"]
+    assert pd.read_csv(salida / "proyecto_traslape.csv")["nom_terr"].tolist() == ["Uno"]
+
+    lejos = tmp_path / "lejos.gpkg"
+    gpd.GeoDataFrame(geometry=[shapely.box(5_000_000, 2_500_000, 5_000_100, 2_500_100)], crs="EPSG:9377").to_file(lejos)
+    assert procesar_entrada(str(lejos), "lejos", gdf_total, gdf_total_proj, arbol, str(salida), ["csv"], 1)["estado"] == "sin_traslape"
@@ -0,0 +1,95 @@
+import os
+import json
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+pytest.importorskip("mapbox_vector_tile")
+import mapanima_teselas as mt
+
+
+def _dataset(n=120, semilla=0):
+    rng = np.random.default_rng(semilla)
+    x, y = rng.uniform(-78, -67, n), rng.uniform(-4, 12, n)
+    geometrias = [shapely.Point(a, b).buffer(r) for a, b, r in zip(x, y, rng.uniform(0.05, 0.6, n))]
+    return gpd.GeoDataFrame(geometry=geometrias, crs="EPSG:4326")
+
+
+def _teselas(directorio):
+    archivos = {}
+    for raiz, _, nombres in os.walk(directorio):
+        for nombre in nombres:
+            if nombre.endswith(".pbf"):
+                with open(os.path.join(raiz, nombre), "rb") as f:
+                    archivos[os.path.relpath(os.path.join(raiz, nombre), directorio)] = f.read()
+    return archivos
+
+
+@pytest.fixture
+def dir_teselas(tmp_path, monkeypatch):
+    monkeypatch.setattr(mt, "DIR_TESELAS", str(tmp_path / "teselas"))
+    return tmp_path
+
+
+def test_regeneracion_selectiva_igual_a_completa(dir_teselas, monkeypatch):
+    viejo = _dataset()
+    nuevo = viejo.copy()
+    nuevo.loc[5, "geometry"] = nuevo.loc[5, "geometry"].buffer(0.3)    # modificada
+    nuevo = nuevo.drop(index=[17, 40])                                  # eliminadas
+    nuevo = pd.concat([nuevo, gpd.GeoDataFrame(geometry=[shapely.box(-75, 4, -74, 5)], index=[500], crs=nuevo.crs)])  # insertada
+
+    anterior = mt.generar_teselas(viejo, "v1", zoom_max=8)
+    inodos = {ruta: os.stat(os.path.join(anterior, ruta)).st_ino for ruta in _teselas(anterior)}
+    selectiva = mt.generar_teselas(nuevo, "v2", zoom_max=8)
+    with open(os.path.join(selectiva, "completo.json"), encoding="utf-8") as f:
+        assert json.load(f)["base"] == os.path.basename(anterior)
+
+    # La generación anterior se conserva para las páginas que aún la usan
+    assert sorted(os.listdir(mt.DIR_TESELAS)) == sorted([os.path.basename(anterior), os.path.basename(selectiva)])
+    sin_cambios = [ruta for ruta in _teselas(selectiva) if os.stat(os.path.join(selectiva, ruta)).st_ino == inodos.get(ruta)]
+
+    monkeypatch.setattr(mt, "DIR_TESELAS", str(dir_teselas / "completa"))
+    completa = mt.generar_teselas(nuevo, "v2", zoom_max=8)
+    assert _teselas(selectiva) == _teselas(completa)
+    assert 0 < len(sin_cambios) < len(_teselas(completa))
+
+
+def test_misma_version_no_se_regenera(dir_teselas):
+    gdf = _dataset(20)
+    directorio = mt.generar_teselas(gdf, "v1", zoom_max=6)
+    marca = os.path.getmtime(os.path.join(directorio, "completo.json"))
+    assert mt.generar_teselas(gdf, "v1", zoom_max=6) == directorio
+    assert os.path.getmtime(os.path.join(directorio, "completo.json")) == marca
+
+
+def test_tabla_de_propiedades_en_la_seccion_script():
+    # streamlit_folium solo ejecuta la sección script; un <script> en la sección html no corre
+    import folium
+    mapa = folium.Map()
+    tabla = mt.tabla_propiedades([3, 7], ['{"cn_ci":"ci","nom_terr":"a</script>"}', '{"cn_ci":"cn"}'])
+    capa = mt.capa_teselas(mapa, "/app/static/teselas/x", tabla, True, [("nom_terr", "Territorio:")])
+    mapa.get_root().render()
+    script = mapa.get_root().script.render()
+    assert tabla in script
+    assert "<\\/script>" in tabla and "a</script>" not in script
+    assert script.index(tabla) < script.index(capa.get_name() + ".on('click'")
+    assert tabla not in mapa.get_root().html.render()
+
+
+def test_se_conservan_las_ultimas_generaciones(dir_teselas):
+    gdf = _dataset(20)
+    directorios = []
+    for i in range(4):
+        gdf.loc[i, "geometry"] = gdf.loc[i, "geometry"].buffer(0.1)
+        directorios.append(mt.generar_teselas(gdf, f"v{i}", zoom_max=5))
+        os.utime(os.path.join(directorios[-1], "completo.json"), (i, i))  # Orden explícito
+    # Una generación en curso (sin completo.json) no se borra
+    en_curso = os.path.join(mt.DIR_TESELAS, "en_curso")
+    os.makedirs(en_curso)
+    mt.limpiar_teselas()
+    assert sorted(os.listdir(mt.DIR_TESELAS)) == sorted([os.path.basename(d) for d in directorios[-2:]] + ["en_curso"])
+    mt.limpiar_teselas(mantener=0)
+    assert os.listdir(mt.DIR_TESELAS) == ["en_curso"]